@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compare the time taken to check, and reduce, the list of work for 1k to 1M synthetic BRITE-Constellation file names,
+with the Counter/list.remove implementation that preceded the Observation ID index. One Observation in a hundred is
+missing a file.
+
+The legacy implementation is quadratic, so it is only timed up to a limit.
+
+Usage: python benchmarks/bench_grouping.py [legacy limit]
+"""
+
+import logging
+import sys
+import time
+
+from collections import Counter, deque
+from os.path import basename
+
+from caom2pipe.manage_composable import Config
+
+from brite2caom2.data_source import BriteLocalFilesDataSource
+from brite2caom2.storage_name import BriteName
+
+
+EXTENSIONS = ['.avedb', '.freq0db', '.lst', '.md5', '.ndatdb', '.orig', '.rlogdb']
+
+
+def synthetic_work(count):
+    result = deque()
+    for ii in range(count // len(EXTENSIONS)):
+        extensions = EXTENSIONS[:-1] if ii % 100 == 0 else EXTENSIONS
+        result.extend(f'/data/HD{ii}_Season-{ii % 50}_BAb_1_5_A{jj}' for jj in extensions)
+    return result
+
+
+def _obs_id(fqn):
+    return BriteName.remove_extensions(basename(fqn))
+
+
+def legacy(work):
+    temp = [k for k, v in Counter([_obs_id(ii) for ii in work]).items() if v != len(EXTENSIONS)]
+    if len(temp) > 0:
+        for fqn in [ii for ii in work if _obs_id(ii) in temp]:
+            work.remove(fqn)
+    for entry in [ii for ii in work if not BriteName.is_archived(ii)]:
+        work.remove(entry)
+    return work
+
+
+class NullReporter:
+    """Accept the reports for the rejected and the unarchived files, so only the work list handling is timed."""
+
+    def capture_failure(self, *args):
+        pass
+
+    def capture_success(self, *args):
+        pass
+
+
+def get_data_source():
+    config = Config()
+    config.collection = 'BRITE-Constellation'
+    config.data_sources = ['/data']
+    config.data_source_extensions = EXTENSIONS
+    config.cleanup_files_when_storing = False
+    config.store_modified_files_only = False
+    result = BriteLocalFilesDataSource(config, cadc_client=None, metadata_reader=None, recursive=True)
+    result.reporter = NullReporter()
+    return result
+
+
+def indexed(work):
+    data_source = get_data_source()
+    data_source._work = work
+    data_source.group_work_by_obs()
+    data_source.remove_unarchived()
+    return data_source._work
+
+
+def run(legacy_limit):
+    for count in [1000, 10000, 100000, 1000000]:
+        start = time.perf_counter()
+        indexed_result = indexed(synthetic_work(count))
+        indexed_time = time.perf_counter() - start
+        line = f'{count:8d} names: indexed {indexed_time:8.3f}s'
+        if count <= legacy_limit:
+            start = time.perf_counter()
+            legacy_result = legacy(synthetic_work(count))
+            legacy_time = time.perf_counter() - start
+            assert list(legacy_result) == list(indexed_result), 'different work'
+            line = f'{line} legacy {legacy_time:8.3f}s ({legacy_time / indexed_time:.0f}x)'
+        print(line)
+
+
+if __name__ == '__main__':
+    # the data source logs a warning for each file of an incomplete Observation
+    logging.disable(logging.WARNING)
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compare the previews per second rendered by BRITEDecorrelatedPreview with the pylab state machine implementation that
+preceded it, serially, and for the current implementation, from a thread pool. The legacy implementation writes the
+thumbnail in a second pass over the preview file, as caom2pipe does, and the current implementation writes it from the
+same rendering.
+
+Usage: python benchmarks/bench_preview.py [number of decorrelated points] [number of previews] [threads]
+"""
+
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import numpy as np  # noqa: E402
+from matplotlib import image, pylab  # noqa: E402
+
+from brite2caom2.preview_augmentation import render_light_curve  # noqa: E402
+
+
+def synthetic_series(points):
+    rng = np.random.default_rng(42)
+    bjd = np.sort(rng.uniform(1700.0, 1900.0, points))
+    decorrelated = (bjd, rng.normal(4.7, 0.01, points), rng.uniform(0.005, 0.01, points))
+    orbits = max(1, points // 100)
+    average = (bjd[::100][:orbits], rng.normal(4.7, 0.002, orbits), rng.uniform(0.001, 0.002, orbits))
+    return decorrelated, average
+
+
+def legacy_render(preview_fqn, obs_id, instrument_name, decorrelated, average, thumb_fqn):
+    mjd_decorr, mag_decorr, sigma_decorr = decorrelated
+    mjd_ave, mag_ave, sigma_ave = average
+    pylab.plot(mjd_decorr, mag_decorr, 'k.', label=instrument_name)
+    pylab.errorbar(mjd_decorr, mag_decorr, yerr=sigma_decorr, xerr=None, fmt='k.')
+    pylab.plot(mjd_ave, mag_ave, 'co', label='Average/orbit')
+    pylab.errorbar(mjd_ave, mag_ave, yerr=sigma_ave, xerr=None, fmt='c.')
+    pylab.xlabel('Barycentric Julian Date - 2456000.0', color='k')
+    pylab.ylabel('BRITE Magnitude', color='k')
+    pylab.xlim(mjd_decorr.min(), mjd_decorr.max())
+    pylab.ylim(mag_decorr.max() + sigma_decorr.max(), mag_decorr.min() - sigma_decorr.max())
+    pylab.title(obs_id, color='k', fontweight='bold')
+    pylab.legend()
+    pylab.savefig(preview_fqn, format='png')
+    pylab.close()
+    image.thumbnail(preview_fqn, thumb_fqn, scale=0.4)
+
+
+def rate(render, count, tmp_dir, decorrelated, average, threads=1):
+    def _render(index):
+        preview_fqn = join(tmp_dir, f'{index}_prev.jpg')
+        render(preview_fqn, f'HD{index}', 'BRITE-Lem', decorrelated, average, preview_fqn.replace('.jpg', '_256.jpg'))
+
+    start = time.perf_counter()
+    if threads == 1:
+        for ii in range(count):
+            _render(ii)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(_render, range(count)))
+    return count / (time.perf_counter() - start)
+
+
+def run(points, count, threads):
+    decorrelated, average = synthetic_series(points)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f'{points} points, {count} previews')
+        print(f'pylab:              {rate(legacy_render, count, tmp_dir, decorrelated, average):6.2f} previews/s')
+        print(f'template:           {rate(render_light_curve, count, tmp_dir, decorrelated, average):6.2f} previews/s')
+        threaded = rate(render_light_curve, count, tmp_dir, decorrelated, average, threads)
+        print(f'template {threads:2d} threads:  {threaded:6.2f} previews/s')
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+    )
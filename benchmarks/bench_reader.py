@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compare the time taken, and the peak memory allocated, to parse BRITE-Constellation time series files with the
+line-by-line loops that preceded the NumPy-based parsers. The NumPy parsers are measured for content read from a
+text file handle, from a memory-mapped file, and streamed in chunks, as a storage client delivers it.
+
+Usage: python benchmarks/bench_reader.py [number of rows]
+"""
+
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from collections import defaultdict
+from os.path import join
+
+import numpy as np
+
+from brite2caom2 import reader
+
+
+NDATDB_HEADER = """# (1) BJD(TDB) - 2456000.0    : Barycentric Julian Date.
+# (2) BRITEMAG                : decorrelated BRITE magnitude.
+# (3) FLAG                    : unused.
+# (4) SIGMA_BRITEMAG          : magnitude uncertainty.
+"""
+
+
+def write_ndatdb(fqn, rows):
+    rng = np.random.default_rng(42)
+    values = np.column_stack(
+        (
+            np.sort(rng.uniform(1700.0, 1900.0, rows)),
+            rng.normal(4.7, 0.01, rows),
+            np.zeros(rows),
+            rng.uniform(0.005, 0.01, rows),
+        )
+    )
+    with open(fqn, 'w') as f:
+        f.write(NDATDB_HEADER)
+        np.savetxt(f, values, fmt=['%.7f', '%.5f', '%d', '%.5f'])
+
+
+ORIG_HEADER = """# SatellID = BLb                   / satellite ID
+# column1  = HJD                   / heliocentric Julian date
+# column2  = XCEN                  / x centroid
+# column3  = YCEN                  / y centroid
+# column4  = FLUX                  / flux
+# column5  = TEMP                  / CCD temperature
+"""
+
+
+def write_orig(fqn, rows):
+    rng = np.random.default_rng(42)
+    values = np.column_stack(
+        (
+            np.sort(rng.uniform(2457600.0, 2457800.0, rows)),
+            rng.normal(21.3, 0.1, rows),
+            rng.normal(18.1, 0.1, rows),
+            rng.normal(134500.0, 100.0, rows),
+            rng.normal(24.0, 1.0, rows),
+        )
+    )
+    with open(fqn, 'w') as f:
+        f.write(ORIG_HEADER)
+        np.savetxt(f, values, fmt=['%.6f', '%.2f', '%.2f', '%.1f', '%.1f'])
+
+
+def legacy_read_orig_file(brite_fh):
+    data = defaultdict(list)
+    metadata = {}
+    for line in brite_fh:
+        if len(line) == 0:
+            continue
+        if line[0] == '#':
+            ll = line.split('=', 1)
+            if '----------' in ll[0]:
+                continue
+            keyword = ll[0].replace('# ', '').strip()
+            [value, comment] = ll[1].split('/', 1)
+            value = value.strip()
+            metadata[keyword] = value
+            if 'column' in keyword:
+                data[value] = []
+        else:
+            datapoint = line.split()
+            for x in range(0, len(datapoint)):
+                key = 'column' + str(x + 1)
+                data[metadata[key]].append(float(datapoint[x]))
+    return data
+
+
+def legacy_read_bjd_file(brite_fh, keys):
+    default_found = False
+    data = defaultdict(list)
+    for line in brite_fh:
+        if len(line) == 0:
+            continue
+        if line[0] == '#':
+            if '2456000.0' in line:
+                default_found = True
+            continue
+        else:
+            datapoint = line.split()
+            data[keys[0]].append(float(datapoint[0]))
+            data[keys[1]].append(float(datapoint[1]))
+            data[keys[2]].append(float(datapoint[3]))
+    assert default_found
+    return data
+
+
+# the size of the chunks delivered to a StreamBody, as a storage client writes them
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def measure(function, repeat):
+    """
+    :param function: the parse to measure
+    :param repeat: the number of times to time the parse
+    :return: the fastest time, in seconds, and the peak memory allocated by one parse, in bytes
+    """
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def compare(label, fqn, uri, keys, legacy, repeat):
+    metadata_reader = reader.BriteFileMetadataReader()
+
+    def _legacy():
+        with open(fqn) as f:
+            return legacy(f)
+
+    def _current():
+        with open(fqn) as f:
+            metadata_reader._read_file(f, uri)
+        return metadata_reader.time_series[uri]
+
+    def _mmap():
+        metadata_reader._read_local_file(fqn, uri)
+        return metadata_reader.time_series[uri]
+
+    def _stream():
+        body = reader.StreamBody()
+        with open(fqn, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                body.write(chunk)
+        body.finish()
+        metadata_reader._read_content(body.header, body, uri)
+        return metadata_reader.time_series[uri]
+
+    expected = _legacy()
+    cases = {'numpy': _current, 'mmap': _mmap, 'stream': _stream}
+    for name, function in cases.items():
+        actual = function()
+        for key in keys:
+            assert np.array_equal(np.array(expected[key]), actual[key]), f'{name} {key} differs'
+
+    legacy_time, legacy_peak = measure(_legacy, repeat)
+    print(f'{label}: loop {legacy_time:.4f}s, peak {legacy_peak / 1e6:.1f}MB')
+    for name, function in cases.items():
+        seconds, peak = measure(function, repeat)
+        print(
+            f'  {name:<6} {seconds:.4f}s, peak {peak / 1e6:.1f}MB, speed-up {legacy_time / seconds:.1f}x, '
+            f'memory reduction {legacy_peak / peak:.1f}x'
+        )
+
+
+def run(rows, repeat=5):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fqn = join(tmp_dir, 'bench.ndatdb')
+        write_ndatdb(fqn, rows)
+        keys = ['BJD', 'BRITEMAG', 'SIGMA_BRITEMAG']
+        compare(
+            f'.ndatdb {rows} rows',
+            fqn,
+            'cadc:BRITE-Constellation/bench.ndatdb',
+            keys,
+            lambda f: legacy_read_bjd_file(f, keys),
+            repeat,
+        )
+        fqn = join(tmp_dir, 'bench.orig')
+        write_orig(fqn, rows)
+        compare(
+            f'.orig {rows} rows',
+            fqn,
+            'cadc:BRITE-Constellation/bench.orig',
+            ['HJD', 'XCEN', 'YCEN', 'FLUX', 'TEMP'],
+            legacy_read_orig_file,
+            repeat,
+        )
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
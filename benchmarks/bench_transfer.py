@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Compare storing files one at a time, as each is processed, with storing them through the AsyncTransferStage, against a
+local HTTP stand-in for CADC storage that adds a fixed latency to each PUT. As in BriteTodoRunner, the uploads of the
+next 'lookahead' files are started before each file is processed. The stage makes one PUT at a time, so the best it can
+do is to hide the smaller of the PUT latency and the processing time.
+
+Usage: python benchmarks/bench_transfer.py [number of files] [lookahead]
+"""
+
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import basename, join
+from urllib.request import Request, urlopen
+
+from brite2caom2.transfer import AsyncTransferStage
+
+
+LATENCY = 0.05
+PROCESSING = 0.01
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(LATENCY)
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInClient:
+    """Implements the put signature of the caom2pipe StorageClientWrapper, against the stand-in server."""
+
+    def __init__(self, url):
+        self._url = url
+
+    def put(self, working_directory, uri):
+        with open(join(working_directory, basename(uri)), 'rb') as f:
+            content = f.read()
+        with urlopen(Request(f'{self._url}/{basename(uri)}', data=content, method='PUT')) as response:
+            response.read()
+
+
+def serial(client, working_directory, uris):
+    for uri in uris:
+        client.put(working_directory, uri)
+        time.sleep(PROCESSING)
+
+
+def staged(client, working_directory, uris, lookahead):
+    stage = AsyncTransferStage(client, lookahead)
+    try:
+        for index, uri in enumerate(uris):
+            for ahead in uris[index + 1:index + 1 + lookahead]:
+                stage.prefetch(join(working_directory, basename(ahead)), ahead)
+            stage.put(working_directory, uri)
+            time.sleep(PROCESSING)
+    finally:
+        stage.close()
+
+
+def run(count, lookahead):
+    server = ThreadingHTTPServer(('localhost', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = StandInClient(f'http://localhost:{server.server_address[1]}')
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            uris = []
+            for ii in range(count):
+                file_name = f'HD{ii}_A_setup1.avedb'
+                with open(join(tmp_dir, file_name), 'wb') as f:
+                    f.write(b'0' * 65536)
+                uris.append(f'cadc:BRITE-Constellation/{file_name}')
+            start = time.perf_counter()
+            serial(client, tmp_dir, uris)
+            serial_time = time.perf_counter() - start
+            start = time.perf_counter()
+            staged(client, tmp_dir, uris, lookahead)
+            staged_time = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    print(f'{count} files, {LATENCY}s PUT latency, {PROCESSING}s processing per file')
+    print(f'serial:                 {serial_time:.3f}s')
+    print(f'staged lookahead {lookahead:2d}:   {staged_time:.3f}s ({serial_time / staged_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2,
+    )
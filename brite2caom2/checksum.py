@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+
+"""
+MD5 checksums for local files, from the .md5 files delivered with each BRITE-Constellation Observation, and from a
+persistent index of the files that have already been verified against CADC storage, so that deciding whether a local
+file needs to be stored does not require reading the whole file to calculate its checksum.
+"""
+
+import json
+import logging
+import os
+import re
+
+
+__all__ = ['ChecksumIndex', 'normalize_md5', 'read_md5_file']
+
+
+# md5sum output - '<checksum>  <file name>', or '<checksum> *<file name>' for binary mode
+MD5SUM_LINE = re.compile(r'^([0-9a-fA-F]{32})\s+\*?(\S.*)$')
+# BSD md5 output - 'MD5 (<file name>) = <checksum>'
+BSD_MD5_LINE = re.compile(r'^MD5 \((.+)\) = ([0-9a-fA-F]{32})$')
+
+
+def normalize_md5(md5sum):
+    """
+    :param md5sum: str checksum, with or without the 'md5:' prefix that CADC storage uses
+    :return: str lower-case hexadecimal checksum
+    """
+    if md5sum is None:
+        return None
+    return md5sum.replace('md5:', '').strip().lower()
+
+
+def read_md5_file(fqn):
+    """
+    :param fqn: str fully-qualified name of a .md5 file
+    :return: dict of checksums, keyed by file name, without any directory
+    """
+    result = {}
+    with open(fqn) as f:
+        for line in f:
+            line = line.strip()
+            md5sum_match = MD5SUM_LINE.match(line)
+            if md5sum_match is not None:
+                md5, f_name = md5sum_match.groups()
+            else:
+                bsd_match = BSD_MD5_LINE.match(line)
+                if bsd_match is None:
+                    continue
+                f_name, md5 = bsd_match.groups()
+            result[os.path.basename(f_name.strip())] = md5.lower()
+    return result
+
+
+class ChecksumIndex:
+    """
+    The local files whose checksums have been verified against CADC storage, keyed by the fully-qualified file name.
+    An entry is only valid while the size and modification time of the file are the same as when it was verified.
+    """
+
+    def __init__(self, index_fqn=None):
+        """
+        :param index_fqn: str fully-qualified name of the JSON index. If None, the index is kept in memory only.
+        """
+        self._index_fqn = index_fqn
+        self._entries = {}
+        self._modified = False
+        self._logger = logging.getLogger(self.__class__.__name__)
+        if index_fqn is not None and os.path.exists(index_fqn):
+            with open(index_fqn) as f:
+                self._entries = {key: tuple(value) for key, value in json.load(f).items()}
+            self._logger.debug(f'Read {len(self._entries)} checksums from {index_fqn}.')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, fqn, stat_result, md5):
+        """
+        :param fqn: str fully-qualified name of the local file
+        :param stat_result: os.stat_result for the local file
+        :param md5: str checksum
+        """
+        self._entries[fqn] = (stat_result.st_size, stat_result.st_mtime_ns, normalize_md5(md5))
+        self._modified = True
+
+    def get(self, fqn, stat_result):
+        """
+        :return: str checksum of the local file, or None, if the file has not been verified, or it has changed since
+            it was verified
+        """
+        entry = self._entries.get(fqn)
+        if entry is not None and entry[0] == stat_result.st_size and entry[1] == stat_result.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def save(self):
+        """Write the index, if it has changed, and there is somewhere to write it. Replace the file, rather than
+        re-writing it in place, so a failure part-way through leaves the previous index intact."""
+        if self._index_fqn is not None and self._modified:
+            temp_fqn = f'{self._index_fqn}.tmp'
+            with open(temp_fqn, 'w') as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(temp_fqn, self._index_fqn)
+            self._modified = False
@@ -77,17 +77,29 @@ intervals.
 """
 
 import logging
+import multiprocessing
+import os
+import queue
 import sys
+import threading
 import traceback
+import yaml
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from os.path import basename
 
 from caom2pipe.client_composable import ClientCollection
-from caom2pipe.manage_composable import Config, StorageName
+from caom2pipe.manage_composable import Config, ExecutionReporter, StorageName, TaskType
 from caom2pipe.name_builder_composable import EntryBuilder
 from caom2pipe.run_composable import common_runner_init, run_by_state, run_by_todo, TodoRunner
 from caom2pipe.transfer_composable import modify_transfer_factory, store_transfer_factory
 
-from brite2caom2 import data_source, reader, storage_name
+from brite2caom2 import checksum, data_source, reader, resolver, storage_name, transfer
 from brite2caom2 import fits2caom2_augmentation, preview_augmentation
+from brite2caom2.data_source import BriteLocalFilesDataSource
 
 META_VISITORS = [fits2caom2_augmentation, preview_augmentation]
 DATA_VISITORS = []
@@ -99,13 +111,121 @@ How to handle the metadata_reader:
 """
 
 
+# the default bounds for the parsed file content cache
+DEFAULT_CACHE_MAX_OBSERVATIONS = 100
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# the runner and data source in a worker process, set by _init_worker
+_worker_runner = None
+_worker_data_source = None
+
+
+class BriteExecutionReporter(ExecutionReporter):
+    """
+    A failure of an Observation-level unit of work is reported for each file of the Observation, so the failure report
+    and the retry list have all the files, rather than only the .rlogdb file that represents the Observation. The
+    error and retry counts are per file, as the retry list is.
+
+    In a worker process, the successes and failures are recorded, rather than reported, and the parent process
+    reports them with report_recorded, so the summary counts and the progress files are only written by the parent
+    process.
+    """
+
+    # the successes and failures recorded in a worker process, or None, when they are reported as they happen
+    _recorded = None
+
+    def capture_failure(self, storage_name, e, stack):
+        if getattr(storage_name, 'is_observation', False):
+            for source_name in storage_name.source_names:
+                self.capture_failure(storage_name.__class__(source_name), e, stack)
+        elif self._recorded is None:
+            super().capture_failure(storage_name, e, stack)
+        else:
+            # not every exception can be pickled, so keep only its message
+            self._recorded.append(('capture_failure', (storage_name, Exception(str(e)), stack)))
+
+    def capture_success(self, obs_id, file_name, start_time):
+        if self._recorded is None:
+            super().capture_success(obs_id, file_name, start_time)
+        else:
+            self._recorded.append(('capture_success', (obs_id, file_name, start_time)))
+
+    def record(self):
+        """Record the successes and failures from now on, rather than report them."""
+        self._recorded = []
+
+    def take_recorded(self):
+        """
+        :return: list of the successes and failures recorded since the last call, as (method name, arguments) tuples
+        """
+        result = self._recorded
+        self._recorded = []
+        return result
+
+    def report_recorded(self, recorded):
+        """
+        Report the successes and failures recorded by another reporter, e.g. in a worker process.
+
+        :param recorded: list returned by take_recorded
+        """
+        for method_name, args in recorded:
+            getattr(self, method_name)(*args)
+
+
 class BriteTodoRunner(TodoRunner):
     """Specialize the handling of the complete record count, because there are sentinel files that must be present
     before storage/ingestion can take place, although the sentinel files themselves are not archived.
+
+    When workers is greater than 1, the work is sharded by Observation ID across that many forked processes. All the
+    files for an Observation go to the same worker, in their original order, so the .rlogdb file is still the last
+    file processed for its Observation. Each worker builds its own clients and TargetResolver, and records its
+    successes and failures, which the reporter of the parent process then reports. The TargetResolver index is merged
+    on every save, so the names resolved by all the workers are kept.
+
+    When there is a transfer_stage, the uploads for the 'store' task type of the next transfer_stage.lookahead entries
+    are started before each entry is processed, and run in the background of the processing. An entry is only
+    uploaded ahead when it passes the checks that are made before it is stored - a valid name, and not rejected. When
+    an entry is processed without a put for one of its uploads, e.g. it fails before it is stored, the upload is
+    cancelled, or if it had already started, the stored file is reported as a success.
+
+    When the unit of work is an Observation, a failure is reported for every file of the Observation, so the retry
+    list has all the files.
+
+    When stream_queue_size is greater than 0, the local data source is scanned in a producer thread, and each
+    Observation is processed as soon as all of its files have been found, rather than after the whole scan. At most
+    stream_queue_size complete Observations wait in the queue for processing. Streaming work is processed by this
+    process, so workers does not apply to it.
     """
 
-    def __init__(self, config, organizer, builder, source, metadata_reader, observable, reporter):
+    def __init__(
+        self,
+        config,
+        organizer,
+        builder,
+        source,
+        metadata_reader,
+        observable,
+        reporter,
+        workers=1,
+        transfer_stage=None,
+        stream_queue_size=0,
+        clients=None,
+        settings=None,
+    ):
         super().__init__(config, organizer, builder, source, metadata_reader, observable, reporter)
+        if not isinstance(reporter, BriteExecutionReporter):
+            # common_runner_init builds the ExecutionReporter instance that the organizer and the data sources share,
+            # so specialize that instance, rather than replace it, and they all report the failures for each file of
+            # an Observation
+            reporter.__class__ = BriteExecutionReporter
+        self._workers = workers
+        self._transfer_stage = transfer_stage
+        self._rejected = None if observable is None else observable.rejected
+        self._stream_queue_size = stream_queue_size
+        self._clients = clients
+        self._settings = {} if settings is None else settings
+        self._work_queue = None
+        self._producer = None
 
     def _build_todo_list(self, data_source):
         """
@@ -113,6 +233,16 @@ class BriteTodoRunner(TodoRunner):
         files are tracked for failure/success, but are not processed, that requires different handling.
         """
         self._logger.debug(f'Begin _build_todo_list with {data_source.__class__.__name__}.')
+        if self._stream_queue_size > 0 and isinstance(data_source, BriteLocalFilesDataSource):
+            self._todo_list = deque()
+            self._organizer.complete_record_count = 0
+            self._work_queue = queue.Queue(maxsize=self._stream_queue_size)
+            self._producer = threading.Thread(
+                target=data_source.stream_work, args=(self._work_queue,), name='work_producer', daemon=True
+            )
+            self._producer.start()
+            self._logger.debug('End _build_todo_list, with the scan continuing in the work producer.')
+            return
         # the initial directory listing
         data_source.get_work()
         # check to make sure all seven files per Observation are present - files may be moved to failure here, without
@@ -125,24 +255,285 @@ class BriteTodoRunner(TodoRunner):
         data_source.remove_unarchived()
         self._logger.debug('End _build_todo_list.')
 
+    def _run_todo_list(self, data_source, current_count):
+        try:
+            if self._work_queue is not None:
+                return self._run_work_queue(data_source, current_count)
+            if self._workers <= 1 or len(self._todo_list) == 0:
+                return self._process_todo_list(data_source, current_count)
+            return self._run_shards(data_source, current_count)
+        finally:
+            # the transfer stage stays open for all the work of the run, and is closed once
+            self._close_transfer_stage()
+
+    def _run_shards(self, data_source, current_count):
+        shards = BriteTodoRunner._shard_by_obs(self._todo_list, self._workers)
+        self._logger.info(f'Processing {len(self._todo_list)} records with {len(shards)} workers.')
+        self._todo_list.clear()
+        result = 0
+        # fork, so the workers start with the organizer, reporter, and cached content of this process, and build
+        # their own clients in _init_worker
+        with ProcessPoolExecutor(
+            max_workers=len(shards),
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(self, data_source),
+        ) as executor:
+            futures = [executor.submit(_run_shard, shard, current_count) for shard in shards]
+            for future in futures:
+                shard_result, recorded, cache_hits, cache_misses, metrics = future.result()
+                result |= shard_result
+                self._reporter.report_recorded(recorded)
+                self._metadata_reader.add_cache_counts(cache_hits, cache_misses, metrics)
+        return result
+
+    def _run_work_queue(self, data_source, current_count):
+        """
+        The consumer for streaming work discovery. Process the files for each Observation as they come off the work
+        queue, until the producer is done.
+        """
+        result = 0
+        try:
+            while True:
+                files = self._work_queue.get()
+                # the reporting for the files the producer has skipped or rejected
+                data_source.run_deferred()
+                if files is None:
+                    break
+                if isinstance(files, Exception):
+                    raise files
+                self._todo_list = deque(data_source.take_observation(files))
+                # as for the list of work without streaming, count the units of work, and the sentinel files that
+                # take_observation has reported
+                archived = sum(len(ii) if isinstance(ii, tuple) else 1 for ii in self._todo_list)
+                self._organizer.complete_record_count += len(self._todo_list) + len(files) - archived
+                result |= self._process_todo_list(data_source, current_count)
+        finally:
+            # let the producer finish, if processing has failed
+            data_source.stop_streaming()
+            while self._producer.is_alive():
+                try:
+                    self._work_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._producer.join()
+            data_source.run_deferred()
+            self._work_queue = None
+            self._producer = None
+        self._logger.info(f'Processed {self._organizer.complete_record_count} records.')
+        return result
+
+    def _init_worker(self, data_source):
+        """
+        Called once in each worker process, before it processes any work. The copies of the clients that a forked
+        worker starts with share the HTTP sessions of the parent process, which the parent process has already
+        used, so build new clients, and a new TargetResolver, and give them to everything that uses them.
+        """
+        clients = ClientCollection(self._config)
+        data_source.set_client(clients.data_client)
+        if self._transfer_stage is not None:
+            self._transfer_stage = transfer.AsyncTransferStage(clients.data_client, self._transfer_stage.lookahead)
+            clients.data_client = self._transfer_stage
+        if self._clients is not None:
+            # the organizer, and the executors it builds, use the ClientCollection instance of the parent process
+            self._clients.data_client = clients.data_client
+            self._clients.metadata_client = clients.metadata_client
+        # the parent process has already seeded the index from the catalogue
+        self._metadata_reader.target_resolver = _get_target_resolver(self._config, self._settings, seed=False)
+
+    def _run_shard(self, data_source, shard, current_count):
+        """
+        Process one shard of the work, in a worker process.
+
+        :return: the result, the successes and failures for the reporter of the parent process, and the changes to
+            the MetadataReader counts, so the parent process can merge them
+        """
+        self._reporter.record()
+        initial_hits = self._metadata_reader.cache_hits
+        initial_misses = self._metadata_reader.cache_misses
+        initial_metrics = self._metadata_reader.metrics.copy()
+        self._todo_list = deque(shard)
+        try:
+            result = self._process_todo_list(data_source, current_count)
+        finally:
+            # the worker's transfer stage restarts, if the worker is given another shard
+            self._close_transfer_stage()
+        return (
+            result,
+            self._reporter.take_recorded(),
+            self._metadata_reader.cache_hits - initial_hits,
+            self._metadata_reader.cache_misses - initial_misses,
+            self._metadata_reader.metrics - initial_metrics,
+        )
+
+    def _process_todo_list(self, data_source, current_count):
+        return super()._run_todo_list(data_source, current_count)
+
+    def _prefetch_ahead(self):
+        """Start the uploads for the entries after the current one, up to the lookahead of the transfer stage."""
+        if self._transfer_stage is None or TaskType.STORE not in self._config.task_types:
+            return
+        for entry in islice(self._todo_list, self._transfer_stage.lookahead):
+            brite_name = storage_name.BriteName(entry)
+            if brite_name.is_valid() and not (
+                self._rejected is not None and self._rejected.is_bad_metadata(brite_name.obs_id)
+            ):
+                for source_name, uri in zip(brite_name.source_names, brite_name.destination_uris):
+                    self._transfer_stage.prefetch(source_name, uri)
+
+    def _discard_prefetched(self, brite_name):
+        """
+        The uploads for an entry that was processed, and did not put them, are cancelled. An upload that had already
+        started has stored the file, so that is reported.
+        """
+        for source_name, uri in zip(brite_name.source_names, brite_name.destination_uris):
+            if self._transfer_stage.discard(uri):
+                self._logger.warning(f'Stored {uri} ahead of the processing of {brite_name.obs_id}, which did not.')
+                self._reporter.capture_success(
+                    brite_name.obs_id, basename(source_name), datetime.utcnow().timestamp()
+                )
+
+    def _close_transfer_stage(self):
+        if self._transfer_stage is not None:
+            self._transfer_stage.close()
+
+    def _process_entry(self, data_source, entry, current_count):
+        self._prefetch_ahead()
+        try:
+            return super()._process_entry(data_source, entry, current_count)
+        finally:
+            brite_name = storage_name.BriteName(entry)
+            if self._transfer_stage is not None:
+                self._discard_prefetched(brite_name)
+            if brite_name.is_observation or brite_name.is_last_to_ingest:
+                # this is the last file for the Observation, so the cached content for the Observation is no longer
+                # needed, whether or not the processing succeeded
+                self._metadata_reader.release(brite_name.obs_id)
+
+    @staticmethod
+    def _shard_by_obs(todo_list, workers):
+        """
+        :param todo_list: the entries to process - file names, or tuples of file names
+        :param workers: int maximum number of shards
+        :return: list of lists of entries, with all the entries for an Observation in the same list, in their original
+            order
+        """
+        by_obs = {}
+        for entry in todo_list:
+            fqn = entry if isinstance(entry, str) else entry[0]
+            by_obs.setdefault(storage_name.BriteName.remove_extensions(basename(fqn)), []).append(entry)
+        shards = [[] for _ in range(min(workers, len(by_obs)))]
+        # largest Observations first, each to the least-loaded shard
+        for entries in sorted(by_obs.values(), key=len, reverse=True):
+            min(shards, key=len).extend(entries)
+        return shards
+
+    def report(self):
+        super().report()
+        self._logger.info(
+            f'Metadata cache hits: {self._metadata_reader.cache_hits} misses: {self._metadata_reader.cache_misses}'
+        )
+        metrics = self._metadata_reader.metrics
+        self._logger.info(
+            f'Files parsed: {metrics["parse"]} retrieved: {metrics["transfer"]}, for previews parsed: '
+            f'{metrics["preview_parse"]} retrieved: {metrics["preview_transfer"]}'
+        )
+
+
+def _init_worker(runner, data_source):
+    global _worker_runner, _worker_data_source
+    runner._init_worker(data_source)
+    _worker_runner = runner
+    _worker_data_source = data_source
+
+
+def _run_shard(shard, current_count):
+    return _worker_runner._run_shard(_worker_data_source, shard, current_count)
+
+
+def _get_brite_settings(config):
+    """
+    caom2pipe.manage_composable.Config ignores config.yml keys it does not know about, so read the BRITE-specific
+    values here. All of them are optional.
+
+    :return: dict of the config.yml content
+    """
+    result = {}
+    config_fqn = os.path.join(config.working_directory, 'config.yml')
+    if os.path.exists(config_fqn):
+        with open(config_fqn) as f:
+            result = yaml.safe_load(f) or {}
+    return result
+
+
+def _get_target_resolver(config, settings, seed=True):
+    """
+    The target coordinates are kept in the working directory, so they are persisted between pipeline invocations.
+
+    :param seed: bool True if the index should be seeded from the target_catalogue_file_name, when there is one
+    """
+    cache_fqn = settings.get('target_cache_file_name', 'targets.json')
+    if not os.path.isabs(cache_fqn):
+        cache_fqn = os.path.join(config.working_directory, cache_fqn)
+    result = resolver.TargetResolver(cache_fqn, offline=settings.get('target_resolver_offline', False))
+    catalogue_fqn = settings.get('target_catalogue_file_name')
+    if seed and catalogue_fqn is not None:
+        result.seed(catalogue_fqn)
+    return result
+
+
+def _get_checksum_index(config, settings):
+    """
+    The verified checksums are kept in the working directory, so they are persisted between pipeline invocations.
+    """
+    index_fqn = settings.get('checksum_index_file_name', 'checksums.json')
+    if not os.path.isabs(index_fqn):
+        index_fqn = os.path.join(config.working_directory, index_fqn)
+    return checksum.ChecksumIndex(index_fqn)
+
 
 def _common_init():
     config = Config()
     config.get_executors()
+    settings = _get_brite_settings(config)
     builder = EntryBuilder(storage_name.BriteName)
     StorageName.collection = config.collection
     clients = ClientCollection(config)
     sources = []
+    target_resolver = _get_target_resolver(config, settings)
+    # bound the memory used by the parsed file content - only BriteTodoRunner releases an Observation after its last
+    # file, so the bound is what releases the content for run_by_state and run_by_todo
+    max_observations = settings.get('metadata_cache_max_observations', DEFAULT_CACHE_MAX_OBSERVATIONS)
+    max_bytes = settings.get('metadata_cache_max_bytes', DEFAULT_CACHE_MAX_BYTES)
+    release_orig_series = settings.get('release_orig_series', False)
     if config.use_local_files:
-        metadata_reader = reader.BriteFileMetadataReader()
+        metadata_reader = reader.BriteFileMetadataReader(
+            max_observations=max_observations,
+            max_bytes=max_bytes,
+            target_resolver=target_resolver,
+            release_orig_series=release_orig_series,
+        )
         source = data_source.BriteLocalFilesDataSource(
-            config, clients.data_client, metadata_reader, config.recurse_data_sources
+            config,
+            clients.data_client,
+            metadata_reader,
+            config.recurse_data_sources,
+            group_by_obs=settings.get('group_by_observation', False),
+            info_workers=settings.get('storage_info_workers', 8),
+            checksum_index=_get_checksum_index(config, settings),
+            scan_workers=settings.get('scan_workers', 8),
         )
         sources.append(source)
     else:
-        metadata_reader = reader.BriteStorageClientMetadataReader(clients.data_client)
+        metadata_reader = reader.BriteStorageClientMetadataReader(
+            clients.data_client,
+            max_observations=max_observations,
+            max_bytes=max_bytes,
+            target_resolver=target_resolver,
+            release_orig_series=release_orig_series,
+        )
     logging.getLogger('matplotlib').setLevel(logging.ERROR)
-    return config, builder, clients, metadata_reader, sources
+    return config, builder, clients, metadata_reader, sources, settings
 
 
 def _run():
@@ -152,8 +543,14 @@ def _run():
     :return 0 if successful, -1 if there's any sort of failure. Return status
         is used by airflow for task instance management and reporting.
     """
-    config, builder, clients, metadata_reader, sources = _common_init()
+    config, builder, clients, metadata_reader, sources, settings = _common_init()
     if config.use_local_files:
+        transfer_stage = None
+        transfer_lookahead = settings.get('transfer_lookahead', 0)
+        if transfer_lookahead > 0:
+            # the store executor, and the preview visitor, put files through the wrapped client
+            transfer_stage = transfer.AsyncTransferStage(clients.data_client, transfer_lookahead)
+            clients.data_client = transfer_stage
         modify_transfer = modify_transfer_factory(config, clients)
         store_transfer = store_transfer_factory(config, clients)
         (
@@ -180,7 +577,18 @@ def _run():
         )
 
         runner = BriteTodoRunner(
-            config, organizer, name_builder, sources, metadata_reader, observable, reporter
+            config,
+            organizer,
+            name_builder,
+            sources,
+            metadata_reader,
+            observable,
+            reporter,
+            workers=settings.get('ingest_workers', 1),
+            transfer_stage=transfer_stage,
+            stream_queue_size=settings.get('stream_queue_size', 0),
+            clients=clients,
+            settings=settings,
         )
         result = runner.run()
         result |= runner.run_retry()
@@ -213,7 +621,7 @@ def _run_state():
     """Uses a state file with a timestamp to control which entries will be
     processed.
     """
-    config, builder, clients, metadata_reader, sources = _common_init()
+    config, builder, clients, metadata_reader, sources, settings = _common_init()
     return run_by_state(
         config=config,
         name_builder=builder,
@@ -67,15 +67,94 @@
 # ***********************************************************************
 #
 
-from collections import Counter
+import os
+
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from itertools import chain
 from os.path import basename
 
 from caom2pipe.data_source_composable import LocalFilesDataSource
 
+from brite2caom2.checksum import normalize_md5, read_md5_file
 from brite2caom2.storage_name import BriteName
 
 
+__all__ = ['BriteLocalFilesDataSource', 'index_by_obs', 'PrefetchedInfoClient']
+
+
+def index_by_obs(work):
+    """
+    :param work: iterable of str fully-qualified file names
+    :return: dict of lists of the file names, keyed by Observation ID, with the file names in the order of work
+    """
+    result = defaultdict(list)
+    for fqn in work:
+        result[BriteName.remove_extensions(basename(fqn))].append(fqn)
+    return result
+
+
+def _list_directory(directory, extensions):
+    """
+    :param directory: str directory name
+    :param extensions: tuple of str file name extensions
+    :return: list of os.DirEntry for the files with one of the extensions, and list of str sub-directory names
+    """
+    files = []
+    sub_directories = []
+    with os.scandir(directory) as dir_listing:
+        for entry in dir_listing:
+            if entry.is_dir():
+                sub_directories.append(entry.path)
+            elif not entry.name.startswith('.') and entry.name.endswith(extensions):
+                files.append(entry)
+    return files, sub_directories
+
+
+class PrefetchedInfoClient:
+    """
+    Answer the storage info calls for a data source listing from the results of a prefetch, which makes the calls for
+    all the files in the listing concurrently. Each prefetched result is answered once, so later info calls for the
+    same file, e.g. the one that checks the file after it's stored, go to the wrapped client.
+
+    The results are keyed by file name, so they do not depend on how the caller builds the URI.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._results = {}
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def client(self):
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    def info(self, uri):
+        f_name = basename(uri)
+        if f_name in self._results:
+            return self._results.pop(f_name)
+        return self._client.info(uri)
+
+    def prefetch(self, uris, workers):
+        """
+        :param uris: list of str CADC storage URIs
+        :param workers: int number of concurrent info calls
+        """
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='info') as executor:
+            for uri, result in zip(uris, executor.map(self._client.info, uris)):
+                self._results[basename(uri)] = result
+
+    def clear(self):
+        self._results = {}
+
+
 class BriteLocalFilesDataSource(LocalFilesDataSource):
     """
     DB 26-10-22
@@ -86,11 +165,58 @@ class BriteLocalFilesDataSource(LocalFilesDataSource):
 
     This class does the work of making sure this file => Observation organization is in place, as part of finding the
     local work to be done.
+
+    When group_by_obs is True, the five archived files for an Observation become a single entry in the list of work,
+    so they are stored and ingested as one unit of work.
+
+    When only modified files are stored, the CADC storage info for every archived file in the listing is retrieved
+    before the listing is filtered, with info_workers calls in flight at a time, and default_filter answers from
+    those results. The local checksum for the comparison comes from the .md5 file delivered with the Observation,
+    rather than from reading the file. The files found to be the same as in CADC storage are added to the
+    checksum_index, if there is one, and are skipped without a storage check in later listings, for as long as their
+    size and modification time are unchanged.
+
+    The data sources are listed with scan_workers directories listed concurrently, because /data is on a network file
+    system, where the time to list each per-season subdirectory is mostly latency.
+
+    With stream_work, the files for each Observation are handed to the runner as soon as they have all been found,
+    so processing starts before the scan of the data sources is finished. The reporter and the file moves are only
+    used by the consumer thread, so the files that the producer thread skips or rejects are reported, and moved, when
+    the consumer calls run_deferred.
     """
 
-    def __init__(self, config, cadc_client, metadata_reader, recursive):
-        super().__init__(config, cadc_client, metadata_reader, recursive)
+    def __init__(
+        self,
+        config,
+        cadc_client,
+        metadata_reader,
+        recursive,
+        group_by_obs=False,
+        info_workers=8,
+        checksum_index=None,
+        scan_workers=8,
+    ):
+        self._info_client = PrefetchedInfoClient(cadc_client)
+        super().__init__(config, self._info_client, metadata_reader, recursive)
         self._correct_listing_length = 0
+        self._group_by_obs = group_by_obs
+        self._info_workers = info_workers
+        self._listing_directories = config.data_sources
+        self._listing_extensions = tuple(config.data_source_extensions)
+        self._listing_recursive = recursive
+        self._prefetch_info = config.store_modified_files_only
+        self._checksum_index = checksum_index
+        self._sentinel_md5 = {}
+        # Observation ID => the files in the list of work for that Observation, in the order of the list of work
+        self._work_index = None
+        self._scan_workers = scan_workers
+        # data source directory => the files found by the concurrent scan
+        self._scanned = {}
+        # set while stream_work is running
+        self._work_queue = None
+        self._stop_streaming = False
+        # the reporter and file move actions left by the producer thread for the consumer thread
+        self._deferred = deque()
 
     def _verify_file(self, fqn):
         """As of now, there are no checks of file content in addition to what is already done by the MetadataReader
@@ -101,35 +227,248 @@ class BriteLocalFilesDataSource(LocalFilesDataSource):
     def correct_listing_length(self):
         return self._correct_listing_length
 
+    def set_client(self, cadc_client):
+        """
+        Replace the CADC storage client, e.g. with one built in a worker process.
+
+        :param cadc_client: the client for the CADC storage info calls
+        """
+        self._info_client.client = cadc_client
+
+    def get_work(self):
+        self._work_index = defaultdict(list)
+        if self._work_queue is None:
+            self._scanned = {ii: self._scan(ii) for ii in self._listing_directories}
+            self._prepare_filter(chain.from_iterable(self._scanned.values()))
+        try:
+            result = super().get_work()
+            if sum(len(ii) for ii in self._work_index.values()) != len(self._work):
+                # the list of work was not built by _find_work
+                self._work_index = index_by_obs(self._work)
+            return result
+        finally:
+            self._scanned = {}
+            self._info_client.clear()
+            self._sentinel_md5 = {}
+            if self._checksum_index is not None:
+                self._checksum_index.save()
+
+    def _prepare_filter(self, entries):
+        """
+        Read the checksums from the .md5 files, and prefetch the storage info for the archived files, that
+        default_filter will need for the entries.
+
+        :param entries: iterable of os.DirEntry
+        """
+        if self._prefetch_info:
+            archived = []
+            for entry in entries:
+                if BriteName.is_archived(entry.name):
+                    archived.append(entry)
+                elif entry.name.endswith('.md5'):
+                    try:
+                        self._sentinel_md5.update(read_md5_file(entry.path))
+                    except (OSError, UnicodeDecodeError) as e:
+                        self._logger.warning(f'Ignore the checksums in {entry.path}: {e}')
+            # the files that have already been verified need neither a checksum calculation nor a storage check
+            uris = [BriteName(ii.path).destination_uris[0] for ii in archived if not self._is_verified(ii)]
+            self._logger.debug(f'Prefetch the storage info for {len(uris)} files.')
+            self._info_client.prefetch(uris, self._info_workers)
+
+    def _find_work(self, entry_path):
+        """
+        Filter the files found by the concurrent scan of a data source, and add the ones to work with to the list of
+        work, and to the Observation ID index.
+
+        When streaming, the files are filtered one directory listing at a time, as the listings complete, and each
+        Observation is put on the work queue as soon as all of its files have been added to the list of work.
+
+        :param entry_path: str data source directory
+        """
+        if self._work_queue is None:
+            entries = self._scanned.get(entry_path)
+            batches = [self._scan(entry_path) if entries is None else entries]
+        else:
+            batches = self._scan_listings(entry_path)
+        for batch in batches:
+            if self._work_queue is not None:
+                if self._stop_streaming:
+                    break
+                self._prepare_filter(batch)
+            for entry in batch:
+                if self.default_filter(entry):
+                    self._logger.info(f'Adding {entry.path} to work list.')
+                    self._work.append(entry.path)
+                    obs_id = BriteLocalFilesDataSource._get_obs_id_from_fqn(entry.path)
+                    self._work_index[obs_id].append(entry.path)
+                    if self._work_queue is not None and len(self._work_index[obs_id]) == len(self._extensions):
+                        # blocks while the queue is full
+                        self._work_queue.put(list(self._work_index[obs_id]))
+
+    def _scan(self, directory):
+        """
+        :param directory: str data source directory
+        :return: list of os.DirEntry, in path order, so the order of the list of work does not depend on the order
+            the listings complete
+        """
+        result = list(chain.from_iterable(self._scan_listings(directory)))
+        result.sort(key=lambda x: x.path)
+        self._logger.debug(f'Found {len(result)} files in {directory}.')
+        return result
+
+    def _scan_listings(self, directory):
+        """
+        List a data source, with up to scan_workers directory listings in flight at a time. Files without one of the
+        data_source_extensions, and hidden files, are left out during the listing.
+
+        :param directory: str data source directory
+        :return: generator of lists of os.DirEntry, one list per directory, in path order, in the order the listings
+            complete
+        """
+        with ThreadPoolExecutor(max_workers=max(1, self._scan_workers), thread_name_prefix='scan') as executor:
+            pending = {executor.submit(_list_directory, directory, self._listing_extensions)}
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, sub_directories = future.result()
+                    if self._listing_recursive:
+                        pending.update(
+                            executor.submit(_list_directory, ii, self._listing_extensions) for ii in sub_directories
+                        )
+                    yield sorted(files, key=lambda x: x.path)
+
+    def stream_work(self, work_queue):
+        """
+        The producer for streaming work discovery. Runs get_work, putting the files for each complete Observation on
+        work_queue as a list, as soon as they are found. After the scan, the files for the incomplete Observations
+        are rejected, as in group_work_by_obs, then None is put on work_queue. If the scan fails, the exception is
+        put on work_queue instead.
+
+        :param work_queue: queue.Queue, preferably bounded, so the scan does not get too far ahead of the processing
+        """
+        self._work_queue = work_queue
+        self._stop_streaming = False
+        try:
+            self.get_work()
+            self._reject_incomplete()
+            work_queue.put(None)
+        except Exception as e:
+            work_queue.put(e)
+        finally:
+            self._work_queue = None
+
+    def run_deferred(self):
+        """
+        The consumer side of stream_work. Report, and move, the files that the producer has skipped or rejected since
+        the last call.
+        """
+        while len(self._deferred) > 0:
+            function, args = self._deferred.popleft()
+            function(*args)
+
+    def _defer(self, function, *args):
+        """
+        Call function now, unless this is the producer thread of stream_work, in which case leave it for the consumer
+        thread, which is the thread that uses the reporter and moves files.
+        """
+        if self._work_queue is None:
+            function(*args)
+        else:
+            self._deferred.append((function, args))
+
+    def stop_streaming(self):
+        """Ask stream_work to finish without listing, or queueing, any more work."""
+        self._stop_streaming = True
+
+    def take_observation(self, files):
+        """
+        The consumer side of stream_work. Put the files that are not archived for an Observation in the success
+        destination, as remove_unarchived does.
+
+        :param files: list of str fully-qualified file names for one Observation, from the work queue
+        :return: list of the entries to process for the Observation - the archived files, in file name order, or one
+            tuple of them, if group_by_obs is True
+        """
+        archived = sorted(ii for ii in files if not self._clean_up_unarchived(ii))
+        if self._group_by_obs:
+            return [tuple(archived)]
+        return archived
+
+    def _is_verified(self, entry):
+        return self._checksum_index is not None and self._checksum_index.get(entry.path, entry.stat()) is not None
+
+    def _is_modified(self, entry, local_md5):
+        """
+        :param entry: os.DirEntry for an archived file
+        :param local_md5: str checksum of the local file, from the .md5 file for the Observation
+        :return: True if the file is not in CADC storage, or if it is, with a different checksum
+        """
+        file_info = self._info_client.info(BriteName(entry.path).destination_uris[0])
+        if file_info is None or normalize_md5(file_info.md5sum) != local_md5:
+            return True
+        if self._checksum_index is not None:
+            self._checksum_index.add(entry.path, entry.stat(), local_md5)
+        return False
+
+    def _skip_stored(self, entry):
+        # the same file is already in CADC storage
+        self._logger.info(f'Skip {entry.path} because it is already in CADC storage.')
+        if self._cleanup_when_storing:
+            self._move_action(entry.path, self._cleanup_success_directory)
+        self._reporter.capture_success(
+            BriteLocalFilesDataSource._get_obs_id_from_fqn(entry.path),
+            entry.name,
+            datetime.utcnow().timestamp(),
+        )
+
     def group_work_by_obs(self):
         """
         Check that all the files for an Observation are present, otherwise, reject the files for ingestion.
         """
+        self._reject_incomplete()
+        if self._group_by_obs:
+            self._group_archived_files()
+
+    def _reject_incomplete(self):
+        if self._work_index is None:
+            self._work_index = index_by_obs(self._work)
         # need to clean up the file that are not part of a valid observation
-        temp = [
-            k for k, v in Counter(
-                [BriteLocalFilesDataSource._get_obs_id_from_fqn(ii) for ii in self._work]
-            ).items() if v != len(self._extensions)
-        ]
-        if len(temp) > 0:
-            clean_up_files = [
-                ii for ii in self._work if BriteLocalFilesDataSource._get_obs_id_from_fqn(ii) in temp
-            ]
-            for fqn in clean_up_files:
-                # don't use self.clean_up, because it invokes a CADC storage info call, and that check doesn't
-                # matter for this failure case
-                self._logger.warning(
-                    f'Fail {fqn} because not all the file types are present for observation '
-                    f'{BriteLocalFilesDataSource._get_obs_id_from_fqn(fqn)}.'
-                )
-                if self._cleanup_when_storing:
-                    self._move_action(fqn, self._cleanup_failure_directory)
-                temp_storage_name = BriteName(entry=fqn)
-                self._reporter.capture_failure(temp_storage_name, BaseException('manifest errors'), 'manifest errors')
-                self._work.remove(fqn)
+        incomplete = [k for k, v in self._work_index.items() if len(v) != len(self._extensions)]
+        if len(incomplete) > 0:
+            clean_up_files = set()
+            for obs_id in incomplete:
+                for fqn in self._work_index.pop(obs_id):
+                    self._logger.warning(
+                        f'Fail {fqn} because not all the file types are present for observation {obs_id}.'
+                    )
+                    self._defer(self._reject_file, fqn)
+                    clean_up_files.add(fqn)
+            BriteLocalFilesDataSource._remove_in_place(self._work, clean_up_files.__contains__)
+
+    def _reject_file(self, fqn):
+        # don't use self.clean_up, because it invokes a CADC storage info call, and that check doesn't matter for this
+        # failure case
+        if self._cleanup_when_storing:
+            self._move_action(fqn, self._cleanup_failure_directory)
+        temp_storage_name = BriteName(entry=fqn)
+        self._reporter.capture_failure(temp_storage_name, BaseException('manifest errors'), 'manifest errors')
+
+    def _group_archived_files(self):
+        """
+        Replace the archived files for each Observation in the list of work with one tuple of those files, in file
+        name order. The files that are not archived stay in the list of work as individual entries.
+        """
+        grouped = [tuple(sorted(ii for ii in v if BriteName.is_archived(ii))) for v in self._work_index.values()]
+        not_archived = [ii for ii in self._work if not BriteName.is_archived(ii)]
+        self._work = type(self._work)([ii for ii in grouped if len(ii) > 0] + not_archived)
+        self._logger.info(f'Grouped the work into {len(grouped)} Observations.')
 
     def clean_up(self, entry, execution_result, current_count):
-        if BriteName.is_archived(entry):
+        if isinstance(entry, tuple):
+            # all the files for an Observation
+            for fqn in entry:
+                self.clean_up(fqn, execution_result, current_count)
+        elif BriteName.is_archived(entry):
             super().clean_up(entry, execution_result, current_count)
         else:
             # avoid the check for the presence of the file in CADC storage prior to picking a clean up destination.
@@ -144,7 +483,23 @@ class BriteLocalFilesDataSource(LocalFilesDataSource):
 
     def default_filter(self, entry):
         if BriteName.is_archived(entry.path):
-            work_with_file = super().default_filter(entry)
+            local_md5 = None
+            if (
+                self._prefetch_info
+                and entry.name.endswith(self._listing_extensions)
+                and not entry.name.startswith('.')
+            ):
+                if self._is_verified(entry):
+                    self._defer(self._skip_stored, entry)
+                    return False
+                local_md5 = self._sentinel_md5.get(entry.name)
+            if local_md5 is None:
+                work_with_file = super().default_filter(entry)
+            else:
+                # use the delivered checksum, instead of calculating it
+                work_with_file = self._is_modified(entry, local_md5)
+                if not work_with_file:
+                    self._defer(self._skip_stored, entry)
         else:
             # avoid the check for the presence of the file in CADC storage, since it will never be in CADC storage.
             work_with_file = True
@@ -152,19 +507,35 @@ class BriteLocalFilesDataSource(LocalFilesDataSource):
 
     def remove_unarchived(self):
         # remove the files that are not archived from the list of work, and put them in the success destination
-        remove_these = []
-        for entry in self._work:
-            if not BriteName.is_archived(entry):
-                if self._cleanup_when_storing:
-                    self._move_action(entry, self._cleanup_success_directory)
-                remove_these.append(entry)
-                self._reporter.capture_success(
-                    BriteLocalFilesDataSource._get_obs_id_from_fqn(entry),
-                    basename(entry),
-                    datetime.utcnow().timestamp(),
-                )
-        for entry in remove_these:
-            self._work.remove(entry)
+        BriteLocalFilesDataSource._remove_in_place(self._work, self._clean_up_unarchived)
+
+    def _clean_up_unarchived(self, entry):
+        """
+        :return: True if entry is a file that is not archived, after putting it in the success destination
+        """
+        if isinstance(entry, str) and not BriteName.is_archived(entry):
+            if self._cleanup_when_storing:
+                self._move_action(entry, self._cleanup_success_directory)
+            self._reporter.capture_success(
+                BriteLocalFilesDataSource._get_obs_id_from_fqn(entry),
+                basename(entry),
+                datetime.utcnow().timestamp(),
+            )
+            return True
+        return False
+
+    @staticmethod
+    def _remove_in_place(work, remove_this):
+        """
+        Remove entries from the list of work in one pass, rather than one list.remove/deque.remove per entry. The
+        same list object is kept, because the TodoRunner holds a reference to it.
+
+        :param work: list or deque of entries
+        :param remove_this: function that returns True for an entry that should be removed
+        """
+        kept = [ii for ii in work if not remove_this(ii)]
+        work.clear()
+        work.extend(kept)
 
     @staticmethod
     def _get_obs_id_from_fqn(fqn):
@@ -67,51 +67,37 @@
 #
 
 
-from caom2 import Part
 from caom2utils import caom2blueprint
 from caom2pipe import caom_composable as cc
 from brite2caom2 import main_app
+from brite2caom2.storage_name import BriteName
 
 
 __all__ = ['BriteFits2caom2Visitor']
 
 
-class DatParser(caom2blueprint.FitsParser):
-    """
-    Extend from FitsParser so that, with a properly configured blueprint,
-    from BriteUndecorrelatedMapping, the behaviour of the method apply_blueprint will build
-    up a valid FITS header.
-    """
-
-    def __init__(self, headers, blueprint, uri):
-        super().__init__(headers, blueprint, uri)
-
-    @property
-    def headers(self):
-        return self._headers
-
-    def ignore_chunks(self, artifact, index):
-        if str(index) not in artifact.parts.keys():
-            artifact.parts.add(Part(str(index)))
-            self.logger.debug(f'Part created for HDU {index}.')
-        self._wcs_parser = caom2blueprint.FitsWcsParser(
-            self.headers[index], self.uri, index
-        )
-        # Rely on the blueprint content to fill the WCS values, so there
-        # is always chunk information.
-        # This decision is why naxis values always need defining in the blueprint mappings.
-        return False
-
-
 class BriteFits2caom2Visitor(cc.Fits2caom2Visitor):
     def __init__(self, observation, **kwargs):
         super().__init__(observation, **kwargs)
 
+    def visit(self):
+        if not self._storage_name.is_observation:
+            return super().visit()
+        # all the files for an Observation are one unit of work, so apply the mapping for each file in turn, to the
+        # same Observation
+        observation_storage_name = self._storage_name
+        try:
+            for source_name in observation_storage_name.source_names:
+                self._storage_name = BriteName(source_name)
+                self._observation = super().visit()
+        finally:
+            self._storage_name = observation_storage_name
+        return self._observation
+
     def _get_parser(self, headers, blueprint, uri):
-        if self._storage_name.has_undecorrelated_metadata or self._storage_name.has_decorrelated_metadata:
-            return DatParser(headers, blueprint, uri)
-        else:
-            return caom2blueprint.BlueprintParser(blueprint, uri)
+        # there are no FITS headers to emulate - the blueprint provides the Observation, Plane and Artifact metadata,
+        # and the mapping builds the Chunk directly, in _update_artifact
+        return caom2blueprint.BlueprintParser(blueprint, uri)
 
     def _get_mapping(self, headers):
         return main_app.mapping_factory(
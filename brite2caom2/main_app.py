@@ -71,12 +71,17 @@ This module implements the ObsBlueprint mapping, as well as the workflow
 entry point that executes the workflow.
 """
 
-from astropy.coordinates import SkyCoord
-from caom2 import DataProductType, CalibrationLevel, ProductType, ReleaseType
+import hashlib
+
+from caom2 import Axis, Chunk, Coord2D, CoordAxis1D, CoordAxis2D, CoordFunction2D, CoordRange1D, Dimension2D
+from caom2 import DataProductType, CalibrationLevel, Part, ProductType, RefCoord, ReleaseType, SpatialWCS
+from caom2 import SpectralWCS, TemporalWCS
 from caom2pipe import caom_composable as cc
-from caom2pipe.manage_composable import CadcException, to_float
+from caom2pipe.manage_composable import CadcException
 from caom2utils.caom2blueprint import update_artifact_meta
+from collections.abc import Mapping, MutableSequence
 from datetime import datetime
+from enum import Enum
 
 from brite2caom2.storage_name import get_entry, BriteName
 
@@ -84,6 +89,54 @@ from brite2caom2.storage_name import get_entry, BriteName
 __all__ = ['mapping_factory']
 
 
+# DB 26-10-22
+# remove the 'BRITE-' from the bandpass name
+# filter ID from SatellID: bandpass name, lower and upper wavelengths in microns
+BANDPASSES = {
+    'b': ('Blue', 0.39, 0.46),
+    'r': ('Red', 0.54, 0.70),
+}
+
+
+# the archived files for an Observation - .orig, .ndatdb, .avedb, .rlogdb, .freq0db
+OBSERVATION_ARTIFACT_COUNT = 5
+
+# the attributes of CAOM entities that identify an instance, rather than describe its content
+IDENTITY_ATTRIBUTES = ('_id', '_last_modified', '_max_last_modified', '_meta_checksum', '_acc_meta_checksum')
+
+
+def content_hash(entity):
+    """
+    :param entity: CAOM entity, e.g. a Part
+    :return: str md5 of the content of the entity and its children, which is the same for an entity and its copy,
+        since the ids and checksums are left out
+    """
+    md5 = hashlib.md5()
+    _update_content_hash(md5, entity)
+    return md5.hexdigest()
+
+
+def _update_content_hash(md5, value):
+    if isinstance(value, Mapping):
+        for key, item in value.items():
+            md5.update(f'{key}:'.encode())
+            _update_content_hash(md5, item)
+    elif isinstance(value, (MutableSequence, list, tuple)):
+        md5.update(b'[')
+        for item in value:
+            _update_content_hash(md5, item)
+        md5.update(b']')
+    elif hasattr(value, '__dict__') and not isinstance(value, Enum):
+        md5.update(f'{type(value).__name__}('.encode())
+        for key, item in sorted(vars(value).items()):
+            if key not in IDENTITY_ATTRIBUTES and key != '_oktypes':
+                md5.update(f'{key}='.encode())
+                _update_content_hash(md5, item)
+        md5.update(b')')
+    else:
+        md5.update(f'{value!r};'.encode())
+
+
 class BriteMapping(cc.TelescopeMapping):
     """
     The mapping for the files with no metadata.
@@ -135,7 +188,9 @@ class BriteMapping(cc.TelescopeMapping):
         :param file_info: FileInfo instance
         """
         super().update(file_info)
-        self._update_copy_metadata()
+        if self._storage_name.is_last_to_ingest:
+            # the copies are made once per plane, when its last file is processed
+            self._update_copy_metadata()
         self._logger.debug('End update')
         return self._observation
 
@@ -144,23 +199,34 @@ class BriteMapping(cc.TelescopeMapping):
 
     def _update_copy_metadata(self):
         """
-        Copy the artifact metadata for the .natdb artifact to the other artifacts.
-        Skip the .orig artifact, which has its own metadata.
+        Copy the artifact metadata for the .ndatdb artifact to the other artifacts, once the plane has all of its
+        artifacts. This is called for the .rlogdb file, which is the last file of the plane to be processed. Skip the
+        .orig artifact, which has its own metadata, and the preview artifacts. A Part that is already the same as its
+        .ndatdb counterpart is left alone, so re-ingesting the files of an Observation does not repeat the copies.
         """
         plane = self._observation.planes['timeseries']
         dat_artifact_key = self._storage_name.file_uri.split('.')[0] + '.ndatdb'
         # account for preview and thumbnail artifacts
-        if dat_artifact_key in plane.artifacts.keys() and len(plane.artifacts.values()) >= 5:
-            dat_artifact = plane.artifacts[dat_artifact_key]
-            for artifact in plane.artifacts.values():
-                if '.jpg' in artifact.uri or '.natdb' in artifact.uri or '.orig' in artifact.uri:
+        archived = [ii for ii in plane.artifacts.keys() if not ii.endswith('.jpg')]
+        if dat_artifact_key not in plane.artifacts.keys() or len(archived) < OBSERVATION_ARTIFACT_COUNT:
+            return
+        dat_artifact = plane.artifacts[dat_artifact_key]
+        dat_parts = [(dat_part, content_hash(dat_part)) for dat_part in dat_artifact.parts.values()]
+        copied = 0
+        for artifact in plane.artifacts.values():
+            if artifact is dat_artifact or '.jpg' in artifact.uri or '.orig' in artifact.uri:
+                continue
+            for dat_part, dat_hash in dat_parts:
+                part = artifact.parts.get(dat_part.name)
+                if part is not None and content_hash(part) == dat_hash:
                     continue
-                for dat_part in dat_artifact.parts.values():
-                    part_copy = cc.copy_part(dat_part)
-                    artifact.parts.add(part_copy)
-                    for dat_chunk in dat_part.chunks:
-                        chunk_copy = cc.copy_chunk(dat_chunk)
-                        part_copy.chunks.append(chunk_copy)
+                part_copy = cc.copy_part(dat_part)
+                artifact.parts.add(part_copy)
+                for dat_chunk in dat_part.chunks:
+                    chunk_copy = cc.copy_chunk(dat_chunk)
+                    part_copy.chunks.append(chunk_copy)
+                copied += 1
+        self._logger.debug(f'Copied {copied} parts from {dat_artifact_key}.')
 
 
 class BriteUndecorrelatedMapping(BriteMapping):
@@ -179,115 +245,111 @@ class BriteUndecorrelatedMapping(BriteMapping):
         super().accumulate_blueprint(bp)
 
         # mapping by @dbohlender
-        object_metadata = self._md_ptr.get('StarInFo').split(',')
-        target_name = object_metadata[0]
-        bp.set('Observation.target.name', target_name)
+        bp.set('Observation.target.name', self._md_ptr.target_name)
         bp.set('Observation.target.standard', False)
-        bp.set('Observation.telescope.name', self._md_ptr.get('SatfulID'))
-        bp.set('Observation.instrument.name', self._md_ptr.get('SatfulID'))
-
-        bp.set('Plane.provenance.name', self._md_ptr.get('RedMetho'))
-        bp.set('Plane.provenance.producer', self._md_ptr.get('RedProID'))
-        bp.set('Plane.provenance.version', self._md_ptr.get('RedVersi'))
-        bp.set('Plane.provenance.runID', self._md_ptr.get('ReleaseV'))
-
-        bp.configure_position_axes((1, 2))
-        # this is here to fake out the Blueprint
-        bp.set('Chunk.naxis', 4)
-        # spatial WCS, assuming 5" x 5" aperture
-        object_coords = SkyCoord.from_name(target_name)
-        bp.set('Chunk.position.axis.axis1.ctype', 'RA---TAN')
-        bp.set('Chunk.position.axis.axis1.cunit', 'deg')
-        bp.set('Chunk.position.axis.axis2.ctype', 'DEC--TAN')
-        bp.set('Chunk.position.axis.axis2.cunit', 'deg')
+        bp.set('Observation.telescope.name', self._md_ptr.satellite_name)
+        bp.set('Observation.instrument.name', self._md_ptr.satellite_name)
 
+        bp.set('Plane.provenance.name', self._md_ptr.reduction_method)
+        bp.set('Plane.provenance.producer', self._md_ptr.reduction_producer)
+        bp.set('Plane.provenance.version', self._md_ptr.reduction_version)
+        bp.set('Plane.provenance.runID', self._md_ptr.release_version)
+        self._logger.debug('Done accumulate_blueprint.')
+
+    def _get_time_axis_range_end_val(self, ext):
+        time_max = self._metadata_reader.summaries[self._storage_name.file_uri].time_max
+        return None if time_max is None else time_max - 2400000.5
+
+    def _get_time_axis_range_start_val(self, ext):
+        time_min = self._metadata_reader.summaries[self._storage_name.file_uri].time_min
+        return None if time_min is None else time_min - 2400000.5
+
+    def _update_artifact(self, artifact):
+        if artifact.uri != self._storage_name.file_uri:
+            return
+        self._logger.debug(f'Begin _update_artifact for {artifact.uri}')
+        if '0' not in artifact.parts.keys():
+            artifact.parts.add(Part('0'))
+        part = artifact.parts['0']
+        if len(part.chunks) == 0:
+            part.chunks.append(Chunk())
+        chunk = part.chunks[0]
+        chunk.meta_producer = artifact.meta_producer
+        # no cutouts, and using range for BRITE-Constellation, so the WCS is built directly, without the FITS
+        # WCS machinery of the blueprint
+        chunk.position = self._build_position()
+        chunk.energy = self._build_energy()
+        chunk.time = self._build_time()
+        self._logger.debug('End _update_artifact')
+
+    def _build_position(self):
+        """
+        :return: SpatialWCS, assuming 5" x 5" aperture
+        """
+        # mapping by @dbohlender
+        # use the coordinates from the header when they're present, and resolve the name only when they're not
+        coordinates = self._md_ptr.coordinates
+        if coordinates is None:
+            coordinates = self._metadata_reader.target_resolver.resolve(self._md_ptr.target_name)
+        ra, dec = coordinates
+        axis = CoordAxis2D(axis1=Axis('RA---TAN', 'deg'), axis2=Axis('DEC--TAN', 'deg'))
         # plate scale (arcsec/pixel)
-        plate_scale = to_float(self._md_ptr.get('InstPScl'))
+        plate_scale = self._md_ptr.plate_scale
         # aperture for photometry
         # DB 26-10-22
         # set the aperture size to 5.0 by default
         # DB 04-11-22
         # FOV is about 5' x 5'
         aperture_size = 5.0
-        if plate_scale is not None:
-            temp = plate_scale * aperture_size / 3600.0
-            bp.set('Chunk.position.axis.function.cd11', temp)
-            bp.set('Chunk.position.axis.function.cd12', 0.0)
-            bp.set('Chunk.position.axis.function.cd21', 0.0)
-            bp.set('Chunk.position.axis.function.cd22', temp)
-
-        bp.set('Chunk.position.axis.function.dimension.naxis1', 1)
-        bp.set('Chunk.position.axis.function.dimension.naxis2', 1)
-        bp.set('Chunk.position.axis.function.refCoord.coord1.pix', 1.0)
-        bp.set('Chunk.position.axis.function.refCoord.coord1.val', object_coords.ra.degree)
-        bp.set('Chunk.position.axis.function.refCoord.coord2.pix', 1.0)
-        bp.set('Chunk.position.axis.function.refCoord.coord2.val', object_coords.dec.degree)
-
-        bp.configure_energy_axis(3)
-        # DB - original script - units are microns
-        # CAOM2 blueprint does 'm'
-        # DB 26-10-22
-        # remove the 'BRITE-' from the bandpass name
-        if self._md_ptr.get('SatellID')[-1] == 'b':
-            bandpass_name = 'Blue'
-            lower_wl = 0.39
-            upper_wl = 0.46
-        elif self._md_ptr.get('SatellID')[-1] == 'r':
-            bandpass_name = 'Red'
-            lower_wl = 0.54
-            upper_wl = 0.70
+        if plate_scale is None:
+            # CoordFunction2D requires the cd values, so use the ones a FITS WCS has when there are no CDi_j or
+            # CDELTi keywords - CDELTi of 1.0 with the identity PC matrix - as the blueprint did
+            self._logger.warning(f'No InstPScl for {self._storage_name.file_uri}. Using the default cd values.')
+            cd_diagonal = 1.0
         else:
-            raise CadcException(f'Unknown filter value ' f'{self._md_ptr.get("SatellID")[-1]}')
-        bp.set('Chunk.energy.specsys', 'TOPOCENT')
-        bp.set('Chunk.energy.bandpassName', bandpass_name)
-        bp.set('Chunk.energy.resolvingPower', (lower_wl + upper_wl) / (2.0 * (upper_wl - lower_wl)))
-        bp.set('Chunk.energy.axis.axis.ctype', 'WAVE')
-        bp.set('Chunk.energy.axis.axis.cunit', 'm')
-        bp.set('Chunk.energy.axis.range.start.pix', 0.5)
-        bp.set('Chunk.energy.axis.range.start.val', lower_wl * 10e-7)
-        bp.set('Chunk.energy.axis.range.end.pix', 1.5)
-        bp.set('Chunk.energy.axis.range.end.val', upper_wl * 10e-7)
-        # this is to avoid a FITS ValueError _only_
-        bp.set('Chunk.energy.axis.function.naxis', 1)
-
-        bp.configure_time_axis(4)
-        bp.set('Chunk.time.exposure', float(self._md_ptr.get('ObsExpoT')) / 1000.0)  # seconds
-        bp.set('Chunk.time.axis.axis.ctype', 'TIME')
-        bp.set('Chunk.time.axis.axis.cunit', 'd')
-        bp.set('Chunk.time.axis.range.start.pix', 0.5)
-        bp.set('Chunk.time.axis.range.start.val', '_get_time_axis_range_start_val()')
-        bp.set('Chunk.time.axis.range.end.pix', 1.5)
-        bp.set('Chunk.time.axis.range.end.val', '_get_time_axis_range_end_val()')
-        # this is to avoid a FITS ValueError _only_
-        bp.set('Chunk.time.axis.function.naxis', 1)
-        self._logger.debug('Done accumulate_blueprint.')
-
-    def _get_time_axis_range_end_val(self, ext):
-        return to_float(self._metadata_reader.time_series.get(self._storage_name.file_uri).get('HJD')[-1]) - 2400000.5
+            cd_diagonal = plate_scale * aperture_size / 3600.0
+        axis.function = CoordFunction2D(
+            dimension=Dimension2D(1, 1),
+            ref_coord=Coord2D(RefCoord(1.0, ra), RefCoord(1.0, dec)),
+            cd11=cd_diagonal,
+            cd12=0.0,
+            cd21=0.0,
+            cd22=cd_diagonal,
+        )
+        return SpatialWCS(axis, coordsys='ICRS')
 
-    def _get_time_axis_range_start_val(self, ext):
-        return to_float(self._metadata_reader.time_series.get(self._storage_name.file_uri).get('HJD')[0]) - 2400000.5
+    def _build_energy(self):
+        """
+        :return: SpectralWCS for the filter identified by SatellID
+        """
+        if self._md_ptr.filter_id not in BANDPASSES:
+            raise CadcException(f'Unknown filter value {self._md_ptr.filter_id}')
+        bandpass_name, lower_wl, upper_wl = BANDPASSES[self._md_ptr.filter_id]
+        # DB - original script - units are microns
+        # CAOM2 does 'm'
+        axis = CoordAxis1D(
+            axis=Axis('WAVE', 'm'),
+            range=CoordRange1D(RefCoord(0.5, lower_wl * 10e-7), RefCoord(1.5, upper_wl * 10e-7)),
+        )
+        return SpectralWCS(
+            axis,
+            specsys='TOPOCENT',
+            bandpass_name=bandpass_name,
+            resolving_power=(lower_wl + upper_wl) / (2.0 * (upper_wl - lower_wl)),
+        )
 
-    def _update_artifact(self, artifact):
-        self._logger.debug(f'Begin _update_artifact for {artifact.uri}')
-        for part in artifact.parts.values():
-            for chunk in part.chunks:
-                # no cutouts
-                chunk.naxis = None
-                chunk.position_axis_1 = None
-                chunk.position_axis_2 = None
-                chunk.energy_axis = None
-                chunk.time_axis = None
-                # using range for BRITE-Constellation
-                if chunk.time is not None and chunk.time.axis is not None and chunk.time.axis.function is not None:
-                    chunk.time.axis.function = None
-                if (
-                    chunk.energy is not None
-                    and chunk.energy.axis is not None
-                    and chunk.energy.axis.function is not None
-                ):
-                    chunk.energy.axis.function = None
-        self._logger.debug('End _update_artifact')
+    def _build_time(self):
+        """
+        :return: TemporalWCS, with the time range of the file's time series
+        """
+        axis = CoordAxis1D(
+            axis=Axis('TIME', 'd'),
+            range=CoordRange1D(
+                RefCoord(0.5, self._get_time_axis_range_start_val(0)),
+                RefCoord(1.5, self._get_time_axis_range_end_val(0)),
+            ),
+        )
+        return TemporalWCS(axis, timesys='UTC', exposure=self._md_ptr.exposure_time)  # exposure in seconds
 
 
 class BriteDecorrelatedMapping(BriteUndecorrelatedMapping):
@@ -304,14 +366,12 @@ class BriteDecorrelatedMapping(BriteUndecorrelatedMapping):
         self._md_ptr = self._metadata_reader.metadata[orig_uri]
 
     def _get_time_axis_range_end_val(self, ext):
-        return to_float(
-            self._metadata_reader.time_series.get(self._storage_name.file_uri).get('BJD')[-1] + 2456000.0 - 2400000.5
-        )
+        time_max = self._metadata_reader.summaries[self._storage_name.file_uri].time_max
+        return None if time_max is None else time_max + 2456000.0 - 2400000.5
 
     def _get_time_axis_range_start_val(self, ext):
-        return to_float(
-            self._metadata_reader.time_series.get(self._storage_name.file_uri).get('BJD')[0] + 2456000.0 - 2400000.5
-        )
+        time_min = self._metadata_reader.summaries[self._storage_name.file_uri].time_min
+        return None if time_min is None else time_min + 2456000.0 - 2400000.5
 
 
 def mapping_factory(storage_name, metadata_reader, clients, observable, observation, config, logger):
@@ -69,51 +69,210 @@
 
 """
 Plotting routines to be adapted for previews and thumbnails from  @dbohlender.
+
+The plots are rendered with an explicit Figure and Agg canvas, rather than the pylab state machine, so there is no
+global state, and previews may be generated concurrently from threads. Each thread keeps one pre-configured figure,
+and only the plotted data, limits, title and legend label change from one preview to the next.
 """
 
 import numpy as np
-from matplotlib import pylab
+import os
+import threading
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
 
 from caom2pipe import manage_composable as mc
+from brite2caom2.reader import summarize
 from brite2caom2.storage_name import get_entry
 
 
+__all__ = ['BRITEDecorrelatedPreview', 'decimate_light_curve', 'LightCurveTemplate', 'render_light_curve', 'visit']
+
+
+THUMBNAIL_WIDTH = 256
+# decorrelated series longer than this are reduced to what can be seen at the preview resolution, before drawing
+DECIMATE_ABOVE = 10000
+
+_templates = threading.local()
+
+
+def decimate_light_curve(x, y, y_error, columns):
+    """
+    Reduce a light curve to what can be seen when it is drawn into a number of pixel columns: the points with the
+    smallest and the largest magnitude in each column, and one error bar per column, that spans the error bars of all
+    the points in the column.
+
+    :param x: np.array of times
+    :param y: np.array of magnitudes
+    :param y_error: np.array of magnitude uncertainties
+    :param columns: int number of pixel columns between x.min() and x.max()
+    :return: tuple of np.arrays - the times and magnitudes of the points to draw, as the smallest and largest
+        magnitude for each column in turn, with NaNs between columns that are not adjacent, so that a line through
+        the points fills each column from the smallest to the largest magnitude, but does not cross gaps in the
+        light curve, and the times, lower, and upper limits, of the error bars to draw
+    """
+    x_min = x.min()
+    x_range = x.max() - x_min
+    if x_range > 0:
+        column = np.minimum((x - x_min) * (columns / x_range), columns - 1).astype(np.intp)
+    else:
+        column = np.zeros(x.shape, dtype=np.intp)
+    # sorted by column, and by magnitude within a column
+    order = np.lexsort((y, column))
+    column_sorted = column[order]
+    starts = np.flatnonzero(np.diff(column_sorted, prepend=-1))
+    ends = np.append(starts[1:], len(order)) - 1
+    occupied = column_sorted[starts]
+
+    # smallest and largest magnitude per column, and a break before each column that does not follow its neighbour
+    breaks = np.diff(occupied, prepend=occupied[0]) > 1
+    points_x = np.column_stack((np.where(breaks, np.nan, x[order[starts]]), x[order[starts]], x[order[ends]]))
+    points_y = np.column_stack((np.where(breaks, np.nan, y[order[starts]]), y[order[starts]], y[order[ends]]))
+    keep = np.column_stack((breaks, np.ones((len(starts), 2), dtype=bool)))
+
+    lower = np.minimum.reduceat((y - y_error)[order], starts)
+    upper = np.maximum.reduceat((y + y_error)[order], starts)
+    if x_range > 0:
+        error_x = x_min + (occupied + 0.5) * (x_range / columns)
+    else:
+        error_x = np.full(len(starts), x_min)
+    return points_x[keep], points_y[keep], error_x, lower, upper
+
+
+class LightCurveTemplate:
+    """
+    A figure with the axes, labels, legend and artists for a light curve preview already in place. Rendering a
+    preview updates the artist data, and draws the canvas once, for both the preview and the thumbnail.
+
+    Decorrelated series with more than decimate_above points are drawn with decimate_light_curve, so the time to
+    draw them does not grow with their length.
+
+    A template is not safe to share between threads - use render_light_curve, which keeps one template per thread.
+    """
+
+    def __init__(self, decimate_above=DECIMATE_ABOVE):
+        self._figure = Figure()
+        self._canvas = FigureCanvasAgg(self._figure)
+        self._axes = self._figure.add_subplot()
+        empty = np.empty(0)
+        (self._decorrelated_points,) = self._axes.plot(empty, empty, 'k.', label='BRITE Data')
+        self._decorrelated_errors = self._axes.errorbar(empty, empty, yerr=empty, xerr=None, fmt='k.')
+        (self._average_points,) = self._axes.plot(empty, empty, 'co', label='Average/orbit')
+        self._average_errors = self._axes.errorbar(empty, empty, yerr=empty, xerr=None, fmt='c.')
+        self._axes.set_xlabel('Barycentric Julian Date - 2456000.0', color='k')
+        self._axes.set_ylabel('BRITE Magnitude', color='k')
+        self._axes.set_title('', color='k', fontweight='bold')
+        self._legend = self._axes.legend()
+        self._decimate_above = decimate_above
+        self._columns = max(1, int(self._axes.get_window_extent().width))
+
+    def render(self, preview_fqn, obs_id, instrument_name, decorrelated, average, thumb_fqn=None, summary=None):
+        """
+        Write a PNG plot of the decorrelated and orbit-averaged magnitudes for an Observation, and optionally, a
+        THUMBNAIL_WIDTH-pixel-wide thumbnail of the same plot.
+
+        :param preview_fqn: str fully-qualified name for the plot
+        :param obs_id: str plot title
+        :param instrument_name: str legend label for the decorrelated magnitudes
+        :param decorrelated: tuple of array-likes, of BJD, magnitude, and magnitude uncertainty
+        :param average: tuple of array-likes, of BJD, magnitude, and magnitude uncertainty, averaged per orbit
+        :param thumb_fqn: str fully-qualified name for the thumbnail, or None, for no thumbnail
+        :param summary: reader.SeriesSummary of the decorrelated series, or None, to compute the axis limits here
+        """
+        mjd_decorr, mag_decorr, sigma_decorr = [np.asarray(ii) for ii in decorrelated]
+        mjd_ave, mag_ave, sigma_ave = [np.asarray(ii) for ii in average]
+        if self._decimate_above is not None and len(mjd_decorr) > self._decimate_above:
+            points_x, points_y, error_x, lower, upper = decimate_light_curve(
+                mjd_decorr, mag_decorr, sigma_decorr, self._columns
+            )
+            linestyle = '-'
+        else:
+            linestyle = 'None'
+            points_x, points_y = mjd_decorr, mag_decorr
+            error_x, lower, upper = mjd_decorr, mag_decorr - sigma_decorr, mag_decorr + sigma_decorr
+        # the line through the decimated points stands in for a column of points that is drawn solid
+        self._decorrelated_points.set_linestyle(linestyle)
+        self._decorrelated_errors[0].set_linestyle(linestyle)
+        self._decorrelated_points.set_data(points_x, points_y)
+        LightCurveTemplate._set_errorbar_data(self._decorrelated_errors, points_x, points_y, error_x, lower, upper)
+        self._average_points.set_data(mjd_ave, mag_ave)
+        LightCurveTemplate._set_errorbar_data(
+            self._average_errors, mjd_ave, mag_ave, mjd_ave, mag_ave - sigma_ave, mag_ave + sigma_ave
+        )
+        if summary is None:
+            summary = summarize(mjd_decorr, mag_decorr, sigma_decorr)
+        self._axes.set_xlim(summary.time_min, summary.time_max)
+        # DB 07-11-22
+        # flip the y-axis direction on the ndatdb/ave plots since brighter = lower magnitude value
+        self._axes.set_ylim(summary.mag_max + summary.max_sigma, summary.mag_min - summary.max_sigma)
+        self._axes.title.set_text(obs_id)
+        self._legend.get_texts()[0].set_text(instrument_name)
+
+        self._canvas.draw()
+        rendered = Image.fromarray(np.asarray(self._canvas.buffer_rgba()))
+        rendered.save(preview_fqn, format='png')
+        if thumb_fqn is not None:
+            height = round(rendered.height * THUMBNAIL_WIDTH / rendered.width)
+            rendered.resize((THUMBNAIL_WIDTH, height), Image.LANCZOS).save(thumb_fqn, format='png')
+
+    @staticmethod
+    def _set_errorbar_data(container, x, y, error_x, lower, upper):
+        data_line, _, (y_error_lines,) = container
+        data_line.set_data(x, y)
+        y_error_lines.set_segments(np.stack((np.column_stack((error_x, lower)), np.column_stack((error_x, upper))), 1))
+
+
+def render_light_curve(preview_fqn, obs_id, instrument_name, decorrelated, average, thumb_fqn=None, summary=None):
+    """
+    LightCurveTemplate.render, with the template for the calling thread.
+    """
+    template = getattr(_templates, 'light_curve', None)
+    if template is None:
+        template = LightCurveTemplate()
+        _templates.light_curve = template
+    template.render(preview_fqn, obs_id, instrument_name, decorrelated, average, thumb_fqn, summary)
+
+
 class BRITEDecorrelatedPreview(mc.PreviewVisitor):
 
     def __init__(self, instrument_name, **kwargs):
         super().__init__(**kwargs)
         self._instrument_name = instrument_name
-        # do the things necessary to read the metadata for the .ndatdb and .avedb files
+        # do the things necessary to read the metadata for the .ndatdb and .avedb files - these come from the
+        # MetadataReader cache when the files have already been parsed, and are only read or retrieved otherwise
+        metrics = self._metadata_reader.metrics
+        initial_parses = metrics['parse']
+        initial_transfers = metrics['transfer']
         get_entry(self._storage_name, '.rlogdb', '.ndatdb', self._clients, self._metadata_reader)
         get_entry(self._storage_name, '.rlogdb', '.avedb', self._clients, self._metadata_reader)
+        self._parses = metrics['parse'] - initial_parses
+        self._transfers = metrics['transfer'] - initial_transfers
+        metrics['preview_parse'] += self._parses
+        metrics['preview_transfer'] += self._transfers
+        self._logger.debug(
+            f'Preview for {self._storage_name.obs_id} parsed {self._parses} and retrieved {self._transfers} files.'
+        )
 
     def generate_plots(self, obs_id):
-        mjd_decorr = np.array(self._metadata_reader.time_series[self._storage_name.decorrelated_uri]['BJD'])
-        mag_decorr = np.array(self._metadata_reader.time_series[self._storage_name.decorrelated_uri]['BRITEMAG'])
-        sigma_decorr = np.array(self._metadata_reader.time_series[self._storage_name.decorrelated_uri]['SIGMA_BRITEMAG'])
-        mjd_ave = np.array(self._metadata_reader.time_series[self._storage_name.average_uri]['ave_BJD'])
-        mag_ave = np.array(self._metadata_reader.time_series[self._storage_name.average_uri]['ave_BRITEMAG'])
-        sigma_ave = np.array(self._metadata_reader.time_series[self._storage_name.average_uri]['ave_SIGMA_BRITEMAG'])
-
-        pylab.plot(mjd_decorr, mag_decorr, 'k.', label=self._instrument_name)
-        pylab.errorbar(mjd_decorr, mag_decorr, yerr=sigma_decorr, xerr=None, fmt='k.')
-        pylab.plot(mjd_ave, mag_ave, 'co', label='Average/orbit')
-        pylab.errorbar(mjd_ave, mag_ave, yerr=sigma_ave, xerr=None, fmt='c.')
-        pylab.xlabel('Barycentric Julian Date - 2456000.0', color='k')
-        pylab.ylabel('BRITE Magnitude', color='k')
-        pylab.xlim(mjd_decorr.min(), mjd_decorr.max())
-        # DB 07-11-22
-        # flip the y-axis direction on the ndatdb/ave plots since brighter = lower magnitude value
-        pylab.ylim(
-            mag_decorr.max() + sigma_decorr.max(),
-            mag_decorr.min() - sigma_decorr.max(),
+        decorrelated = self._metadata_reader.time_series[self._storage_name.decorrelated_uri]
+        average = self._metadata_reader.time_series[self._storage_name.average_uri]
+        render_light_curve(
+            self._preview_fqn,
+            obs_id,
+            self._instrument_name,
+            (decorrelated['BJD'], decorrelated['BRITEMAG'], decorrelated['SIGMA_BRITEMAG']),
+            (average['ave_BJD'], average['ave_BRITEMAG'], average['ave_SIGMA_BRITEMAG']),
+            thumb_fqn=self._thumb_fqn,
+            summary=self._metadata_reader.summaries[self._storage_name.decorrelated_uri],
         )
-        pylab.title(obs_id, color='k', fontweight='bold')
-        pylab.legend()
-        pylab.savefig(self._preview_fqn, format='png')
-        pylab.close()
         return self._save_figure()
 
+    def _gen_thumbnail(self):
+        # the thumbnail is written from the same rendering as the preview, in generate_plots, so this only counts it
+        return 1 if os.path.exists(self._thumb_fqn) else 0
+
 
 def visit(observation, **kwargs):
     storage_name = kwargs.get('storage_name')
@@ -67,15 +67,302 @@
 # ***********************************************************************
 #
 
+import mmap
+import numpy as np
+import os
+import re
+import warnings
+
 from astropy.io import fits
-from caom2pipe.manage_composable import CadcException
+from caom2pipe.manage_composable import CadcException, to_float
 from caom2pipe import reader_composable as rdc
-from collections import defaultdict
-from io import BytesIO
+from collections import Counter, namedtuple, OrderedDict
+from itertools import chain
+from os.path import basename, exists, getsize
+from brite2caom2.resolver import get_star_info_coordinates, TargetResolver
 from brite2caom2.storage_name import BriteName
 
 
-__all__ = ['BriteFileMetadataReader', 'BriteStorageClientMetadataReader']
+__all__ = ['BriteFileMetadataReader', 'BriteOrigHeader', 'BriteStorageClientMetadataReader']
+
+
+# what identifies the source of a parsed entry, so that the entry can be re-used for as long as the source doesn't
+# change - mtime is None when the content was retrieved from CADC storage
+ContentSignature = namedtuple('ContentSignature', 'size mtime md5')
+
+# what the mappings and the preview need from a time series, computed once when the series is parsed - times are in
+# the units of the file's time column, and the magnitude fields are None for a series with no magnitudes
+SeriesSummary = namedtuple('SeriesSummary', 'time_min time_max count mag_min mag_max median_sigma max_sigma')
+
+
+def summarize(time, magnitude=None, sigma=None):
+    """
+    Summarize a time series in one vectorized pass.
+
+    :param time: array of times, in any order, or None, if the series has no time column
+    :param magnitude: array of magnitudes, or None
+    :param sigma: array of magnitude uncertainties, or None
+    :return: SeriesSummary
+    """
+    count = 0 if time is None else len(time)
+    if count == 0:
+        return SeriesSummary(None, None, count, None, None, None, None)
+    time_min, time_max = float(np.min(time)), float(np.max(time))
+    if magnitude is None or sigma is None:
+        return SeriesSummary(time_min, time_max, count, None, None, None, None)
+    return SeriesSummary(
+        time_min,
+        time_max,
+        count,
+        float(np.min(magnitude)),
+        float(np.max(magnitude)),
+        float(np.median(sigma)),
+        float(np.max(sigma)),
+    )
+
+
+class BriteOrigHeader:
+    """
+    The metadata from a .orig header, parsed once per Observation. The keywords the mapping relies on are converted
+    to their types here, so the conversions are not repeated for each of the files that share the .orig content. The
+    remaining keywords are kept as strings, in keywords.
+    """
+
+    # keyword: attribute, for the keywords that are not kept in keywords
+    parsed_keywords = {
+        'SatellID': 'satellite_id',
+        'SatfulID': 'satellite_name',
+        'StarInFo': 'star_info',
+        'ObsExpoT': 'exposure_time',
+        'InstPScl': 'plate_scale',
+        'RedMetho': 'reduction_method',
+        'RedProID': 'reduction_producer',
+        'RedVersi': 'reduction_version',
+        'ReleaseV': 'release_version',
+    }
+
+    __slots__ = tuple(parsed_keywords.values()) + ('target_name', 'filter_id', 'coordinates', 'keywords')
+
+    def __init__(self, metadata):
+        """
+        :param metadata: dict of keyword: value, both strings, as found in the header
+        """
+        keywords = dict(metadata)
+        for keyword, attribute in BriteOrigHeader.parsed_keywords.items():
+            setattr(self, attribute, keywords.pop(keyword, None))
+        # StarInFo is a comma-separated list that starts with the target name
+        self.star_info = () if self.star_info is None else tuple(self.star_info.split(','))
+        self.target_name = self.star_info[0] if len(self.star_info) > 0 else None
+        self.coordinates = get_star_info_coordinates(self.star_info)
+        # the last character of the satellite ID identifies the filter - 'b' or 'r'
+        self.filter_id = self.satellite_id[-1] if self.satellite_id else None
+        # ms => s
+        self.exposure_time = None if self.exposure_time is None else float(self.exposure_time) / 1000.0
+        # arcsec/pixel
+        self.plate_scale = to_float(self.plate_scale)
+        self.keywords = keywords
+
+    def get(self, keyword, default=None):
+        """
+        dict-style access by header keyword. The value is typed for the keywords that are parsed, and a string
+        otherwise.
+        """
+        attribute = BriteOrigHeader.parsed_keywords.get(keyword)
+        if attribute is None:
+            return self.keywords.get(keyword, default)
+        if attribute == 'star_info':
+            return ','.join(self.star_info) if len(self.star_info) > 0 else default
+        value = getattr(self, attribute)
+        return default if value is None else value
+
+    def __eq__(self, other):
+        if not isinstance(other, BriteOrigHeader):
+            return NotImplemented
+        return all(getattr(self, ii) == getattr(other, ii) for ii in BriteOrigHeader.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f'{ii}={getattr(self, ii)!r}' for ii in BriteOrigHeader.__slots__)
+        return f'BriteOrigHeader({fields})'
+
+
+class LineBody:
+    """
+    The numeric block of a BRITE file, as an iterable of text lines. This is what is available when the content
+    arrives as a text file handle, or as a list of lines.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+
+    def columns(self, usecols):
+        """
+        Decode the numeric block in one pass.
+
+        :param usecols: indices of the columns to return
+        :return: a list of contiguous float64 arrays, one per entry in usecols
+        """
+        if len(usecols) == 0:
+            return []
+        with warnings.catch_warnings():
+            # an empty numeric block is not an error at this point
+            warnings.simplefilter('ignore', UserWarning)
+            values = np.loadtxt(
+                self._lines, dtype=np.float64, comments=BriteMetaDataReader.comment_char, usecols=usecols, ndmin=2
+            )
+        if values.size == 0:
+            return [np.empty(0, dtype=np.float64) for _ in usecols]
+        return list(np.ascontiguousarray(values.T))
+
+
+class ColumnDecoder:
+    """
+    Decode the numeric block of a BRITE file from bytes, without creating a str per line. The bytes are provided in
+    pieces that each end on a line boundary, so the memory used is bounded by the size of a piece plus the size of
+    the decoded columns.
+    """
+
+    # a comment, to the end of the line, as numpy.loadtxt recognizes it
+    comment = re.compile(rb'#[^\n]*')
+    non_space = re.compile(rb'\S')
+
+    def __init__(self, usecols=None):
+        self._usecols = usecols
+        self._num_columns = None
+        self._pieces = []
+
+    def decode(self, buffer):
+        """
+        :param buffer: bytes containing only complete lines
+        """
+        if b'#' in buffer:
+            # comment lines in the numeric block are skipped, as they are by LineBody
+            buffer = ColumnDecoder.comment.sub(b'', buffer)
+        first = ColumnDecoder.non_space.search(buffer)
+        if first is None:
+            # numpy.fromstring finds a value in a block with no content
+            return
+        if self._num_columns is None:
+            eol = buffer.find(b'\n', first.start())
+            self._num_columns = len(buffer[first.start():None if eol < 0 else eol].split())
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                values = np.fromstring(buffer, dtype=np.float64, sep=' ')
+            except (DeprecationWarning, ValueError) as e:
+                raise CadcException(f'Could not decode the numeric content: {e}')
+        if values.size % self._num_columns != 0:
+            raise CadcException(
+                f'Found {values.size} values, which is not a multiple of {self._num_columns} columns.'
+            )
+        values = values.reshape(-1, self._num_columns)
+        if self._usecols is not None:
+            values = values[:, list(self._usecols)]
+        self._pieces.append(values)
+
+    def columns(self, usecols=None):
+        """
+        :param usecols: indices of the columns to return, if the decoder was not told at construction
+        :return: a list of contiguous float64 arrays, one per column
+        """
+        if usecols is None:
+            indices = range(len(self._usecols) if self._usecols is not None else (self._num_columns or 0))
+        elif self._usecols is None:
+            indices = usecols
+        else:
+            indices = [self._usecols.index(ii) for ii in usecols]
+        if len(self._pieces) == 0:
+            result = [np.empty(0, dtype=np.float64) for _ in indices]
+        else:
+            result = [np.concatenate([piece[:, ii] for piece in self._pieces]) for ii in indices]
+        self._pieces = []
+        return result
+
+
+class BufferBody:
+    """
+    The numeric block of a BRITE file, as a region of a bytes-like buffer that supports find and slicing, such as a
+    memory-mapped file. The region is handed to a ColumnDecoder in blocks, so no str is created per line, and no copy
+    of the whole region is made.
+    """
+
+    block_size = 4 * 1024 * 1024
+
+    def __init__(self, buffer, start):
+        self._buffer = buffer
+        self._start = start
+
+    def columns(self, usecols):
+        decoder = ColumnDecoder(usecols)
+        size = len(self._buffer)
+        start = self._start
+        while start < size:
+            end = min(start + BufferBody.block_size, size)
+            if end < size:
+                eol = self._buffer.rfind(b'\n', start, end)
+                if eol < 0:
+                    eol = self._buffer.find(b'\n', end)
+                end = size if eol < 0 else eol + 1
+            decoder.decode(self._buffer[start:end])
+            start = end
+        return decoder.columns()
+
+
+class StreamBody:
+    """
+    A write-only, file-like destination for the content of a BRITE file, as it is delivered by a storage client. The
+    header lines are collected, and the numeric block is handed to a ColumnDecoder, as each chunk arrives. Only the
+    trailing partial line of a chunk is kept between writes, so the memory used is bounded by the size of a chunk
+    plus the size of the decoded columns.
+    """
+
+    def __init__(self):
+        self._header = []
+        self._in_header = True
+        self._remainder = b''
+        self._decoder = ColumnDecoder()
+
+    @property
+    def header(self):
+        return self._header
+
+    def write(self, chunk):
+        content = self._remainder + bytes(chunk)
+        eol = content.rfind(b'\n')
+        if eol < 0:
+            self._remainder = content
+        else:
+            self._remainder = content[eol + 1:]
+            self._consume(content[:eol + 1])
+        return len(chunk)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        """Handle a last line with no line terminator."""
+        if len(self._remainder) > 0:
+            self._consume(self._remainder)
+            self._remainder = b''
+
+    def columns(self, usecols):
+        return self._decoder.columns(usecols)
+
+    def _consume(self, content):
+        """
+        :param content: bytes containing only complete lines
+        """
+        if self._in_header:
+            header, offset = BriteMetaDataReader._scan_header(content)
+            self._header.extend(header)
+            if offset >= len(content):
+                return
+            self._in_header = False
+            content = content[offset:]
+        self._decoder.decode(content)
 
 
 class BriteMetaDataReader(rdc.MetadataReader):
@@ -90,8 +377,37 @@ class BriteMetaDataReader(rdc.MetadataReader):
     A single Observation relies on the existence of five files with different extensions. Ensure those five files
     exist before ingestion, since the metadata from one file applies to all files, and successful preview generation
     relies on the content of two other files.
+
+    The parsed content is cached by Observation, so that it is available to all the files of that Observation. The
+    cache is bounded by max_observations and/or max_bytes, with the least recently used Observation evicted first,
+    and the entries for an Observation are released once the last file for that Observation is processed.
+
+    The target_resolver provides coordinates for the target names found in the .orig files.
+
+    A SeriesSummary is computed for each time series as it is parsed. Nothing but the summary of a .orig time series
+    is used, so with release_orig_series, that time series is released as soon as it is summarized.
     """
     comment_char = '#'
+    column_keyword = re.compile(r'^column(\d+)$')
+
+    def __init__(self, *args, max_observations=None, max_bytes=None, target_resolver=None, release_orig_series=False):
+        super().__init__(*args)
+        self._target_resolver = TargetResolver() if target_resolver is None else target_resolver
+        self._release_orig_series = release_orig_series
+        self._time_series = {}
+        self._summaries = {}
+        self._metadata = {}
+        self._signatures = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._max_observations = max_observations
+        self._max_bytes = max_bytes
+        # key is obs_id, value is the set of cached uris, least recently used first
+        self._observations = OrderedDict()
+        self._entry_bytes = {}
+        self._cached_bytes = 0
+        # 'parse' counts the files parsed, 'transfer' the files retrieved from CADC storage
+        self._metrics = Counter()
 
     @property
     def metadata(self):
@@ -101,6 +417,141 @@ class BriteMetaDataReader(rdc.MetadataReader):
     def time_series(self):
         return self._time_series
 
+    @property
+    def summaries(self):
+        """
+        :return: dict of uri: SeriesSummary, for every parsed time series
+        """
+        return self._summaries
+
+    @property
+    def target_resolver(self):
+        return self._target_resolver
+
+    @target_resolver.setter
+    def target_resolver(self, value):
+        self._target_resolver = value
+
+    @property
+    def cache_hits(self):
+        return self._cache_hits
+
+    @property
+    def cache_misses(self):
+        return self._cache_misses
+
+    @property
+    def cached_bytes(self):
+        return self._cached_bytes
+
+    @property
+    def cached_observations(self):
+        return list(self._observations.keys())
+
+    @property
+    def metrics(self):
+        """
+        :return: collections.Counter of the files parsed ('parse') and retrieved from CADC storage ('transfer'), and
+            of any other counts that are added, e.g. by the preview visitor
+        """
+        return self._metrics
+
+    def add_cache_counts(self, hits, misses, metrics=None):
+        """Include the cache counts from another MetadataReader - e.g. one in a worker process."""
+        self._cache_hits += hits
+        self._cache_misses += misses
+        if metrics is not None:
+            self._metrics.update(metrics)
+
+    def record_transfer(self, uri):
+        """Count a file retrieved from CADC storage to be parsed."""
+        self._logger.debug(f'Retrieved {uri}.')
+        self._metrics['transfer'] += 1
+
+    def is_cached(self, uri, fqn=None):
+        """
+        The files that make up an Observation are each a unit of work, but the metadata and data of the .orig, .ndatdb
+        and .avedb files are used by more than one of those units of work. Re-use an entry that has already been
+        parsed, as long as the source it was parsed from is unchanged.
+
+        :param uri: CADC uri for the file
+        :param fqn: fully-qualified name of the file on local disk, if there is one
+        :return: True if the metadata and time series for uri are present and valid
+        """
+        signature = self._signatures.get(uri)
+        if signature is None or uri not in self._summaries:
+            result = False
+        elif fqn is not None and exists(fqn):
+            stat_result = os.stat(fqn)
+            result = signature.size == stat_result.st_size and signature.mtime == stat_result.st_mtime_ns
+        else:
+            # the local file has been moved or removed since it was parsed, or the content came from CADC storage
+            result = True
+        if result and signature.md5 is not None:
+            file_info = self._file_info.get(uri)
+            result = file_info is None or file_info.md5sum == signature.md5
+        if result:
+            self._cache_hits += 1
+            obs_id = BriteMetaDataReader._get_obs_id(uri)
+            if obs_id in self._observations:
+                self._observations.move_to_end(obs_id)
+            self._logger.debug(f'Cache hit for {uri}.')
+        else:
+            self._cache_misses += 1
+        return result
+
+    def _record(self, uri, fqn=None):
+        """
+        Keep track of the source of a parsed entry.
+
+        :param uri: CADC uri for the file
+        :param fqn: fully-qualified name of the file on local disk, or None if the content came from CADC storage
+        """
+        self._metrics['parse'] += 1
+        file_info = self._file_info.get(uri)
+        md5 = None if file_info is None else file_info.md5sum
+        if fqn is None:
+            size = None if file_info is None else file_info.size
+            self._signatures[uri] = ContentSignature(size, None, md5)
+        else:
+            stat_result = os.stat(fqn)
+            self._signatures[uri] = ContentSignature(stat_result.st_size, stat_result.st_mtime_ns, md5)
+        obs_id = BriteMetaDataReader._get_obs_id(uri)
+        self._observations.setdefault(obs_id, set()).add(uri)
+        self._observations.move_to_end(obs_id)
+        entry_bytes = sum(getattr(ii, 'nbytes', 0) for ii in self._time_series.get(uri, {}).values())
+        self._cached_bytes += entry_bytes - self._entry_bytes.get(uri, 0)
+        self._entry_bytes[uri] = entry_bytes
+        self._evict()
+
+    def _evict(self):
+        """Release the least recently used Observations until the cache is within its bounds. The most recently
+        used Observation is always kept, since it's the one being worked on."""
+        while len(self._observations) > 1 and (
+            (self._max_observations is not None and len(self._observations) > self._max_observations)
+            or (self._max_bytes is not None and self._cached_bytes > self._max_bytes)
+        ):
+            self.release(next(iter(self._observations)))
+
+    def release(self, obs_id):
+        """
+        Remove the cached metadata and time series for all the files of an Observation.
+
+        :param obs_id: str Observation ID
+        """
+        for uri in self._observations.pop(obs_id, set()):
+            self._time_series.pop(uri, None)
+            self._summaries.pop(uri, None)
+            self._metadata.pop(uri, None)
+            self._headers.pop(uri, None)
+            self._signatures.pop(uri, None)
+            self._cached_bytes -= self._entry_bytes.pop(uri, 0)
+        self._logger.debug(f'Released cached entries for {obs_id}.')
+
+    @staticmethod
+    def _get_obs_id(uri):
+        return BriteName.remove_extensions(basename(uri))
+
     def _read_file(self, brite_fh, uri):
         """
         Read the metadata and data from csv files.
@@ -108,82 +559,153 @@ class BriteMetaDataReader(rdc.MetadataReader):
         :param brite_fh: file handle
         :param uri:
         """
+        header, body = BriteMetaDataReader._split_header(brite_fh)
+        self._read_content(header, body, uri)
+
+    def _read_local_file(self, fqn, uri):
+        """
+        Read the metadata and data from a file on local disk. The file is memory-mapped, the header region is
+        scanned in place, and the numeric region is decoded in blocks, so there is no intermediate str per line.
+
+        :param fqn: fully-qualified name of the file on local disk
+        :param uri: CADC uri for the file
+        """
+        if getsize(fqn) == 0:
+            # mmap does not support empty files
+            with open(fqn) as f:
+                self._read_file(f, uri)
+        else:
+            with open(fqn, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header, offset = BriteMetaDataReader._scan_header(mm)
+                self._read_content(header, BufferBody(mm, offset), uri)
+        self._record(uri, fqn)
+
+    def _read_content(self, header, body, uri):
+        """
+        :param header: list of the comment lines at the top of the file
+        :param body: LineBody or BufferBody for the numeric block that follows the header
+        :param uri: CADC uri for the file
+        """
         if uri.endswith('.orig'):
-            self._read_orig_file(brite_fh, uri)
+            self._read_orig_file(header, body, uri)
         elif uri.endswith('.ndatdb'):
-            self._read_bjd_file(brite_fh, uri, ['BJD', 'BRITEMAG', 'SIGMA_BRITEMAG'])
+            self._read_bjd_file(header, body, uri, ['BJD', 'BRITEMAG', 'SIGMA_BRITEMAG'])
         elif uri.endswith('.avedb'):
-            self._read_bjd_file(brite_fh, uri, ['ave_BJD', 'ave_BRITEMAG', 'ave_SIGMA_BRITEMAG'])
+            self._read_bjd_file(header, body, uri, ['ave_BJD', 'ave_BRITEMAG', 'ave_SIGMA_BRITEMAG'])
 
-    def _read_bjd_file(self, brite_fh, uri, keys):
+    def _read_bjd_file(self, header, body, uri, keys):
         """
-        :param brite_fh: file handle
+        :param header: list of header lines
+        :param body: numeric block
         :param uri: CADC uri for the file
         :param keys: key names for accessing the timeseries
         """
-        default_found = False
-        data = defaultdict(list)
-        # Read average magnitudes/orbit from the 'avedb' file.
-        for line in brite_fh:
-            if len(line) == 0:
-                continue
-            if line[0] == BriteMetaDataReader.comment_char:
-                # skip header lines
-                # DB 26-10-22
-                # Note:  for preview generation, the x-axis assumes the 2456000.0 value in this header line doesn’t
-                # change:
-                # (1) BJD(TDB) - 2456000.0    : Barycentric Julian Date.
-                #
-                # Add a check to ensure the default doesn't change.
-                if '2456000.0' in line:
-                    default_found = True
-                continue
-            else:
-                # Read time series data into dictionary arrays
-                datapoint = line.split()
-                data[keys[0]].append(float(datapoint[0]))
-                data[keys[1]].append(float(datapoint[1]))
-                data[keys[2]].append(float(datapoint[3]))
-
-        if not default_found:
+        # DB 26-10-22
+        # Note:  for preview generation, the x-axis assumes the 2456000.0 value in this header line doesn’t
+        # change:
+        # (1) BJD(TDB) - 2456000.0    : Barycentric Julian Date.
+        #
+        # Add a check to ensure the default doesn't change.
+        if not any('2456000.0' in line for line in header):
             raise CadcException(f'Wrong default x-axis value found for {uri}. Stopping.')
 
+        # Read average magnitudes/orbit from the 'avedb' file. Only columns 1, 2 and 4 are used.
+        columns = body.columns((0, 1, 3))
         self._metadata[uri] = {}
-        self._time_series[uri] = data
+        self._time_series[uri] = dict(zip(keys, columns))
+        self._summaries[uri] = summarize(*columns)
         self._headers[uri] = [fits.Header()]
 
-    def _read_orig_file(self, brite_fh, uri):
+    def _read_orig_file(self, header, body, uri):
         """
         This file contains most of the metadata for a CAOM2 record.
-        :param brite_fh: file handle
+        :param header: list of header lines
+        :param body: numeric block
         :param uri: CADC uri for the file
         """
-        data = defaultdict(list)
+        metadata = BriteMetaDataReader._parse_orig_header(header)
+        # resolve the time series column names once, from the 'columnN' keywords, and decode the numeric block
+        # into one array per column
+        schema = BriteMetaDataReader._get_column_schema(metadata)
+        columns = body.columns(tuple(range(len(schema))))
+        self._metadata[uri] = BriteOrigHeader(metadata)
+        time_series = dict(zip(schema, columns))
+        self._summaries[uri] = summarize(time_series.get('HJD'))
+        if not self._release_orig_series:
+            self._time_series[uri] = time_series
+        self._headers[uri] = [fits.Header()]
+
+    @staticmethod
+    def _parse_orig_header(header):
+        """
+        :param header: list of '# keyword = value / comment' lines
+        :return: dict of keyword: value, both strings
+        """
         metadata = {}
-        for line in brite_fh:
+        for line in header:
+            ll = line.split('=', 1)
+            if '----------' in ll[0]:
+                continue
+            keyword = ll[0].replace(f'{BriteMetaDataReader.comment_char} ', '').strip()
+            [value, comment] = ll[1].split('/', 1)
+            metadata[keyword] = value.strip()
+        return metadata
+
+    @staticmethod
+    def _get_column_schema(metadata):
+        """
+        :param metadata: dict of .orig header keywords
+        :return: list of time series column names, in the order the columns occur in the file
+        """
+        indexed = {}
+        for keyword, value in metadata.items():
+            match = BriteMetaDataReader.column_keyword.match(keyword)
+            if match is not None:
+                indexed[int(match.group(1))] = value
+        if sorted(indexed.keys()) != list(range(1, len(indexed) + 1)):
+            raise CadcException(f'Non-contiguous column keywords {sorted(indexed.keys())}.')
+        return [indexed[ii] for ii in sorted(indexed.keys())]
+
+    @staticmethod
+    def _split_header(brite_fh):
+        """
+        Separate the comment lines at the top of a BRITE file from the numeric block that follows.
+
+        :param brite_fh: file handle, or any iterable of lines
+        :return: the list of header lines, and a LineBody positioned at the first line of the numeric block
+        """
+        header = []
+        lines = iter(brite_fh)
+        for line in lines:
             if len(line) == 0:
                 continue
-            # First read header content of data file
             if line[0] == BriteMetaDataReader.comment_char:
-                ll = line.split('=', 1)
-                if '----------' in ll[0]:
-                    continue
-                keyword = ll[0].replace(f'{BriteMetaDataReader.comment_char} ', '').strip()
-                [value, comment] = ll[1].split('/', 1)
-                value = value.strip()
-                metadata[keyword] = value
-                # Initialize time series data arrays
-                if 'column' in keyword:
-                    data[value] = []
+                header.append(line)
             else:
-                datapoint = line.split()
-                for x in range(0, len(datapoint)):
-                    key = 'column' + str(x + 1)
-                    data[metadata[key]].append(float(datapoint[x]))
+                return header, LineBody(chain([line], lines))
+        return header, LineBody(iter(()))
 
-        self._metadata[uri] = metadata
-        self._time_series[uri] = data
-        self._headers[uri] = [fits.Header()]
+    @staticmethod
+    def _scan_header(buffer):
+        """
+        Find the comment lines at the top of a BRITE file, in place, in a bytes-like buffer.
+
+        :param buffer: bytes-like object that supports find and slicing, such as a memory-mapped file
+        :return: the list of header lines, and the offset of the numeric block that follows
+        """
+        header = []
+        size = len(buffer)
+        start = 0
+        while start < size:
+            eol = buffer.find(b'\n', start)
+            end = size if eol < 0 else eol
+            line = buffer[start:end]
+            if len(line.strip()) > 0:
+                if line[:1] != BriteMetaDataReader.comment_char.encode():
+                    break
+                header.append(line.decode())
+            start = end + 1
+        return header, min(start, size)
 
     def set(self, storage_name):
         self.set_file_info(storage_name)
@@ -192,11 +714,17 @@ class BriteMetaDataReader(rdc.MetadataReader):
     def reset(self):
         super().reset()
         self._time_series = {}
+        self._summaries = {}
         self._metadata = {}
+        self._signatures = {}
+        self._observations = OrderedDict()
+        self._entry_bytes = {}
+        self._cached_bytes = 0
 
     def __str__(self):
         ts_keys = '\n'.join(ii for ii in self._time_series)
-        return f'\nKeys:\n{ts_keys}\n'
+        metrics = ' '.join(f'{key}: {value}' for key, value in sorted(self._metrics.items()))
+        return f'\nKeys:\n{ts_keys}\nCache hits: {self._cache_hits} misses: {self._cache_misses}\n{metrics}\n'
 
     def set_file_info(self, storage_name):
         """Retrieves FileInfo information to memory."""
@@ -210,38 +738,44 @@ class BriteMetaDataReader(rdc.MetadataReader):
 
 class BriteFileMetadataReader(BriteMetaDataReader, rdc.FileMetadataReader):
 
-    def __init__(self):
-        super().__init__()
-        self._time_series = {}
-        self._metadata = {}
+    def __init__(self, max_observations=None, max_bytes=None, target_resolver=None, release_orig_series=False):
+        super().__init__(
+            max_observations=max_observations,
+            max_bytes=max_bytes,
+            target_resolver=target_resolver,
+            release_orig_series=release_orig_series,
+        )
 
     def set_time_series(self, storage_name):
         for index, entry in enumerate(storage_name.destination_uris):
-            if entry not in self._time_series.keys():
-                if storage_name.has_data:
-                    self._logger.debug(f'Retrieve content for {entry}')
-                    with open(storage_name.source_names[index]) as f:
-                        self._read_file(f, entry)
-                else:
-                    self._logger.info(f'No Content for {entry}')
+            if not BriteName.is_data(entry):
+                self._logger.info(f'No Content for {entry}')
+            elif not self.is_cached(entry, storage_name.source_names[index]):
+                self._logger.debug(f'Retrieve content for {entry}')
+                self._read_local_file(storage_name.source_names[index], entry)
 
 
 class BriteStorageClientMetadataReader(BriteMetaDataReader, rdc.StorageClientReader):
 
-    def __init__(self, client):
-        super().__init__(client)
-        self._time_series = {}
-        self._metadata = {}
+    def __init__(self, client, max_observations=None, max_bytes=None, target_resolver=None, release_orig_series=False):
+        super().__init__(
+            client,
+            max_observations=max_observations,
+            max_bytes=max_bytes,
+            target_resolver=target_resolver,
+            release_orig_series=release_orig_series,
+        )
 
     def set_time_series(self, storage_name):
         for index, entry in enumerate(storage_name.destination_uris):
-            if entry not in self._time_series.keys():
-                if storage_name.has_data:
-                    self._logger.debug(f'Retrieve content for {entry}')
-                    buffer = BytesIO()
-                    self._client.cadcget(storage_name.file_uri, buffer)
-                    self._read_file(buffer.getvalue().decode().split('\n'), storage_name.file_uri)
-                    # I think this does a memory clean-up
-                    buffer.close()
-                else:
-                    self._logger.info(f'No Content for {entry}')
+            if not BriteName.is_data(entry):
+                self._logger.info(f'No Content for {entry}')
+            elif not self.is_cached(entry):
+                self._logger.debug(f'Retrieve content for {entry}')
+                # parse the content as the client delivers it, instead of holding copies of the whole file
+                body = StreamBody()
+                self._client.cadcget(entry, body)
+                self.record_transfer(entry)
+                body.finish()
+                self._read_content(body.header, body, entry)
+                self._record(entry)
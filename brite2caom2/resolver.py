@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+Target coordinates, from the .orig header where they are present, and otherwise from name resolution, with a
+persistent cache, so that the coordinates for the same few hundred bright stars are not retrieved from a name
+resolver service for every file of every season.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import tempfile
+
+from astropy.coordinates import SkyCoord
+from caom2pipe.manage_composable import CadcException
+
+
+__all__ = ['get_star_info_coordinates', 'TargetResolver']
+
+
+# sexagesimal RA and Dec, as found in the StarInFo keyword - e.g. '05:37:38.68', '05 37 38.68', '05h37m38.68s',
+# '+21:08:33.2', '-00 17 56.7', "+21d08'33.2\""
+RA_SEXAGESIMAL = re.compile(r'^(\d{1,2})[h:\s]\s*(\d{1,2})[m:\s]\s*(\d{1,2}(?:\.\d*)?)s?$')
+DEC_SEXAGESIMAL = re.compile(r'^([+-]?)(\d{1,2})[d:\s]\s*(\d{1,2})[m\':\s]\s*(\d{1,2}(?:\.\d*)?)(?:"|s)?$')
+
+
+def get_star_info_coordinates(star_info):
+    """
+    The StarInFo keyword is a comma-separated list that starts with the target name. Find the first pair of
+    consecutive fields that are a sexagesimal RA and Dec.
+
+    :param star_info: list of str, the comma-separated StarInFo values
+    :return: tuple of RA, Dec, in degrees, or None, if there are no coordinates
+    """
+    fields = [ii.strip() for ii in star_info]
+    for index in range(1, len(fields) - 1):
+        ra_match = RA_SEXAGESIMAL.match(fields[index])
+        dec_match = DEC_SEXAGESIMAL.match(fields[index + 1])
+        if ra_match is None or dec_match is None:
+            continue
+        hours, ra_minutes, ra_seconds = [float(ii) for ii in ra_match.groups()]
+        sign, degrees, dec_minutes, dec_seconds = dec_match.groups()
+        degrees, dec_minutes, dec_seconds = float(degrees), float(dec_minutes), float(dec_seconds)
+        if (
+            hours >= 24.0
+            or ra_minutes >= 60.0
+            or ra_seconds >= 60.0
+            or dec_minutes >= 60.0
+            or dec_seconds >= 60.0
+            or degrees + dec_minutes / 60.0 + dec_seconds / 3600.0 > 90.0
+        ):
+            continue
+        ra = 15.0 * (hours + ra_minutes / 60.0 + ra_seconds / 3600.0)
+        dec = degrees + dec_minutes / 60.0 + dec_seconds / 3600.0
+        if sign == '-':
+            dec = -dec
+        return ra, dec
+    return None
+
+
+class TargetResolver:
+    """
+    Resolve a target name to ICRS RA/Dec, in degrees.
+
+    Resolved coordinates are kept in a JSON index, keyed by the normalized target name. The index is read on
+    construction, and merged with the index on disk every time a name is resolved by the name resolver service. The
+    index may be pre-seeded from a local catalogue file, with one 'name, ra, dec' entry per line, with RA and Dec in
+    degrees.
+
+    In offline mode, a name that is not already in the index is an error, instead of a name resolver service call.
+    """
+
+    def __init__(self, cache_fqn=None, offline=False):
+        """
+        :param cache_fqn: str fully-qualified name of the JSON index. If None, the index is kept in memory only.
+        :param offline: bool True if there should be no name resolver service calls
+        """
+        self._cache_fqn = cache_fqn
+        self._offline = offline
+        self._coords = {}
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._coords = self._read()
+
+    def __contains__(self, name):
+        return TargetResolver.normalize(name) in self._coords
+
+    def __len__(self):
+        return len(self._coords)
+
+    def add(self, name, ra, dec):
+        """Add, or replace, the coordinates for a target, in memory."""
+        self._coords[TargetResolver.normalize(name)] = (float(ra), float(dec))
+
+    def resolve(self, name):
+        """
+        :param name: str target name, as found in the StarInFo header keyword
+        :return: tuple of RA, Dec, in degrees
+        """
+        key = TargetResolver.normalize(name)
+        result = self._coords.get(key)
+        if result is None:
+            if self._offline:
+                raise CadcException(f'No coordinates for {name} in offline mode.')
+            self._logger.info(f'Resolve coordinates for {name}.')
+            object_coords = SkyCoord.from_name(name)
+            result = (object_coords.ra.degree, object_coords.dec.degree)
+            self._coords[key] = result
+            self.save()
+        return result
+
+    def save(self):
+        """Write the index, if there is somewhere to write it. The index is merged with the one on disk, while holding
+        an exclusive lock, so the names resolved by concurrent pipeline processes, e.g. the ingest workers, are all
+        kept. Replace the file, rather than re-writing it in place, so a failure part-way through leaves the previous
+        index intact."""
+        if self._cache_fqn is not None:
+            cache_dir = os.path.dirname(os.path.abspath(self._cache_fqn))
+            cache_name = os.path.basename(self._cache_fqn)
+            with open(os.path.join(cache_dir, f'.{cache_name}.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                merged = self._read()
+                merged.update(self._coords)
+                self._coords = merged
+                fd, temp_fqn = tempfile.mkstemp(dir=cache_dir, prefix=f'.{cache_name}.', suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f:
+                        json.dump(self._coords, f, indent=1, sort_keys=True)
+                    os.replace(temp_fqn, self._cache_fqn)
+                except BaseException:
+                    os.unlink(temp_fqn)
+                    raise
+
+    def _read(self):
+        """
+        :return: dict of the index on disk, which is empty if there is no index, or if the index is corrupt
+        """
+        result = {}
+        if self._cache_fqn is not None and os.path.exists(self._cache_fqn):
+            try:
+                with open(self._cache_fqn) as f:
+                    result = {key: tuple(value) for key, value in json.load(f).items()}
+                self._logger.debug(f'Read {len(result)} targets from {self._cache_fqn}.')
+            except json.JSONDecodeError as e:
+                # the names will be resolved again, and the index re-written
+                self._logger.warning(f'Ignore the corrupt target index {self._cache_fqn}: {e}')
+        return result
+
+    def seed(self, catalogue_fqn):
+        """
+        Bulk-load target coordinates from a local catalogue file.
+
+        :param catalogue_fqn: str fully-qualified name of a file with one 'name, ra, dec' entry per line. Blank
+            lines and lines that start with '#' are ignored.
+        """
+        count = 0
+        with open(catalogue_fqn) as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+                try:
+                    name, ra, dec = [ii.strip() for ii in line.rsplit(',', 2)]
+                    self.add(name, ra, dec)
+                except ValueError as e:
+                    raise CadcException(f'Could not understand "{line}" in {catalogue_fqn}: {e}')
+                count += 1
+        self._logger.info(f'Seeded {count} targets from {catalogue_fqn}.')
+        self.save()
+
+    @staticmethod
+    def normalize(name):
+        """Target names are matched ignoring case and repeated white space."""
+        return ' '.join(name.split()).upper()
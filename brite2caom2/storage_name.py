@@ -79,12 +79,21 @@ class BriteName(StorageName):
     For the decorrelated planes, need to have the content of multiple files to generate the previews, so implement
     this class to collect the artifacts by plane product ID. This decision is captured in how _source_names and
     _destination_uris are set.
+
+    When all the files for an Observation are processed as one unit of work, the entry is the tuple of those file
+    names, and the .rlogdb file, as the last to ingest, is the file that represents the collection.
     """
 
     def __init__(self, entry):
+        if isinstance(entry, (list, tuple)):
+            source_names = list(entry)
+            self._representative = BriteName.get_last_to_ingest(source_names)
+        else:
+            source_names = [entry]
+            self._representative = entry
         super().__init__(
-            file_name=basename(entry),
-            source_names=[entry],
+            file_name=basename(self._representative),
+            source_names=source_names,
         )
 
     @property
@@ -105,11 +114,12 @@ class BriteName(StorageName):
 
     @property
     def has_data(self):
-        return (
-            self._file_name.endswith('.orig')
-            or self._file_name.endswith('.ndatdb')
-            or self._file_name.endswith('.avedb')
-        )
+        return BriteName.is_data(self._file_name)
+
+    @property
+    def is_observation(self):
+        """True if this instance represents all the files for an Observation."""
+        return len(self._source_names) > 1
 
     @property
     def is_last_to_ingest(self):
@@ -137,7 +147,7 @@ class BriteName(StorageName):
         Common code to refer to a different file than the one currently being processed.
         :return:
         """
-        new_fqn = self._source_names[0].replace(original_extension, new_extension)
+        new_fqn = self._representative.replace(original_extension, new_extension)
         new_uri = self._get_uri(basename(new_fqn), StorageName.scheme)
         return new_fqn, new_uri
 
@@ -157,6 +167,18 @@ class BriteName(StorageName):
         # files whose purpose is other than storage/ingestion at CADC
         return not (file_name.endswith('.lst') or file_name.endswith('.md5'))
 
+    @staticmethod
+    def is_data(file_name):
+        # files with time series content
+        return file_name.endswith('.orig') or file_name.endswith('.ndatdb') or file_name.endswith('.avedb')
+
+    @staticmethod
+    def get_last_to_ingest(file_names):
+        for file_name in file_names:
+            if file_name.endswith('.rlogdb'):
+                return file_name
+        return file_names[-1]
+
 
 def get_entry(sn, original_extension, new_extension, clients, metadata_reader):
     """
@@ -171,10 +193,13 @@ def get_entry(sn, original_extension, new_extension, clients, metadata_reader):
     fqn, uri = sn.use_different_file(original_extension, new_extension)
     if dirname(fqn) is None or dirname(fqn) == '':
         fqn = f'./{fqn}'
+    # re-use the metadata if it has already been read, and the file hasn't changed since
+    if metadata_reader.is_cached(uri, fqn):
+        return uri, fqn
     # retrieve the file if it doesn't already exist - e.g. if re-ingesting files/observations
     if not exists(fqn) and clients is not None:
         clients.data_client.get(dirname(fqn), uri)
+        metadata_reader.record_transfer(uri)
     # retrieve the file metadata if it doesn't already exist
-    with open(fqn) as f:
-        metadata_reader._read_file(f, uri)
+    metadata_reader._read_local_file(fqn, uri)
     return uri, fqn
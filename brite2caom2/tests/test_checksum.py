@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import os
+
+from brite2caom2.checksum import ChecksumIndex, normalize_md5, read_md5_file
+
+
+def test_read_md5_file(tmp_path):
+    md5_fqn = tmp_path / 'A.md5'
+    md5_fqn.write_text(
+        'D41D8CD98F00B204E9800998ECF8427E  A.avedb\n'
+        '0cc175b9c0f1b6a831c399e269772661 */data/A.orig\n'
+        '\n'
+        'not a checksum line\n'
+        'MD5 (A.rlogdb) = 92eb5ffee6ae2fec3ad71c777531578f\n'
+    )
+    test_result = read_md5_file(md5_fqn.as_posix())
+    assert test_result == {
+        'A.avedb': 'd41d8cd98f00b204e9800998ecf8427e',
+        'A.orig': '0cc175b9c0f1b6a831c399e269772661',
+        'A.rlogdb': '92eb5ffee6ae2fec3ad71c777531578f',
+    }, 'wrong checksums'
+    assert normalize_md5('md5:D41D8CD98F00B204E9800998ECF8427E') == 'd41d8cd98f00b204e9800998ecf8427e', 'wrong md5'
+    assert normalize_md5(None) is None, 'wrong None'
+
+
+def test_checksum_index(tmp_path):
+    index_fqn = (tmp_path / 'checksums.json').as_posix()
+    data_fqn = tmp_path / 'A.avedb'
+    data_fqn.write_text('content')
+    stat_result = os.stat(data_fqn)
+
+    test_subject = ChecksumIndex(index_fqn)
+    assert test_subject.get(data_fqn.as_posix(), stat_result) is None, 'not verified yet'
+    test_subject.add(data_fqn.as_posix(), stat_result, 'md5:9A0364B9E99BB480DD25E1F0284C8555')
+    test_subject.save()
+
+    # persisted
+    test_subject = ChecksumIndex(index_fqn)
+    assert len(test_subject) == 1, 'wrong length'
+    assert test_subject.get(data_fqn.as_posix(), stat_result) == '9a0364b9e99bb480dd25e1f0284c8555', 'wrong md5'
+
+    # a changed file is not verified
+    data_fqn.write_text('different content')
+    assert test_subject.get(data_fqn.as_posix(), os.stat(data_fqn)) is None, 'changed file'
@@ -69,12 +69,17 @@
 
 import glob
 import os
+import pickle
+import pytest
+import queue
 import test_main_app
+import threading
 
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
+from os.path import basename
 from shutil import copy
-from unittest.mock import call, patch
+from unittest.mock import ANY, call, Mock, patch
 
 from caom2utils import data_util
 from caom2pipe.data_source_composable import StateRunnerMeta
@@ -254,6 +259,77 @@ def test_run_local_clean_up(access_mock, client_mock, move_mock, test_config, tm
         os.chdir(orig_cwd)
 
 
+@patch('brite2caom2.data_source.BriteLocalFilesDataSource._move_action')
+@patch('brite2caom2.composable.ClientCollection')
+@patch('cadcutils.net.ws.WsCapabilities.get_access_url')
+def test_run_local_group_by_obs(access_mock, client_mock, move_mock, test_config, tmp_path):
+    access_mock.return_value = 'https://localhost'
+    test_config.change_working_directory(tmp_path.as_posix())
+
+    # dict to track how many times info has been called for a particular URI
+    info_uri_calls = defaultdict(int)
+
+    def _info_mock(uri):
+        info_uri_calls[uri] += 1
+        if info_uri_calls[uri] > 1:
+            fqn = f'{TEST_ROOT_DIR}/{os.path.basename(uri)}'
+            return data_util.get_local_file_info(fqn)
+        else:
+            return None
+
+    client_mock.return_value.data_client.info.side_effect = _info_mock
+    client_mock.return_value.metadata_client.read.return_value = None
+
+    test_files = glob.glob(f'{TEST_ROOT_DIR}/*')
+    orig_cwd = os.getcwd()
+    try:
+        os.chdir(tmp_path)
+        test_config.logging_level = 'INFO'
+        test_config.task_types = [mc.TaskType.STORE, mc.TaskType.INGEST]
+        test_config.store_modified_files_only = True
+        test_config.cleanup_files_when_storing = True
+        test_config.cleanup_failure_destination = f'{tmp_path.as_posix()}/failure'
+        test_config.cleanup_success_destination = f'{tmp_path.as_posix()}/success'
+        test_config.retry_failures = False
+        test_config.log_to_file = True
+        test_config.use_local_files = True
+        test_config.data_source_extensions = test_data_source.EXTENSIONS
+        test_config.data_sources = [TEST_ROOT_DIR]
+        test_config.features.supports_latest_client = True
+        test_config.features.supports_decompression = True
+        test_config.proxy_file_name = 'test_proxy.pem'
+        test_config.write_to_file(test_config)
+        with open(f'{tmp_path.as_posix()}/config.yml', 'a') as f:
+            f.write('group_by_observation: True\n')
+
+        for d in [test_config.cleanup_failure_destination, test_config.cleanup_success_destination]:
+            os.mkdir(d)
+
+        with open(test_config.proxy_fqn, 'w') as f:
+            f.write('test content')
+
+        def _move_mock(source, destination):
+            assert source in test_files, f'unexpected source {source}'
+            assert destination == f'{tmp_path.as_posix()}/success', f'unexpected destination {destination}'
+
+        move_mock.side_effect = _move_mock
+
+        test_result = composable._run()
+        assert test_result == 0, 'expect success'
+        # 42 = 30 science files + 12 preview files, the same as when the unit of work is a file
+        assert client_mock.return_value.data_client.put.call_count == 42, 'put call count'
+        # 6 = once per observation, instead of once per archived file
+        assert client_mock.return_value.metadata_client.read.call_count == 6, 'meta read call count'
+        assert client_mock.return_value.metadata_client.create.call_count == 6, 'meta create call count'
+        assert client_mock.return_value.metadata_client.update.call_count == 0, 'meta update call count'
+        prefix = os.path.basename(tmp_path.as_posix())
+        report_fqn = f'{tmp_path.as_posix()}/logs/{prefix}_report.txt'
+        # 18 = 6 observations + 12 sentinel files
+        _check_report_file(report_fqn, 18)
+    finally:
+        os.chdir(orig_cwd)
+
+
 def test_run_scrape(test_config, tmp_path):
     test_config.change_working_directory(tmp_path.as_posix())
     test_config.logging_level = 'INFO'
@@ -275,6 +351,307 @@ def test_run_scrape(test_config, tmp_path):
         os.chdir(orig_cwd)
 
 
+def test_run_scrape_parallel(test_config, tmp_path):
+    test_config.change_working_directory(tmp_path.as_posix())
+    test_config.logging_level = 'INFO'
+    test_config.use_local_files = True
+    test_config.data_sources = [f'{test_main_app.TEST_DATA_DIR}/HD36486']
+    test_config.data_source_extensions = test_data_source.EXTENSIONS
+    test_config.task_types = [mc.TaskType.SCRAPE]
+    orig_cwd = os.getcwd()
+    try:
+        os.chdir(tmp_path.as_posix())
+        mc.Config.write_to_file(test_config)
+        with open(f'{tmp_path.as_posix()}/config.yml', 'a') as f:
+            f.write('ingest_workers: 3\n')
+        with patch(
+            'brite2caom2.composable._get_brite_settings', wraps=composable._get_brite_settings
+        ) as settings_mock:
+            test_result = composable._run()
+        assert test_result == 0, 'wrong return value'
+        # the workers use the settings of the parent process
+        assert settings_mock.call_count == 1, 'config.yml should be read once per run'
+        previews = glob.glob(f'{tmp_path.as_posix()}/*/*.jpg')
+        assert len(previews) == 18, 'preview generation failed'
+        # the worker counts are merged into the report - 63 = 7 files * 9 observations
+        _check_report_file(test_config.report_fqn, 63)
+    finally:
+        os.chdir(orig_cwd)
+
+
+def test_run_scrape_stream(test_config, tmp_path):
+    test_config.change_working_directory(tmp_path.as_posix())
+    test_config.logging_level = 'INFO'
+    test_config.use_local_files = True
+    test_config.data_sources = [f'{test_main_app.TEST_DATA_DIR}/HD36486']
+    test_config.data_source_extensions = test_data_source.EXTENSIONS
+    test_config.task_types = [mc.TaskType.SCRAPE]
+    orig_cwd = os.getcwd()
+    try:
+        os.chdir(tmp_path.as_posix())
+        mc.Config.write_to_file(test_config)
+        with open(f'{tmp_path.as_posix()}/config.yml', 'a') as f:
+            f.write('stream_queue_size: 2\n')
+        test_result = composable._run()
+        assert test_result == 0, 'wrong return value'
+        previews = glob.glob(f'{tmp_path.as_posix()}/*/*.jpg')
+        assert len(previews) == 18, 'preview generation failed'
+        _check_report_file(test_config.report_fqn, 63)
+    finally:
+        os.chdir(orig_cwd)
+
+
+def test_shard_by_obs():
+    test_todo_list = deque(
+        [f'/data/A{ii}' for ii in test_data_source.EXTENSIONS]
+        + [('/data/B.avedb', '/data/B.rlogdb')]
+        + [f'/data/C{ii}' for ii in ['.orig', '.rlogdb']]
+    )
+    test_result = composable.BriteTodoRunner._shard_by_obs(test_todo_list, 2)
+    assert len(test_result) == 2, 'wrong shard count'
+    assert test_result[0] == [f'/data/A{ii}' for ii in test_data_source.EXTENSIONS], 'A stays together, in order'
+    assert test_result[1] == ['/data/C.orig', '/data/C.rlogdb', ('/data/B.avedb', '/data/B.rlogdb')], 'wrong shard'
+    assert len(composable.BriteTodoRunner._shard_by_obs(test_todo_list, 8)) == 3, 'no empty shards'
+
+
+@patch('brite2caom2.composable.ClientCollection')
+def test_init_worker(client_mock, test_config, tmp_path):
+    # a worker replaces the clients, and the TargetResolver, it inherits from the parent process
+    test_config.change_working_directory(tmp_path.as_posix())
+    parent_clients = Mock()
+    parent_stage = composable.transfer.AsyncTransferStage(parent_clients.data_client, 3)
+    parent_clients.data_client = parent_stage
+    data_source_mock = Mock()
+    metadata_reader = composable.reader.BriteFileMetadataReader()
+    parent_resolver = metadata_reader.target_resolver
+    test_subject = composable.BriteTodoRunner.__new__(composable.BriteTodoRunner)
+    test_subject._config = test_config
+    test_subject._transfer_stage = parent_stage
+    test_subject._clients = parent_clients
+    test_subject._settings = {'target_resolver_offline': True}
+    test_subject._metadata_reader = metadata_reader
+    worker_clients = client_mock.return_value
+    worker_data_client = worker_clients.data_client
+
+    composable._init_worker(test_subject, data_source_mock)
+    assert composable._worker_runner is test_subject, 'wrong worker runner'
+    assert composable._worker_data_source is data_source_mock, 'wrong worker data source'
+    data_source_mock.set_client.assert_called_once_with(worker_data_client)
+    assert test_subject._transfer_stage is not parent_stage, 'expect a worker transfer stage'
+    assert test_subject._transfer_stage.lookahead == 3, 'wrong worker transfer lookahead'
+    assert test_subject._transfer_stage._client is worker_data_client, 'wrong worker transfer client'
+    assert parent_clients.data_client is test_subject._transfer_stage, 'store through the worker transfer stage'
+    assert parent_clients.metadata_client is worker_clients.metadata_client, 'wrong worker metadata client'
+    assert metadata_reader.target_resolver is not parent_resolver, 'expect a worker TargetResolver'
+
+
+@patch('brite2caom2.composable.reader.BriteStorageClientMetadataReader')
+@patch('brite2caom2.composable.ClientCollection')
+def test_common_init_cache_bounds(client_mock, reader_mock, test_config, tmp_path):
+    # only BriteTodoRunner releases the cached content after the last file of an Observation, so the cache is bounded
+    # by default, for run_by_todo and run_by_state
+    test_config.change_working_directory(tmp_path.as_posix())
+    test_config.use_local_files = False
+    orig_cwd = os.getcwd()
+    try:
+        os.chdir(tmp_path)
+        mc.Config.write_to_file(test_config)
+        composable._common_init()
+        kwargs = reader_mock.call_args.kwargs
+        assert kwargs['max_observations'] == composable.DEFAULT_CACHE_MAX_OBSERVATIONS, 'wrong default observations'
+        assert kwargs['max_bytes'] == composable.DEFAULT_CACHE_MAX_BYTES, 'wrong default bytes'
+
+        with open(f'{tmp_path.as_posix()}/config.yml', 'a') as f:
+            f.write('metadata_cache_max_observations: 3\nmetadata_cache_max_bytes: null\n')
+        composable._common_init()
+        kwargs = reader_mock.call_args.kwargs
+        assert kwargs['max_observations'] == 3, 'wrong configured observations'
+        assert kwargs['max_bytes'] is None, 'expect no bytes bound'
+    finally:
+        os.chdir(orig_cwd)
+
+
+@patch('caom2pipe.run_composable.TodoRunner._run_todo_list')
+def test_run_work_queue_transfer_stage(run_mock, test_config):
+    # the transfer stage stays open across the Observations of a streaming run, and is closed once
+    test_config.task_types = [mc.TaskType.STORE]
+    stage_mock = Mock()
+    test_subject = composable.BriteTodoRunner.__new__(composable.BriteTodoRunner)
+    test_subject._config = test_config
+    test_subject._transfer_stage = stage_mock
+    test_subject._organizer = Mock()
+    test_subject._organizer.complete_record_count = 0
+    test_subject._logger = Mock()
+    test_subject._producer = threading.Thread(target=lambda: None)
+    test_subject._producer.start()
+    test_subject._work_queue = queue.Queue()
+    for obs_id in ['A', 'B']:
+        test_subject._work_queue.put([f'/data/{obs_id}.orig', f'/data/{obs_id}.rlogdb'])
+    test_subject._work_queue.put(None)
+    data_source_mock = Mock()
+    data_source_mock.take_observation.side_effect = lambda files: files
+
+    def _run_todo_list_mock(data_source, current_count):
+        assert not stage_mock.close.called, 'expect an open transfer stage'
+        test_subject._todo_list.clear()
+        return 0
+
+    run_mock.side_effect = _run_todo_list_mock
+    assert test_subject._run_todo_list(data_source_mock, 0) == 0, 'wrong result'
+    assert run_mock.call_count == 2, 'expect a list of work per Observation'
+    stage_mock.close.assert_called_once_with()
+
+
+@patch('caom2pipe.run_composable.TodoRunner._run_todo_list')
+def test_run_work_queue_group_by_obs(run_mock, test_config):
+    # when streaming, with group_by_observation, an Observation is one record, and each sentinel file is one record
+    test_config.task_types = [mc.TaskType.INGEST]
+    test_config.cleanup_files_when_storing = False
+    test_config.data_source_extensions = test_data_source.EXTENSIONS
+    test_config.data_sources = ['/data']
+    reporter_mock = Mock()
+    data_source = composable.BriteLocalFilesDataSource(test_config, Mock(), Mock(), recursive=True, group_by_obs=True)
+    data_source.reporter = reporter_mock
+    test_subject = composable.BriteTodoRunner.__new__(composable.BriteTodoRunner)
+    test_subject._config = test_config
+    test_subject._transfer_stage = None
+    test_subject._organizer = Mock()
+    test_subject._organizer.complete_record_count = 0
+    test_subject._logger = Mock()
+    test_subject._producer = threading.Thread(target=lambda: None)
+    test_subject._producer.start()
+    test_subject._work_queue = queue.Queue()
+    for obs_id in ['A', 'B']:
+        test_subject._work_queue.put([f'/data/{obs_id}{ii}' for ii in test_data_source.EXTENSIONS])
+    test_subject._work_queue.put(None)
+    processed = []
+
+    def _run_todo_list_mock(data_source, current_count):
+        processed.extend(test_subject._todo_list)
+        test_subject._todo_list.clear()
+        return 0
+
+    run_mock.side_effect = _run_todo_list_mock
+    assert test_subject._run_todo_list(data_source, 0) == 0, 'wrong result'
+    archived = ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb']
+    assert processed == [tuple(f'/data/{obs_id}{ii}' for ii in archived) for obs_id in ['A', 'B']], 'wrong work'
+    # 6 = 2 Observations + 4 sentinel files, the same as the count for the files without streaming
+    assert test_subject._organizer.complete_record_count == 6, 'wrong record count'
+    assert reporter_mock.capture_success.call_count == 4, 'expect a success for each sentinel file'
+
+
+@patch('caom2pipe.manage_composable.ExecutionReporter.capture_failure')
+def test_brite_execution_reporter(capture_mock, test_config, tmp_path):
+    test_config.change_working_directory(tmp_path.as_posix())
+    test_subject = composable.BriteExecutionReporter(test_config, observable=Mock(autospec=True))
+    assert isinstance(test_subject, mc.ExecutionReporter), 'expect an ExecutionReporter'
+    test_entry = tuple(f'/data/A{ii}' for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb'])
+    test_e = mc.CadcException('failure')
+    test_subject.capture_failure(storage_name.BriteName(test_entry), test_e, 'stack')
+    assert [ii[0][0].source_names for ii in capture_mock.call_args_list] == [[ii] for ii in test_entry], (
+        'expect a failure for every file of the Observation'
+    )
+    assert all(ii[0][1:] == (test_e, 'stack') for ii in capture_mock.call_args_list), 'wrong failure'
+    test_subject.capture_failure(storage_name.BriteName('/data/B.orig'), test_e, 'stack')
+    assert capture_mock.call_args[0][0].source_names == ['/data/B.orig'], 'expect a file failure'
+    assert capture_mock.call_count == 6, 'wrong failure count'
+
+    # the runner specializes the reporter instance that the organizer and the data sources share
+    reporter = mc.ExecutionReporter(test_config, observable=Mock(autospec=True))
+    composable.BriteTodoRunner(test_config, Mock(), Mock(), [], Mock(), Mock(), reporter)
+    assert isinstance(reporter, composable.BriteExecutionReporter), 'expect a specialized reporter'
+
+
+@patch('caom2pipe.manage_composable.ExecutionReporter.capture_success')
+@patch('caom2pipe.manage_composable.ExecutionReporter.capture_failure')
+def test_brite_execution_reporter_recorded(capture_failure_mock, capture_success_mock, test_config, tmp_path):
+    # a worker records its successes and failures, and the parent process reports them
+    test_config.change_working_directory(tmp_path.as_posix())
+    worker_reporter = composable.BriteExecutionReporter(test_config, observable=Mock(autospec=True))
+    worker_reporter.record()
+    worker_reporter.capture_success('A', 'A.orig', 1.0)
+    test_entry = tuple(f'/data/B{ii}' for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb'])
+    worker_reporter.capture_failure(storage_name.BriteName(test_entry), mc.CadcException('failure'), 'stack')
+    assert not capture_success_mock.called, 'no success reported by the worker'
+    assert not capture_failure_mock.called, 'no failure reported by the worker'
+    # the recorded reports are returned from the worker process to the parent process
+    recorded = pickle.loads(pickle.dumps(worker_reporter.take_recorded()))
+    assert worker_reporter.take_recorded() == [], 'recorded reports are taken once'
+
+    test_subject = composable.BriteExecutionReporter(test_config, observable=Mock(autospec=True))
+    test_subject.report_recorded(recorded)
+    capture_success_mock.assert_called_once_with('A', 'A.orig', 1.0)
+    assert [ii[0][0].source_names for ii in capture_failure_mock.call_args_list] == [[ii] for ii in test_entry], (
+        'expect a failure for every file of the Observation'
+    )
+    assert all(str(ii[0][1]) == 'failure' and ii[0][2] == 'stack' for ii in capture_failure_mock.call_args_list), (
+        'wrong failure'
+    )
+
+
+@patch('caom2pipe.run_composable.TodoRunner._process_entry')
+def test_process_entry_release(process_mock):
+    # the cached content for an Observation is released after its last file, whether or not the processing succeeds
+    test_subject = composable.BriteTodoRunner.__new__(composable.BriteTodoRunner)
+    test_subject._metadata_reader = Mock()
+    test_subject._transfer_stage = None
+    process_mock.return_value = 0
+    for entry in [f'/data/A{ii}' for ii in test_data_source.EXTENSIONS if ii != '.rlogdb']:
+        assert test_subject._process_entry(None, entry, 0) == 0, 'wrong result'
+    assert not test_subject._metadata_reader.release.called, 'no release before the last file'
+    process_mock.side_effect = mc.CadcException('preview failure')
+    with pytest.raises(mc.CadcException):
+        test_subject._process_entry(None, '/data/A.rlogdb', 0)
+    test_subject._metadata_reader.release.assert_called_once_with('A')
+    process_mock.side_effect = None
+    test_subject._process_entry(None, ('/data/B.avedb', '/data/B.rlogdb'), 0)
+    test_subject._metadata_reader.release.assert_called_with('B')
+
+
+@patch('caom2pipe.run_composable.TodoRunner._process_entry')
+def test_process_entry_prefetch(process_mock, test_config):
+    # the files of the next entry are uploaded while an entry is processed, and an entry that is rejected after its
+    # upload started has the stored file reported
+    test_config.task_types = [mc.TaskType.STORE]
+    client_mock = Mock()
+    stage = composable.transfer.AsyncTransferStage(client_mock, 1)
+    test_subject = composable.BriteTodoRunner.__new__(composable.BriteTodoRunner)
+    test_subject._config = test_config
+    test_subject._metadata_reader = Mock()
+    test_subject._reporter = Mock()
+    test_subject._logger = Mock()
+    test_subject._transfer_stage = stage
+    # C is in the rejected list before the run starts, so it is not uploaded ahead
+    test_subject._rejected = Mock()
+    test_subject._rejected.is_bad_metadata.side_effect = lambda obs_id: obs_id == 'C'
+    test_subject._todo_list = deque([f'/data/{ii}.orig' for ii in ['A', 'B', 'C', 'D']])
+
+    def _process_entry_mock(data_source, entry, current_count):
+        obs_id = basename(entry).split('.')[0]
+        if obs_id in ['A', 'D']:
+            stage.put('/data', f'cadc:BRITE-Constellation/{obs_id}.orig')
+            return 0
+        # B and C are rejected, without a put
+        return -1
+
+    process_mock.side_effect = _process_entry_mock
+    try:
+        while len(test_subject._todo_list) > 0:
+            entry = test_subject._todo_list.popleft()
+            test_subject._process_entry(None, entry, 0)
+        assert stage.in_flight == 0, 'nothing left in flight'
+    finally:
+        stage.close()
+    # one entry ahead, so D is not uploaded until A is done
+    assert [ii.args[1] for ii in client_mock.put.call_args_list] == [
+        'cadc:BRITE-Constellation/B.orig',
+        'cadc:BRITE-Constellation/A.orig',
+        'cadc:BRITE-Constellation/D.orig',
+    ], 'wrong puts'
+    test_subject._reporter.capture_success.assert_called_once_with('B', 'B.orig', ANY)
+    assert test_subject._logger.warning.call_count == 1, 'expect a warning for B'
+
+
 @patch('brite2caom2.composable.ClientCollection')
 @patch('cadcutils.net.ws.WsCapabilities.get_access_url')
 def test_run_reingest_retry(access_mock, client_mock, test_config, tmp_path):
@@ -335,7 +712,17 @@ def test_run_reingest_retry(access_mock, client_mock, test_config, tmp_path):
         with open(test_config.proxy_fqn, 'w') as f:
             f.write('test content')
 
-        test_result = composable._run()
+        # keep a reference to the MetadataReader, for its counts
+        metadata_readers = []
+        common_init_orig = composable._common_init
+
+        def _common_init_mock():
+            result = common_init_orig()
+            metadata_readers.append(result[3])
+            return result
+
+        with patch('brite2caom2.composable._common_init', side_effect=_common_init_mock):
+            test_result = composable._run()
         assert test_result == 0, 'expect success'
         assert (
             client_mock.return_value.data_client.info.call_count == 30
@@ -343,8 +730,25 @@ def test_run_reingest_retry(access_mock, client_mock, test_config, tmp_path):
         assert client_mock.return_value.data_client.put.called, 'put called for previews'
         assert client_mock.return_value.data_client.put.call_count == 12, 'wrong put previews call count'
         assert client_mock.return_value.data_client.get.called, 'get should be called'
-        # 48 = 6 observation * 5 files/observation + 6 observations * 3 re-read files (.avedb, .orig, .ndatdb) / observation needing cadcget retrieval
-        assert client_mock.return_value.data_client.get.call_count == 48, 'get call count'
+        metadata_reader = metadata_readers[0]
+        metrics = metadata_reader.metrics
+        # 18 = 6 observations * 3 files with time series content (.orig, .ndatdb, .avedb), each parsed once
+        assert metrics['parse'] == 18, f'parse count {metrics}'
+        # each of those files is looked up 2 times per observation: once when it is the file being processed, and
+        # once by get_entry - from the .ndatdb mapping for the .orig, and from the .rlogdb preview for the .ndatdb
+        # and .avedb. One of the two look-ups is the parse, the other is a cache hit.
+        assert metadata_reader.cache_misses == 18, f'cache misses {metadata_reader.cache_misses}'
+        assert metadata_reader.cache_hits == 18, f'cache hits {metadata_reader.cache_hits}'
+        # the preview content is all in the cache
+        assert metrics['preview_parse'] == 0, f'preview parse count {metrics}'
+        assert metrics['preview_transfer'] == 0, f'preview transfer count {metrics}'
+        # every parse is of content transferred from CADC storage, by cadcget in the MetadataReader, or by get in
+        # get_entry, and the other get calls are the once-per-file retrievals by the MODIFY task
+        assert metrics['transfer'] == metrics['parse'], f'transfer count {metrics}'
+        assert (
+            client_mock.return_value.data_client.get.call_count
+            == 30 + metrics['transfer'] - client_mock.return_value.data_client.cadcget.call_count
+        ), 'get call count'
         assert client_mock.return_value.data_client.cadcget.called, 'cadcget should be called'
         # 12 = 6 observations * 2 files (.avedb, .ndatdb) / observation needing cadcget retrieval
         # the get vs cadcget calls => cadcget is for the MetadataReader specialization, which does a
@@ -69,10 +69,16 @@
 
 
 from caom2pipe.manage_composable import Config, ExecutionReporter, TaskType
-from brite2caom2.data_source import BriteLocalFilesDataSource
+from brite2caom2.checksum import ChecksumIndex
+from brite2caom2.data_source import BriteLocalFilesDataSource, index_by_obs, PrefetchedInfoClient
 
 import conftest
+import hashlib
 import pytest
+import queue
+import threading
+
+from collections import deque
 from mock import call, Mock, patch
 
 
@@ -208,6 +214,217 @@ def test_data_source_mixed_bag_todo_cleanup(clients_mock, move_mock, test_config
         assert test_reporter._summary._errors_sum == 6, f'wrong error {test_reporter._summary}'
 
 
+@patch('brite2caom2.data_source.BriteLocalFilesDataSource._move_action')
+@patch('caom2pipe.client_composable.ClientCollection')
+def test_data_source_group_by_obs(clients_mock, move_mock, test_config_ds, tmp_path):
+    test_config_ds.change_working_directory(tmp_path.as_posix())
+    clients_mock.return_value.data_client.info.return_value = None
+
+    test_reader = Mock()
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds, clients_mock.return_value.data_client, test_reader, recursive=True, group_by_obs=True
+    )
+    test_reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    test_subject.reporter = test_reporter
+
+    # one missing a file, two correct observations
+    test_listing = (
+        _create_dir_listing(EXTENSIONS[:-1])
+        + _create_dir_listing(EXTENSIONS, 'B')
+        + _create_dir_listing(EXTENSIONS, 'C')
+    )
+    with patch('os.scandir') as scandir_mock:
+        scandir_mock.return_value.__enter__.return_value = test_listing
+        test_subject.get_work()
+        test_subject.group_work_by_obs()
+        test_subject.remove_unarchived()
+        test_result = list(test_subject._work)
+        assert len(test_result) == 2, 'one entry per complete observation'
+        for prefix in ['B', 'C']:
+            assert (
+                tuple(f'/test_files/{prefix}{ii}' for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb'])
+                in test_result
+            ), f'wrong grouping for {prefix}'
+        assert test_reporter._summary._errors_sum == 6, f'wrong error {test_reporter._summary}'
+        assert test_reporter._summary._success_sum == 4, f'wrong report {test_reporter._summary}'
+
+
+@patch('brite2caom2.data_source.BriteLocalFilesDataSource._move_action')
+@patch('caom2pipe.client_composable.ClientCollection')
+def test_data_source_prefetch_info(clients_mock, move_mock, test_config_ds, tmp_path):
+    test_config_ds.change_working_directory(tmp_path.as_posix())
+    clients_mock.return_value.data_client.info.return_value = None
+
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds, clients_mock.return_value.data_client, Mock(), recursive=True, info_workers=3
+    )
+    test_subject.reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    test_listing = _create_dir_listing(EXTENSIONS) + _create_dir_listing(EXTENSIONS, 'B')
+    with patch('os.scandir') as scandir_mock:
+        scandir_mock.return_value.__enter__.return_value = test_listing
+        test_subject.get_work()
+    assert len(test_subject._work) == 14, 'wrong work'
+    # one info call per archived file, from the prefetch, none from default_filter
+    assert clients_mock.return_value.data_client.info.call_count == 10, 'wrong info count'
+    info_uris = [ii.args[0] for ii in clients_mock.return_value.data_client.info.call_args_list]
+    assert len([ii for ii in info_uris if ii.endswith('/B.orig')]) == 1, 'wrong info calls'
+
+
+@patch('brite2caom2.data_source.BriteLocalFilesDataSource._move_action')
+@patch('caom2pipe.client_composable.ClientCollection')
+def test_data_source_md5_sentinel(clients_mock, move_mock, test_config_ds, tmp_path):
+    test_config_ds.change_working_directory(tmp_path.as_posix())
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    test_config_ds.data_sources = [data_dir.as_posix()]
+    checksums = {}
+    for ii in EXTENSIONS:
+        if ii != '.md5':
+            (data_dir / f'A{ii}').write_text(f'content {ii}')
+            checksums[f'A{ii}'] = hashlib.md5(f'content {ii}'.encode()).hexdigest()
+    (data_dir / 'A.md5').write_text(''.join(f'{value}  {key}\n' for key, value in checksums.items()))
+
+    def _info_mock(uri):
+        # only the .avedb file is already stored
+        if uri.endswith('.avedb'):
+            return Mock(md5sum=f'md5:{checksums["A.avedb"]}')
+        return None
+
+    clients_mock.return_value.data_client.info.side_effect = _info_mock
+    index_fqn = (tmp_path / 'checksums.json').as_posix()
+
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds,
+        clients_mock.return_value.data_client,
+        Mock(),
+        recursive=True,
+        checksum_index=ChecksumIndex(index_fqn),
+    )
+    test_subject.reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    with patch('brite2caom2.data_source.LocalFilesDataSource.default_filter') as super_filter_mock:
+        test_subject.get_work()
+        # the delivered checksums are used, so the parent class does not calculate any
+        assert not super_filter_mock.called, 'expect the .md5 checksums to be used'
+    assert f'{data_dir}/A.avedb' not in test_subject._work, 'stored file should be skipped'
+    assert len(test_subject._work) == 6, 'wrong work'
+    assert move_mock.call_args.args[0] == f'{data_dir}/A.avedb', 'stored file should be cleaned up'
+    assert clients_mock.return_value.data_client.info.call_count == 5, 'wrong info count'
+
+    # the verified file is not checked again
+    clients_mock.return_value.data_client.info.reset_mock()
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds,
+        clients_mock.return_value.data_client,
+        Mock(),
+        recursive=True,
+        checksum_index=ChecksumIndex(index_fqn),
+    )
+    test_subject.reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    test_subject.get_work()
+    assert clients_mock.return_value.data_client.info.call_count == 4, 'wrong verified info count'
+    assert len(test_subject._work) == 6, 'wrong verified work'
+
+
+@patch('caom2pipe.client_composable.ClientCollection')
+def test_data_source_scan(clients_mock, test_config_ds, tmp_path):
+    test_config_ds.change_working_directory(tmp_path.as_posix())
+    test_config_ds.store_modified_files_only = False
+    data_dir = tmp_path / 'data'
+    test_config_ds.data_sources = [data_dir.as_posix()]
+    for season, prefix in [('2019', 'B'), ('2017/BAb', 'A'), ('2021', 'C')]:
+        (data_dir / season).mkdir(parents=True)
+        for ii in EXTENSIONS + ['.txt']:
+            (data_dir / season / f'{prefix}{ii}').write_text(ii)
+        (data_dir / season / f'.{prefix}.avedb').write_text('hidden')
+
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds, clients_mock.return_value.data_client, Mock(), recursive=True, scan_workers=2
+    )
+    test_subject.reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    test_subject.get_work()
+    expected = [
+        f'{data_dir}/{season}/{prefix}{ii}'
+        for season, prefix in [('2017/BAb', 'A'), ('2019', 'B'), ('2021', 'C')]
+        for ii in EXTENSIONS
+    ]
+    assert list(test_subject._work) == expected, 'wrong work'
+    assert test_subject._work_index['B'] == expected[7:14], 'wrong index'
+    assert not clients_mock.return_value.data_client.info.called, 'no storage checks'
+
+
+@patch('brite2caom2.data_source.BriteLocalFilesDataSource._move_action')
+@patch('caom2pipe.client_composable.ClientCollection')
+def test_data_source_stream_work(clients_mock, move_mock, test_config_ds, tmp_path):
+    test_config_ds.change_working_directory(tmp_path.as_posix())
+    test_config_ds.store_modified_files_only = False
+    data_dir = tmp_path / 'data'
+    test_config_ds.data_sources = [data_dir.as_posix()]
+    for season, prefix, extensions in [
+        ('2017', 'A', EXTENSIONS),
+        ('2019', 'B', EXTENSIONS[:-1]),
+        ('2021', 'C', EXTENSIONS),
+    ]:
+        (data_dir / season).mkdir(parents=True)
+        for ii in extensions:
+            (data_dir / season / f'{prefix}{ii}').write_text(ii)
+
+    test_subject = BriteLocalFilesDataSource(
+        test_config_ds, clients_mock.return_value.data_client, Mock(), recursive=True, group_by_obs=True
+    )
+    test_reporter = ExecutionReporter(test_config_ds, observable=Mock(autospec=True))
+    test_subject.reporter = test_reporter
+    # the reporter and the file moves are only used by the consumer thread
+    move_threads = set()
+    move_mock.side_effect = lambda *args: move_threads.add(threading.current_thread())
+    work_queue = queue.Queue(maxsize=1)
+    producer = threading.Thread(target=test_subject.stream_work, args=(work_queue,))
+    producer.start()
+    test_result = []
+    while True:
+        files = work_queue.get()
+        test_subject.run_deferred()
+        if files is None:
+            break
+        test_result.extend(test_subject.take_observation(files))
+    producer.join()
+
+    assert sorted(test_result) == [
+        tuple(f'{data_dir}/{season}/{prefix}{ii}' for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb'])
+        for season, prefix in [('2017', 'A'), ('2021', 'C')]
+    ], 'wrong streamed work'
+    # the incomplete Observation is rejected at the end of the scan
+    assert test_reporter._summary._errors_sum == 6, f'wrong error {test_reporter._summary}'
+    assert test_reporter._summary._success_sum == 4, f'wrong success {test_reporter._summary}'
+    assert move_mock.call_count == 10, 'wrong move count'
+    assert move_threads == {threading.current_thread()}, 'expect moves by the consumer thread only'
+
+
+def test_index_by_obs():
+    test_work = deque(['/data/B.avedb', '/data/A.orig', '/data/B.md5', '/data/A.avedb'])
+    test_result = index_by_obs(test_work)
+    assert list(test_result.keys()) == ['B', 'A'], 'wrong observations'
+    assert test_result['A'] == ['/data/A.orig', '/data/A.avedb'], 'wrong order'
+    # the runner holds a reference to the list of work, so it's changed in place
+    BriteLocalFilesDataSource._remove_in_place(test_work, lambda x: x.endswith('.md5'))
+    assert list(test_work) == ['/data/B.avedb', '/data/A.orig', '/data/A.avedb'], 'wrong work'
+
+
+def test_prefetched_info_client():
+    client_mock = Mock()
+    client_mock.info.side_effect = lambda uri: f'info {uri}'
+    test_subject = PrefetchedInfoClient(client_mock)
+    test_subject.prefetch(['cadc:TEST/a.avedb', 'cadc:TEST/b.avedb'], 2)
+    assert client_mock.info.call_count == 2, 'wrong prefetch count'
+    # answered by name, once
+    assert test_subject.info('ad:TEST/a.avedb') == 'info cadc:TEST/a.avedb', 'wrong prefetched result'
+    assert client_mock.info.call_count == 2, 'expect prefetched result'
+    assert test_subject.info('cadc:TEST/a.avedb') == 'info cadc:TEST/a.avedb', 'wrong result'
+    assert client_mock.info.call_count == 3, 'expect client call'
+    test_subject.clear()
+    test_subject.info('cadc:TEST/b.avedb')
+    assert client_mock.info.call_count == 4, 'expect client call after clear'
+
+
 def _create_dir_listing(extensions, prefix='A'):
     stat_return_value = type('', (), {})
     stat_return_value.st_mtime = 1579740835.7357888
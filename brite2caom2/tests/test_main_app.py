@@ -68,16 +68,19 @@
 #
 import brite2caom2.storage_name
 from brite2caom2 import fits2caom2_augmentation
+from caom2 import Algorithm, Artifact, Axis, Chunk, CoordAxis1D, CoordRange1D, Part, Plane, ProductType, RefCoord
+from caom2 import ReleaseType, SimpleObservation, TemporalWCS
 from caom2.diff import get_differences
 from caom2pipe.caom_composable import get_all_artifact_keys
 from caom2pipe import manage_composable as mc
-from brite2caom2 import reader
+from brite2caom2 import main_app, reader
+from brite2caom2.resolver import TargetResolver
 from datetime import datetime
 
 import glob
 import os
 
-from mock import patch
+from mock import Mock, patch
 
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -86,10 +89,13 @@ PLUGIN = os.path.join(os.path.dirname(THIS_DIR), 'main_app.py')
 
 
 def pytest_generate_tests(metafunc):
-    obs_id_list = [
-        ii for ii in glob.glob(f'{TEST_DATA_DIR}/*/*') if ('xml' not in ii and '.md5' not in ii and '.lst' not in ii)
-    ]
-    metafunc.parametrize('test_name', obs_id_list)
+    if 'test_name' in metafunc.fixturenames:
+        obs_id_list = [
+            ii
+            for ii in glob.glob(f'{TEST_DATA_DIR}/*/*')
+            if ('xml' not in ii and '.md5' not in ii and '.lst' not in ii)
+        ]
+        metafunc.parametrize('test_name', obs_id_list)
 
 
 @patch('caom2pipe.client_composable.ClientCollection')
@@ -137,6 +143,172 @@ def test_main_app(clients_mock, test_name, test_config):
     # assert False  # cause I want to see logging messages
 
 
+def test_accumulate_blueprint(test_config):
+    metadata_reader = reader.BriteFileMetadataReader()
+    headers = {
+        'A.orig': {
+            'SatellID': 'BLb', 'SatfulID': 'BRITE-Lem', 'StarInFo': 'HD 1, 00:00:00, +10:00:00', 'ObsExpoT': '1000'
+        },
+        'B.orig': {'SatellID': 'BHr', 'SatfulID': 'BRITE-Heweliusz', 'StarInFo': 'HD 2, 01:00:00, +20:00:00'},
+    }
+    plans = {}
+    for f_name, metadata in headers.items():
+        storage_name = Mock(file_uri=f'cadc:BRITE-Constellation/{f_name}')
+        metadata_reader.metadata[storage_name.file_uri] = reader.BriteOrigHeader(metadata)
+        test_subject = main_app.BriteUndecorrelatedMapping(
+            storage_name, metadata_reader, Mock(), Mock(), None, test_config
+        )
+        bp = Mock()
+        test_subject.accumulate_blueprint(bp)
+        plans[f_name] = {ii[0][0]: ii[0][1] for ii in bp.set.call_args_list}
+        # the Chunk is built directly, so there is no WCS configuration in the blueprint
+        bp.configure_position_axes.assert_not_called()
+        assert not any(ii.startswith('Chunk.') for ii in plans[f_name]), 'no Chunk keys'
+
+    assert plans['A.orig']['Observation.target.standard'] is False, 'wrong A standard'
+    assert plans['B.orig']['Observation.target.standard'] is False, 'wrong B standard'
+
+    assert plans['A.orig']['Observation.target.name'] == 'HD 1', 'wrong A target'
+    assert plans['B.orig']['Observation.target.name'] == 'HD 2', 'wrong B target'
+    assert plans['B.orig']['Observation.telescope.name'] == 'BRITE-Heweliusz', 'wrong B telescope'
+    assert 'Observation.metaRelease' in plans['A.orig'], 'expect a release date'
+
+
+def test_build_chunk(test_config):
+    # the StarInFo coordinates are used, so the name is not resolved, even offline
+    metadata_reader = reader.BriteFileMetadataReader(target_resolver=TargetResolver(offline=True))
+    storage_name = Mock(file_uri='cadc:BRITE-Constellation/C.orig')
+    metadata_reader.metadata[storage_name.file_uri] = reader.BriteOrigHeader(
+        {
+            'SatellID': 'UBr',
+            'SatfulID': 'UniBRITE',
+            'StarInFo': 'HD 3, 02:00:00, +30:00:00',
+            'InstPScl': '27',
+            'ObsExpoT': '3000',
+        }
+    )
+    metadata_reader.summaries[storage_name.file_uri] = reader.SeriesSummary(
+        2458029.58226200007, 2458056.97917999979, 10, None, None, None, None
+    )
+    test_subject = main_app.BriteUndecorrelatedMapping(storage_name, metadata_reader, Mock(), Mock(), None, test_config)
+    artifact = Artifact(storage_name.file_uri, ProductType.SCIENCE, ReleaseType.DATA)
+    artifact.meta_producer = 'brite2caom2/0.1.0'
+    other_artifact = Artifact('cadc:BRITE-Constellation/C.rlogdb', ProductType.INFO, ReleaseType.DATA)
+    for _ in range(2):
+        # the second time is a re-ingest, which re-uses the Part and Chunk
+        test_subject._update_artifact(artifact)
+        test_subject._update_artifact(other_artifact)
+        assert list(artifact.parts.keys()) == ['0'], 'wrong parts'
+        assert len(artifact.parts['0'].chunks) == 1, 'wrong chunks'
+        assert len(other_artifact.parts) == 0, 'the Chunk is only built for the mapped file'
+
+    chunk = artifact.parts['0'].chunks[0]
+    assert chunk.meta_producer == 'brite2caom2/0.1.0', 'wrong meta_producer'
+    assert chunk.naxis is None and chunk.position_axis_1 is None and chunk.time_axis is None, 'no cutouts'
+    assert chunk.position.coordsys == 'ICRS', 'wrong coordsys'
+    assert chunk.position.axis.axis1.ctype == 'RA---TAN', 'wrong axis1'
+    assert chunk.position.axis.axis2.cunit == 'deg', 'wrong axis2'
+    assert chunk.position.axis.function.dimension.naxis1 == 1, 'wrong naxis1'
+    assert chunk.position.axis.function.ref_coord.coord1.val == 30.0, 'wrong RA'
+    assert chunk.position.axis.function.ref_coord.coord2.val == 30.0, 'wrong Dec'
+    assert chunk.position.axis.function.cd11 == 27.0 * 5.0 / 3600.0, 'wrong cd11'
+    assert chunk.position.axis.function.cd12 == 0.0, 'wrong cd12'
+    assert chunk.energy.bandpass_name == 'Red', 'wrong bandpass'
+    assert chunk.energy.specsys == 'TOPOCENT', 'wrong specsys'
+    assert chunk.energy.axis.range.start.val == 0.54 * 10e-7, 'wrong energy start'
+    assert chunk.energy.axis.range.end.pix == 1.5, 'wrong energy end'
+    assert chunk.energy.axis.function is None, 'using range'
+    assert chunk.time.timesys == 'UTC', 'wrong timesys'
+    assert chunk.time.exposure == 3.0, 'wrong exposure'
+    assert chunk.time.axis.range.start.val == 2458029.58226200007 - 2400000.5, 'wrong time start'
+    assert chunk.time.axis.range.end.val == 2458056.97917999979 - 2400000.5, 'wrong time end'
+    assert chunk.time.axis.function is None, 'using range'
+
+    # without a plate scale, the reference coordinate and dimension are kept
+    metadata_reader.metadata[storage_name.file_uri].plate_scale = None
+    function = test_subject._build_position().axis.function
+    assert function.dimension.naxis2 == 1, 'wrong naxis2 without a plate scale'
+    assert function.ref_coord.coord2.val == 30.0, 'wrong Dec without a plate scale'
+    assert (function.cd11, function.cd12, function.cd21, function.cd22) == (1.0, 0.0, 0.0, 1.0), 'wrong default cd'
+
+    # without coordinates in StarInFo, the name is resolved
+    metadata_reader.metadata[storage_name.file_uri].coordinates = None
+    metadata_reader.target_resolver.add('HD 3', 31.0, 29.0)
+    function = test_subject._build_position().axis.function
+    assert function.ref_coord.coord1.val == 31.0, 'wrong resolved RA'
+    assert function.ref_coord.coord2.val == 29.0, 'wrong resolved Dec'
+
+
+def test_update_copy_metadata(test_config):
+    obs_id = 'HD37202_31-Tau-I-2017_BLb_1_5_A'
+    observation = SimpleObservation('BRITE-Constellation', obs_id, Algorithm('exposure'))
+    plane = Plane('timeseries')
+    observation.planes.add(plane)
+    for extension in ['.orig', '.ndatdb', '.avedb', '.rlogdb', '_prev.jpg']:
+        plane.artifacts.add(
+            Artifact(f'cadc:BRITE-Constellation/{obs_id}{extension}', ProductType.SCIENCE, ReleaseType.DATA)
+        )
+    dat_artifact = plane.artifacts[f'cadc:BRITE-Constellation/{obs_id}.ndatdb']
+    dat_artifact.parts.add(Part('0'))
+    dat_chunk = Chunk()
+    dat_chunk.time = TemporalWCS(
+        CoordAxis1D(Axis('TIME', 'd'), range=CoordRange1D(RefCoord(0.5, 58038.3), RefCoord(1.5, 58056.9))),
+        timesys='UTC',
+        exposure=3.0,
+    )
+    dat_artifact.parts['0'].chunks.append(dat_chunk)
+    storage_name = Mock(file_uri=f'cadc:BRITE-Constellation/{obs_id}.avedb')
+    test_subject = main_app.BriteMapping(storage_name, Mock(), Mock(), Mock(), observation, test_config)
+
+    def _chunk_ids():
+        return {
+            key: [chunk._id for chunk in artifact.parts['0'].chunks]
+            for key, artifact in plane.artifacts.items()
+            if '0' in artifact.parts.keys()
+        }
+
+    # four archived artifacts is not a complete plane
+    test_subject._update_copy_metadata()
+    assert list(_chunk_ids().keys()) == [dat_artifact.uri], 'expect no copies'
+
+    plane.artifacts.add(
+        Artifact(f'cadc:BRITE-Constellation/{obs_id}.freq0db', ProductType.INFO, ReleaseType.DATA)
+    )
+    test_subject._update_copy_metadata()
+    first_ids = _chunk_ids()
+    assert sorted(ii.split('.')[-1] for ii in first_ids.keys()) == ['avedb', 'freq0db', 'ndatdb', 'rlogdb'], 'copies'
+    assert first_ids[dat_artifact.uri] == [dat_chunk._id], 'the source is not replaced'
+    for key in first_ids.keys():
+        assert main_app.content_hash(plane.artifacts[key].parts['0']) == main_app.content_hash(
+            dat_artifact.parts['0']
+        ), f'wrong content {key}'
+
+    # a re-ingest with the same content does not copy again
+    test_subject._update_copy_metadata()
+    assert _chunk_ids() == first_ids, 'expect no new copies'
+
+    # changed content is copied again
+    dat_chunk.time.exposure = 4.0
+    test_subject._update_copy_metadata()
+    second_ids = _chunk_ids()
+    assert second_ids[dat_artifact.uri] == first_ids[dat_artifact.uri], 'the source is not replaced'
+    for key in second_ids.keys():
+        if key != dat_artifact.uri:
+            assert second_ids[key] != first_ids[key], f'expect a new copy {key}'
+            assert plane.artifacts[key].parts['0'].chunks[0].time.exposure == 4.0, f'wrong exposure {key}'
+
+
+@patch('caom2pipe.caom_composable.TelescopeMapping.update')
+def test_update_last_to_ingest(update_mock, test_config):
+    # the .ndatdb metadata is copied once per plane, for the last file processed
+    for f_name, expected in [('A.avedb', False), ('A.ndatdb', False), ('A.orig', False), ('A.rlogdb', True)]:
+        storage_name = brite2caom2.storage_name.BriteName(f'/data/{f_name}')
+        test_subject = main_app.BriteMapping(storage_name, Mock(), Mock(), Mock(), Mock(), test_config)
+        with patch.object(test_subject, '_update_copy_metadata') as copy_mock:
+            test_subject.update(Mock())
+        assert copy_mock.called == expected, f'wrong copy for {f_name}'
+
+
 def _set_release_date_values(observation):
     # the release date is "the time at which the file is received at CADC", which is random, and therfore hard to
     # test with, so over-ride with a known value before doing the comparison to the expected value
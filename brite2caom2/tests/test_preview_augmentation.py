@@ -68,8 +68,12 @@
 #
 
 import glob
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from os.path import basename
+from PIL import Image
 
+from caom2 import ProductType
 from caom2pipe.caom_composable import get_all_artifact_keys
 from caom2pipe import manage_composable as mc
 
@@ -80,8 +84,9 @@ import test_main_app
 
 
 def pytest_generate_tests(metafunc):
-    obs_id_list = [ii for ii in glob.glob(f'{test_main_app.TEST_DATA_DIR}/*') if '.expected.xml' in ii]
-    metafunc.parametrize('test_name', obs_id_list)
+    if 'test_name' in metafunc.fixturenames:
+        obs_id_list = [ii for ii in glob.glob(f'{test_main_app.TEST_DATA_DIR}/*') if '.expected.xml' in ii]
+        metafunc.parametrize('test_name', obs_id_list)
 
 
 @patch('caom2pipe.client_composable.ClientCollection')
@@ -117,3 +122,73 @@ def test_preview_visit(clients_mock, test_name, test_config):
             thumbnail_found = True
     assert preview_found, f'expect a preview artifact {rlog_fqn}'
     assert thumbnail_found, f'expect a thumbnail artifact {rlog_fqn}'
+    # the thumbnail is rendered with the preview, so check it's the artifact and the file that's expected
+    for plane in test_obs.planes.values():
+        for artifact in plane.artifacts.values():
+            if artifact.uri.endswith('_prev_256.jpg'):
+                assert artifact.product_type == ProductType.THUMBNAIL, f'wrong thumbnail product type {rlog_fqn}'
+                thumb_fqns = glob.glob(f'{test_main_app.TEST_DATA_DIR}/**/{basename(artifact.uri)}', recursive=True)
+                assert len(thumb_fqns) == 1, f'expect a thumbnail file {rlog_fqn}'
+                assert Image.open(thumb_fqns[0]).size[0] == preview_augmentation.THUMBNAIL_WIDTH, 'wrong thumbnail'
+
+
+def test_render_light_curve_threads(tmp_path):
+    rng = np.random.default_rng(42)
+    bjd = np.sort(rng.uniform(1700.0, 1900.0, 2000))
+    decorrelated = (bjd, rng.normal(4.7, 0.01, 2000), rng.uniform(0.005, 0.01, 2000))
+    average = (bjd[::100], rng.normal(4.7, 0.002, 20), rng.uniform(0.001, 0.002, 20))
+
+    def _render(index):
+        fqn = (tmp_path / f'{index}_prev.jpg').as_posix()
+        preview_augmentation.render_light_curve(fqn, 'HD36486_test', 'BRITE-Lem', decorrelated, average)
+        with open(fqn, 'rb') as f:
+            return f.read()
+
+    expected = _render('serial')
+    # there is no shared plotting state, so concurrent renders are the same as a serial one
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        test_result = list(executor.map(_render, range(8)))
+    assert all(ii == expected for ii in test_result), 'concurrent renders differ'
+
+
+def test_light_curve_template(tmp_path):
+    rng = np.random.default_rng(42)
+    series = []
+    for count in [2000, 300]:
+        bjd = np.sort(rng.uniform(1700.0, 1900.0, count))
+        orbits = count // 100
+        series.append(
+            (
+                (bjd, rng.normal(4.7, 0.01, count), rng.uniform(0.005, 0.01, count)),
+                (bjd[::100], rng.normal(4.7, 0.002, orbits), rng.uniform(0.001, 0.002, orbits)),
+            )
+        )
+
+    def _render(template, name, index):
+        preview_fqn = (tmp_path / f'{name}_prev.jpg').as_posix()
+        thumb_fqn = (tmp_path / f'{name}_prev_256.jpg').as_posix()
+        template.render(preview_fqn, f'HD{index}', f'BRITE-{index}', *series[index], thumb_fqn=thumb_fqn)
+        with open(preview_fqn, 'rb') as f:
+            return f.read(), Image.open(thumb_fqn).size
+
+    reused = preview_augmentation.LightCurveTemplate()
+    _render(reused, 'first', 0)
+    _render(reused, 'second', 1)
+    # a re-used template renders the same preview as a new one
+    assert _render(reused, 'reused', 0) == _render(preview_augmentation.LightCurveTemplate(), 'new', 0), 'differ'
+    assert _render(reused, 'reused', 0)[1] == (256, 192), 'wrong thumbnail size'
+
+
+def test_decimate_light_curve():
+    rng = np.random.default_rng(42)
+    x = np.sort(np.concatenate((rng.uniform(0.0, 40.0, 50000), rng.uniform(60.0, 100.0, 50000))))
+    y = rng.normal(4.7, 0.01, len(x))
+    y_error = rng.uniform(0.005, 0.01, len(x))
+    points_x, points_y, error_x, lower, upper = preview_augmentation.decimate_light_curve(x, y, y_error, 100)
+    # one error bar per occupied column, and two points per column, with one break for the gap
+    assert 80 <= len(error_x) <= 81, 'wrong error bar count'
+    assert len(points_x) == 2 * len(error_x) + 1, 'wrong point count'
+    assert np.isnan(points_x).sum() == 1, 'expect a break at the gap'
+    assert np.nanmin(points_y) == y.min() and np.nanmax(points_y) == y.max(), 'wrong point extremes'
+    assert lower.min() == (y - y_error).min() and upper.max() == (y + y_error).max(), 'wrong error envelope'
+    assert (error_x < 40.0).sum() == 40, 'wrong error bar positions'
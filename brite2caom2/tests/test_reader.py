@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import numpy as np
+import pytest
+
+from caom2pipe.manage_composable import CadcException
+from brite2caom2 import reader
+from brite2caom2.storage_name import BriteName, get_entry
+from mock import Mock
+
+
+NDATDB_CONTENT = """# Decorrelated BRITE photometry
+# (1) BJD(TDB) - 2456000.0    : Barycentric Julian Date.
+# (2) BRITEMAG                : decorrelated BRITE magnitude.
+# (3) FLAG                    : unused.
+# (4) SIGMA_BRITEMAG          : magnitude uncertainty.
+1789.0523451   4.71235   0   0.00712
+1789.0535102   4.70998   0   0.00705
+1789.0546753   4.71456   1   0.00731
+"""
+
+
+def test_read_bjd_file(tmp_path):
+    test_fqn = tmp_path / 'test.ndatdb'
+    test_fqn.write_text(NDATDB_CONTENT)
+    test_uri = 'cadc:BRITE-Constellation/test.ndatdb'
+    test_subject = reader.BriteFileMetadataReader()
+    with open(test_fqn) as f:
+        test_subject._read_file(f, test_uri)
+    test_result = test_subject.time_series[test_uri]
+    assert list(test_result.keys()) == ['BJD', 'BRITEMAG', 'SIGMA_BRITEMAG'], 'wrong keys'
+    for value in test_result.values():
+        assert isinstance(value, np.ndarray), 'expect arrays'
+        assert value.dtype == np.float64, 'wrong dtype'
+        assert value.flags['C_CONTIGUOUS'], 'expect contiguous columns'
+    assert test_result['BJD'].tolist() == [1789.0523451, 1789.0535102, 1789.0546753], 'wrong BJD'
+    assert test_result['BRITEMAG'].tolist() == [4.71235, 4.70998, 4.71456], 'wrong BRITEMAG'
+    assert test_result['SIGMA_BRITEMAG'].tolist() == [0.00712, 0.00705, 0.00731], 'wrong SIGMA_BRITEMAG'
+    assert test_subject.metadata[test_uri] == {}, 'wrong metadata'
+
+    # the same content, as delivered by the storage client
+    test_uri_2 = 'cadc:BRITE-Constellation/test.avedb'
+    test_subject._read_file(NDATDB_CONTENT.split('\n'), test_uri_2)
+    test_result_2 = test_subject.time_series[test_uri_2]
+    assert list(test_result_2.keys()) == ['ave_BJD', 'ave_BRITEMAG', 'ave_SIGMA_BRITEMAG'], 'wrong ave keys'
+    assert np.array_equal(test_result_2['ave_BJD'], test_result['BJD']), 'wrong ave_BJD'
+
+
+def test_read_bjd_file_wrong_default():
+    test_content = NDATDB_CONTENT.replace('2456000.0', '2450000.0').split('\n')
+    test_subject = reader.BriteFileMetadataReader()
+    with pytest.raises(CadcException):
+        test_subject._read_file(test_content, 'cadc:BRITE-Constellation/test.ndatdb')
+
+
+ORIG_CONTENT = """# ------------------------------------------------------------------
+# SatellID = BLb                   / satellite ID
+# SatfulID = BRITE-Lem             / satellite full ID
+# StarInFo = HD37202,zeta Tau      / star information
+# ObsExpoT = 1000                  / exposure time [ms]
+# column1  = HJD                   / heliocentric Julian date
+# column2  = XCEN                  / x centroid
+# column3  = YCEN                  / y centroid
+# column4  = FLUX                  / flux
+# ------------------------------------------------------------------
+2457673.547091   21.31   18.12   134567.2
+2457673.547326   21.29   18.17   134588.9
+"""
+
+
+def test_read_orig_file():
+    test_uri = 'cadc:BRITE-Constellation/test.orig'
+    test_subject = reader.BriteFileMetadataReader()
+    test_subject._read_file(ORIG_CONTENT.split('\n'), test_uri)
+    test_metadata = test_subject.metadata[test_uri]
+    assert test_metadata.get('SatellID') == 'BLb', 'wrong SatellID'
+    assert test_metadata.get('StarInFo') == 'HD37202,zeta Tau', 'wrong StarInFo'
+    assert test_metadata.get('column4') == 'FLUX', 'wrong column4'
+    test_result = test_subject.time_series[test_uri]
+    assert list(test_result.keys()) == ['HJD', 'XCEN', 'YCEN', 'FLUX'], 'wrong column order'
+    assert test_result['HJD'].tolist() == [2457673.547091, 2457673.547326], 'wrong HJD'
+    assert test_result['FLUX'].tolist() == [134567.2, 134588.9], 'wrong FLUX'
+    assert all(ii.flags['C_CONTIGUOUS'] for ii in test_result.values()), 'expect contiguous columns'
+
+
+def test_orig_header():
+    test_subject = reader.BriteFileMetadataReader()
+    test_uri = 'cadc:BRITE-Constellation/test.orig'
+    test_subject._read_file(ORIG_CONTENT.split('\n'), test_uri)
+    test_result = test_subject.metadata[test_uri]
+    assert isinstance(test_result, reader.BriteOrigHeader), 'wrong type'
+    assert not hasattr(test_result, '__dict__'), 'expect slots'
+    assert test_result.satellite_id == 'BLb', 'wrong satellite_id'
+    assert test_result.filter_id == 'b', 'wrong filter_id'
+    assert test_result.satellite_name == 'BRITE-Lem', 'wrong satellite_name'
+    assert test_result.star_info == ('HD37202', 'zeta Tau'), 'wrong star_info'
+    assert test_result.target_name == 'HD37202', 'wrong target_name'
+    assert test_result.coordinates is None, 'no coordinates in StarInFo'
+    assert test_result.exposure_time == 1.0, 'wrong exposure_time'
+    assert test_result.plate_scale is None, 'no InstPScl'
+    assert test_result.get('ObsExpoT') == 1.0, 'wrong typed get'
+    assert test_result.get('InstPScl', 'default') == 'default', 'wrong default'
+    assert 'SatellID' not in test_result.keywords, 'parsed keywords are not repeated'
+
+    test_result = reader.BriteOrigHeader(
+        {'SatellID': 'UBr', 'StarInFo': 'HD 37202, 05:37:38.68, +21:08:33.2', 'InstPScl': '27.3'}
+    )
+    assert test_result.filter_id == 'r', 'wrong filter_id'
+    assert test_result.plate_scale == 27.3, 'wrong plate_scale'
+    assert test_result.coordinates == pytest.approx((84.41117, 21.14256), abs=1e-5), 'wrong coordinates'
+    assert test_result.exposure_time is None, 'no ObsExpoT'
+    assert test_result.get('StarInFo') == 'HD 37202, 05:37:38.68, +21:08:33.2', 'wrong StarInFo'
+
+
+def test_summaries(tmp_path):
+    test_subject = reader.BriteFileMetadataReader()
+    ndatdb_uri = 'cadc:BRITE-Constellation/test.ndatdb'
+    test_subject._read_file(NDATDB_CONTENT.split('\n'), ndatdb_uri)
+    test_result = test_subject.summaries[ndatdb_uri]
+    assert test_result.time_min == 1789.0523451, 'wrong time_min'
+    assert test_result.time_max == 1789.0546753, 'wrong time_max'
+    assert test_result.count == 3, 'wrong count'
+    assert test_result.mag_min == 4.70998, 'wrong mag_min'
+    assert test_result.mag_max == 4.71456, 'wrong mag_max'
+    assert test_result.median_sigma == 0.00712, 'wrong median_sigma'
+    assert test_result.max_sigma == 0.00731, 'wrong max_sigma'
+
+    # the time range does not rely on the order of the series
+    unsorted = reader.summarize(np.array([3.0, 1.0, 2.0]))
+    assert (unsorted.time_min, unsorted.time_max, unsorted.count) == (1.0, 3.0, 3), 'wrong unsorted range'
+    assert unsorted.mag_min is None and unsorted.median_sigma is None, 'expect no magnitudes'
+    assert reader.summarize(np.empty(0)) == reader.SeriesSummary(None, None, 0, None, None, None, None), 'empty'
+
+    # only the summary of the .orig time series is kept
+    orig_fqn = tmp_path / 'test.orig'
+    orig_fqn.write_text(ORIG_CONTENT)
+    orig_uri = 'cadc:BRITE-Constellation/test.orig'
+    test_subject = reader.BriteFileMetadataReader(release_orig_series=True)
+    test_subject._read_local_file(orig_fqn.as_posix(), orig_uri)
+    assert orig_uri not in test_subject.time_series, 'expect released time series'
+    assert test_subject.metadata[orig_uri].get('SatellID') == 'BLb', 'expect metadata'
+    test_result = test_subject.summaries[orig_uri]
+    assert (test_result.time_min, test_result.time_max) == (2457673.547091, 2457673.547326), 'wrong HJD range'
+    assert test_result.count == 2, 'wrong orig count'
+    assert test_subject.cached_bytes == 0, 'expect no cached time series'
+    assert test_subject.is_cached(orig_uri, orig_fqn.as_posix()), 'expect the summary to be cached'
+    test_subject.release('test')
+    assert orig_uri not in test_subject.summaries, 'expect released summary'
+
+
+@pytest.mark.parametrize('block_size', [37, 4 * 1024 * 1024])
+def test_read_local_file(block_size, tmp_path, monkeypatch):
+    monkeypatch.setattr(reader.BufferBody, 'block_size', block_size)
+    test_subject = reader.BriteFileMetadataReader()
+    for f_name, content in [('test.ndatdb', NDATDB_CONTENT), ('test.orig', ORIG_CONTENT)]:
+        test_fqn = tmp_path / f_name
+        test_fqn.write_text(content)
+        mmap_uri = f'cadc:BRITE-Constellation/mmap/{f_name}'
+        line_uri = f'cadc:BRITE-Constellation/line/{f_name}'
+        test_subject._read_local_file(test_fqn.as_posix(), mmap_uri)
+        test_subject._read_file(content.split('\n'), line_uri)
+        assert test_subject.metadata[mmap_uri] == test_subject.metadata[line_uri], f'metadata {f_name}'
+        mmap_result = test_subject.time_series[mmap_uri]
+        line_result = test_subject.time_series[line_uri]
+        assert list(mmap_result.keys()) == list(line_result.keys()), f'keys {f_name}'
+        for key, value in line_result.items():
+            assert np.array_equal(mmap_result[key], value), f'{key} {f_name}'
+            assert mmap_result[key].flags['C_CONTIGUOUS'], f'contiguous {key} {f_name}'
+
+
+# comment lines after the header block, which numpy.loadtxt skips
+COMMENTED_NDATDB_CONTENT = (
+    NDATDB_CONTENT.replace('1789.0535102', '# a comment in the numeric block\n1789.0535102')
+    + '# a trailing comment\n\n'
+)
+
+
+@pytest.mark.parametrize('block_size', [1, 37, 4 * 1024 * 1024])
+def test_read_commented_body(block_size, tmp_path, monkeypatch):
+    monkeypatch.setattr(reader.BufferBody, 'block_size', block_size)
+    test_fqn = tmp_path / 'test.ndatdb'
+    test_fqn.write_text(COMMENTED_NDATDB_CONTENT)
+    test_subject = reader.BriteFileMetadataReader()
+    line_uri = 'cadc:BRITE-Constellation/line/test.ndatdb'
+    mmap_uri = 'cadc:BRITE-Constellation/mmap/test.ndatdb'
+    test_subject._read_file(COMMENTED_NDATDB_CONTENT.split('\n'), line_uri)
+    test_subject._read_local_file(test_fqn.as_posix(), mmap_uri)
+    for uri in [line_uri, mmap_uri]:
+        test_result = test_subject.time_series[uri]
+        assert test_result['BJD'].tolist() == [1789.0523451, 1789.0535102, 1789.0546753], f'wrong BJD {uri}'
+        assert test_result['SIGMA_BRITEMAG'].tolist() == [0.00712, 0.00705, 0.00731], f'wrong SIGMA {uri}'
+
+
+def test_column_decoder():
+    test_subject = reader.ColumnDecoder()
+    test_subject.decode(b'1.0 2.0 3.0\n4.0 5.0 6.0\n')
+    test_subject.decode(b'7.0 8.0 9.0\n')
+    test_result = test_subject.columns((2, 0))
+    assert [ii.tolist() for ii in test_result] == [[3.0, 6.0, 9.0], [1.0, 4.0, 7.0]], 'wrong columns'
+
+    with pytest.raises(CadcException):
+        reader.ColumnDecoder().decode(b'1.0 2.0 3.0\n4.0 5.0\n')
+
+    # comments and blank blocks contribute no values
+    test_subject = reader.ColumnDecoder()
+    test_subject.decode(b'# only a comment\n\n')
+    test_subject.decode(b'1.0 2.0 # inline\n# full line\n3.0 4.0\n')
+    test_subject.decode(b'\n')
+    assert [ii.tolist() for ii in test_subject.columns((0, 1))] == [[1.0, 3.0], [2.0, 4.0]], 'wrong comment handling'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 29, 1024])
+def test_storage_client_read_streaming(chunk_size, test_config):
+    contents = {'test.ndatdb': NDATDB_CONTENT.encode(), 'test.orig': ORIG_CONTENT.encode()}
+
+    def _cadcget_mock(uri, dest):
+        content = contents[uri.split('/')[-1]]
+        for ii in range(0, len(content), chunk_size):
+            dest.write(content[ii:ii + chunk_size])
+
+    client_mock = Mock()
+    client_mock.cadcget.side_effect = _cadcget_mock
+    test_subject = reader.BriteStorageClientMetadataReader(client_mock)
+    line_reader = reader.BriteFileMetadataReader()
+    for f_name, content in contents.items():
+        test_storage_name = BriteName(f_name)
+        test_subject.set_time_series(test_storage_name)
+        line_reader._read_file(content.decode().split('\n'), test_storage_name.file_uri)
+        assert (
+            test_subject.metadata[test_storage_name.file_uri] == line_reader.metadata[test_storage_name.file_uri]
+        ), f'metadata {f_name}'
+        test_result = test_subject.time_series[test_storage_name.file_uri]
+        expected = line_reader.time_series[test_storage_name.file_uri]
+        assert list(test_result.keys()) == list(expected.keys()), f'keys {f_name}'
+        for key, value in expected.items():
+            assert np.array_equal(test_result[key], value), f'{key} {f_name}'
+    assert client_mock.cadcget.call_count == 2, 'cadcget count'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 29, 1024])
+def test_storage_client_read_commented(chunk_size, test_config):
+    content = COMMENTED_NDATDB_CONTENT.encode()
+
+    def _cadcget_mock(uri, dest):
+        for ii in range(0, len(content), chunk_size):
+            dest.write(content[ii:ii + chunk_size])
+
+    client_mock = Mock()
+    client_mock.cadcget.side_effect = _cadcget_mock
+    test_subject = reader.BriteStorageClientMetadataReader(client_mock)
+    test_storage_name = BriteName('test.ndatdb')
+    test_subject.set_time_series(test_storage_name)
+    test_result = test_subject.time_series[test_storage_name.file_uri]
+    assert test_result['BJD'].tolist() == [1789.0523451, 1789.0535102, 1789.0546753], 'wrong BJD'
+    assert test_result['BRITEMAG'].tolist() == [4.71235, 4.70998, 4.71456], 'wrong BRITEMAG'
+
+
+def test_get_entry_cache(test_config, tmp_path):
+    ndatdb_fqn = tmp_path / 'test.ndatdb'
+    ndatdb_fqn.write_text(NDATDB_CONTENT)
+    orig_fqn = tmp_path / 'test.orig'
+    orig_fqn.write_text(ORIG_CONTENT)
+    test_storage_name = BriteName(ndatdb_fqn.as_posix())
+    test_subject = reader.BriteFileMetadataReader()
+
+    test_uri, test_fqn = get_entry(test_storage_name, '.ndatdb', '.orig', None, test_subject)
+    assert test_uri == 'cadc:BRITE-Constellation/test.orig', 'wrong uri'
+    assert test_fqn == orig_fqn.as_posix(), 'wrong fqn'
+    assert test_subject.cache_misses == 1, 'first read is a miss'
+    assert test_subject.cache_hits == 0, 'first read is not a hit'
+    first_result = test_subject.time_series[test_uri]
+
+    # the second reference to the same, unchanged, file re-uses the parsed content
+    get_entry(test_storage_name, '.ndatdb', '.orig', None, test_subject)
+    assert test_subject.cache_hits == 1, 'second read is a hit'
+    assert test_subject.time_series[test_uri] is first_result, 'expect no re-parse'
+
+    # a changed file is re-parsed
+    orig_fqn.write_text(ORIG_CONTENT + '2457673.547561   21.30   18.15   134601.7\n')
+    get_entry(test_storage_name, '.ndatdb', '.orig', None, test_subject)
+    assert test_subject.cache_misses == 2, 'changed file is a miss'
+    assert len(test_subject.time_series[test_uri]['HJD']) == 3, 'expect re-parse'
+
+    # set_time_series uses the same cache
+    test_subject.set_time_series(BriteName(orig_fqn.as_posix()))
+    assert test_subject.cache_hits == 2, 'set_time_series hit'
+    assert 'Cache hits: 2 misses: 2' in str(test_subject), 'wrong str'
+    assert test_subject.metrics['parse'] == 2, 'wrong parse count'
+    assert test_subject.metrics['transfer'] == 0, 'wrong transfer count'
+
+
+def test_get_entry_transfer(test_config, tmp_path):
+    orig_fqn = tmp_path / 'test.orig'
+    test_storage_name = BriteName((tmp_path / 'test.ndatdb').as_posix())
+    test_subject = reader.BriteFileMetadataReader()
+    clients_mock = Mock()
+    clients_mock.data_client.get.side_effect = lambda working_directory, uri: orig_fqn.write_text(ORIG_CONTENT)
+
+    # the file is not on disk, so it's retrieved, then parsed
+    get_entry(test_storage_name, '.ndatdb', '.orig', clients_mock, test_subject)
+    clients_mock.data_client.get.assert_called_with(tmp_path.as_posix(), 'cadc:BRITE-Constellation/test.orig')
+    assert test_subject.metrics['transfer'] == 1, 'wrong transfer count'
+    assert test_subject.metrics['parse'] == 1, 'wrong parse count'
+
+    # the cached content is used, even when the file is no longer on disk
+    orig_fqn.unlink()
+    get_entry(test_storage_name, '.ndatdb', '.orig', clients_mock, test_subject)
+    assert clients_mock.data_client.get.call_count == 1, 'expect no retrieval'
+    assert test_subject.metrics['transfer'] == 1, 'wrong cached transfer count'
+    assert test_subject.metrics['parse'] == 1, 'wrong cached parse count'
+
+
+def test_cache_eviction(test_config, tmp_path):
+    test_subject = reader.BriteFileMetadataReader(max_observations=2)
+    for obs_id in ['A', 'B', 'C']:
+        test_fqn = tmp_path / f'{obs_id}.ndatdb'
+        test_fqn.write_text(NDATDB_CONTENT)
+        test_subject.set_time_series(BriteName(test_fqn.as_posix()))
+    assert test_subject.cached_observations == ['B', 'C'], 'least recently used is evicted'
+    assert 'cadc:BRITE-Constellation/A.ndatdb' not in test_subject.time_series, 'A time series evicted'
+    assert 'cadc:BRITE-Constellation/A.ndatdb' not in test_subject.metadata, 'A metadata evicted'
+    assert test_subject.cached_bytes == 2 * 3 * 3 * 8, 'wrong byte count'
+
+    # a hit makes B the most recently used
+    test_subject.set_time_series(BriteName((tmp_path / 'B.ndatdb').as_posix()))
+    test_subject.set_time_series(BriteName((tmp_path / 'A.ndatdb').as_posix()))
+    assert test_subject.cached_observations == ['B', 'A'], 'wrong eviction after hit'
+
+    test_subject.release('A')
+    assert test_subject.cached_observations == ['B'], 'release'
+    assert test_subject.cached_bytes == 3 * 3 * 8, 'wrong byte count after release'
+
+    # the byte bound
+    test_subject = reader.BriteFileMetadataReader(max_bytes=3 * 3 * 8)
+    for obs_id in ['A', 'B']:
+        test_subject.set_time_series(BriteName((tmp_path / f'{obs_id}.ndatdb').as_posix()))
+    assert test_subject.cached_observations == ['B'], 'byte bound'
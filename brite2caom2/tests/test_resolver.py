@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import os
+import pytest
+
+from caom2pipe.manage_composable import CadcException
+from brite2caom2.resolver import get_star_info_coordinates, TargetResolver
+from mock import patch
+
+
+@patch('brite2caom2.resolver.SkyCoord.from_name')
+def test_resolver(from_name_mock, tmp_path):
+    from_name_mock.return_value.ra.degree = 84.41118808
+    from_name_mock.return_value.dec.degree = 21.14254433
+    cache_fqn = (tmp_path / 'targets.json').as_posix()
+    catalogue_fqn = tmp_path / 'catalogue.csv'
+    catalogue_fqn.write_text('# name, ra, dec\nHD36486, 83.00166706, -0.29909204\n\nalf Ori , 88.79293899, 7.407064\n')
+
+    test_subject = TargetResolver(cache_fqn)
+    test_subject.seed(catalogue_fqn.as_posix())
+    assert len(test_subject) == 2, 'wrong seed count'
+    assert test_subject.resolve('HD36486') == (83.00166706, -0.29909204), 'wrong seeded coordinates'
+    assert test_subject.resolve('ALF  ori') == (88.79293899, 7.407064), 'names are normalized'
+    assert not from_name_mock.called, 'seeded names should not be resolved remotely'
+
+    assert test_subject.resolve('HD37202') == (84.41118808, 21.14254433), 'wrong resolved coordinates'
+    assert from_name_mock.call_count == 1, 'resolved once'
+    test_subject.resolve('HD37202')
+    assert from_name_mock.call_count == 1, 'resolved from the cache'
+
+    # the resolved coordinates are persisted, and available offline
+    offline_subject = TargetResolver(cache_fqn, offline=True)
+    assert len(offline_subject) == 3, 'wrong persisted count'
+    assert 'hd37202' in offline_subject, 'expect persisted target'
+    assert offline_subject.resolve('HD37202') == (84.41118808, 21.14254433), 'wrong persisted coordinates'
+    with pytest.raises(CadcException):
+        offline_subject.resolve('HD31237')
+    assert from_name_mock.call_count == 1, 'no remote calls in offline mode'
+
+
+def test_resolver_index(tmp_path):
+    cache_fqn = tmp_path / 'targets.json'
+    cache_fqn.write_text('{"HD37202": [84.41118808, 21.')
+    # a corrupt index is treated as empty
+    test_subject = TargetResolver(cache_fqn.as_posix())
+    assert len(test_subject) == 0, 'expect an empty index'
+    test_subject.add('HD37202', 84.41118808, 21.14254433)
+    test_subject.save()
+    assert _temporary_files(tmp_path) == [], 'expect no temporary files'
+    assert TargetResolver(cache_fqn.as_posix()).resolve('HD37202') == (84.41118808, 21.14254433), 'wrong index'
+
+    # a failed write leaves the previous index, and no temporary files
+    with patch('brite2caom2.resolver.json.dump', side_effect=ValueError('no')):
+        with pytest.raises(ValueError):
+            test_subject.save()
+    assert _temporary_files(tmp_path) == [], 'expect no temporary files after a failure'
+    assert len(TargetResolver(cache_fqn.as_posix())) == 1, 'expect the previous index'
+
+    # processes that share the index, e.g. the ingest workers, keep each other's names
+    first_subject = TargetResolver(cache_fqn.as_posix())
+    second_subject = TargetResolver(cache_fqn.as_posix())
+    first_subject.add('HD36486', 83.00166706, -0.29909204)
+    first_subject.save()
+    second_subject.add('alf Ori', 88.79293899, 7.407064)
+    second_subject.save()
+    assert len(second_subject) == 3, 'expect the names saved by the first subject'
+    test_result = TargetResolver(cache_fqn.as_posix(), offline=True)
+    assert len(test_result) == 3, 'expect the names from all the subjects'
+    assert test_result.resolve('HD36486') == (83.00166706, -0.29909204), 'wrong first subject coordinates'
+    assert test_result.resolve('ALF ORI') == (88.79293899, 7.407064), 'wrong second subject coordinates'
+
+
+def _temporary_files(directory):
+    return [ii for ii in os.listdir(directory) if ii.endswith('.tmp')]
+
+
+def test_get_star_info_coordinates():
+    for star_info, expected in [
+        ('HD37202, zeta Tau, 05:37:38.68, +21:08:33.2, 3.0, B4IIIpe', (84.41116666666667, 21.142555555555553)),
+        ('HD36486, del Ori, 05 32 00.40, -00 17 56.7, 2.2, O9.5II', (83.00166666666667, -0.2990833333333333)),
+        ('HD36486, del Ori, 05h32m00.40s, -00d17\'56.7", 2.2', (83.00166666666667, -0.2990833333333333)),
+    ]:
+        test_result = get_star_info_coordinates(star_info.split(','))
+        assert test_result == pytest.approx(expected), f'wrong coordinates for {star_info}'
+    for star_info in ['HD37202', 'HD37202, zeta Tau, 3.0, B4IIIpe', 'HD37202, zeta Tau, 25:37:38.68, +21:08:33.2']:
+        assert get_star_info_coordinates(star_info.split(',')) is None, f'expect no coordinates for {star_info}'
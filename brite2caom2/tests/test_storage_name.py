@@ -98,3 +98,24 @@ def test_storage_name(test_config):
             == [f'{test_config.scheme}:{test_config.collection}/{test_subject.file_name}']
         ), f'wrong decorrelated uris {test_subject.destination_uris}'
         assert test_subject.product_id == 'timeseries', 'wrong product id'
+
+
+def test_storage_name_observation(test_config):
+    test_obs_id = 'HD37202_31-Tau-I-2017_BLb_1_5_A'
+    test_entry = tuple(f'/data/{test_obs_id}{ii}' for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb'])
+    test_subject = BriteName(test_entry)
+    assert test_subject.is_observation, 'expect an Observation'
+    assert test_subject.obs_id == test_obs_id, 'wrong obs id'
+    assert test_subject.file_name == f'{test_obs_id}.rlogdb', 'the .rlogdb file represents the Observation'
+    assert test_subject.is_last_to_ingest, 'expect last to ingest'
+    assert not test_subject.has_data, 'the .rlogdb file has no data'
+    assert test_subject.source_names == list(test_entry), 'wrong source names'
+    assert test_subject.destination_uris == [
+        f'{test_config.scheme}:{test_config.collection}/{test_obs_id}{ii}'
+        for ii in ['.avedb', '.freq0db', '.ndatdb', '.orig', '.rlogdb']
+    ], 'wrong destination uris'
+    assert test_subject.use_different_file('.rlogdb', '.ndatdb') == (
+        f'/data/{test_obs_id}.ndatdb',
+        f'{test_config.scheme}:{test_config.collection}/{test_obs_id}.ndatdb',
+    ), 'wrong different file'
+    assert not BriteName(test_entry[0]).is_observation, 'a single file is not an Observation'
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+import pytest
+import threading
+import time
+
+from caom2pipe.manage_composable import CadcException
+from brite2caom2.transfer import AsyncTransferStage
+from mock import Mock
+
+
+def test_transfer_stage():
+    lock = threading.Lock()
+    in_flight = []
+    maximum = []
+
+    def _put_mock(working_directory, uri, *args, **kwargs):
+        with lock:
+            in_flight.append(uri)
+            maximum.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(uri)
+        if uri.endswith('bad.avedb'):
+            raise CadcException(f'Failed to store {uri}')
+
+    client_mock = Mock()
+    client_mock.put.side_effect = _put_mock
+    test_subject = AsyncTransferStage(client_mock, 2)
+    try:
+        for ii in ['a', 'b', 'c', 'd', 'bad']:
+            test_subject.prefetch(f'/data/{ii}.avedb', f'cadc:BRITE-Constellation/{ii}.avedb')
+        # prefetching the same file twice does not store it twice
+        test_subject.prefetch('/data/a.avedb', 'cadc:BRITE-Constellation/a.avedb')
+        # a put that was not prefetched waits its turn
+        test_subject.put('/data', 'cadc:BRITE-Constellation/e.avedb')
+
+        for ii in ['a', 'b', 'c', 'd']:
+            test_subject.put('/data', f'cadc:BRITE-Constellation/{ii}.avedb')
+        # the failure is reported against the put for the file that failed
+        with pytest.raises(CadcException):
+            test_subject.put('/data', 'cadc:BRITE-Constellation/bad.avedb')
+        assert client_mock.put.call_count == 6, 'wrong put count'
+        # the wrapped put changes the working directory, so the puts are made one at a time
+        assert max(maximum) == 1, 'wrong concurrency'
+
+        # a prefetch uses the arguments of the most recent put
+        test_subject.put('/data', 'cadc:BRITE-Constellation/f.avedb', 'md5:1234', replace=True)
+        test_subject.prefetch('/data/g.avedb', 'cadc:BRITE-Constellation/g.avedb')
+        test_subject.put('/data', 'cadc:BRITE-Constellation/g.avedb', 'md5:1234', replace=True)
+        client_mock.put.assert_called_with('/data', 'cadc:BRITE-Constellation/g.avedb', 'md5:1234', replace=True)
+        assert client_mock.put.call_count == 8, 'wrong prefetch with arguments count'
+        # and when the put has other arguments, the file is put again, with those
+        test_subject.prefetch('/data/h.avedb', 'cadc:BRITE-Constellation/h.avedb')
+        test_subject.put('/data', 'cadc:BRITE-Constellation/h.avedb')
+        client_mock.put.assert_called_with('/data', 'cadc:BRITE-Constellation/h.avedb')
+        # other calls go to the wrapped client
+        test_subject.info('cadc:BRITE-Constellation/e.avedb')
+        client_mock.info.assert_called_with('cadc:BRITE-Constellation/e.avedb')
+    finally:
+        test_subject.close()
+    assert test_subject.in_flight == 0, 'nothing left in flight'
+
+
+def test_transfer_stage_discard():
+    started = threading.Event()
+    release = threading.Event()
+
+    def _put_mock(working_directory, uri):
+        started.set()
+        release.wait(5)
+
+    client_mock = Mock()
+    client_mock.put.side_effect = _put_mock
+    test_subject = AsyncTransferStage(client_mock, 2)
+    try:
+        test_subject.prefetch('/data/a.avedb', 'cadc:BRITE-Constellation/a.avedb')
+        test_subject.prefetch('/data/b.avedb', 'cadc:BRITE-Constellation/b.avedb')
+        assert started.wait(5), 'expect the first upload to start'
+        # the second upload waits its turn, so it is cancelled
+        assert not test_subject.discard('cadc:BRITE-Constellation/b.avedb'), 'b should not be stored'
+        release.set()
+        # the first upload had started, so the file is stored
+        assert test_subject.discard('cadc:BRITE-Constellation/a.avedb'), 'a should be stored'
+        assert not test_subject.discard('cadc:BRITE-Constellation/c.avedb'), 'c was never prefetched'
+    finally:
+        test_subject.close()
+    client_mock.put.assert_called_once_with('/data', 'cadc:BRITE-Constellation/a.avedb')
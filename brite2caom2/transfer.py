@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# ***********************************************************************
+# ******************  CANADIAN ASTRONOMY DATA CENTRE  *******************
+# *************  CENTRE CANADIEN DE DONNÉES ASTRONOMIQUES  **************
+#
+#  (c) 2022.                            (c) 2022.
+#  Government of Canada                 Gouvernement du Canada
+#  National Research Council            Conseil national de recherches
+#  Ottawa, Canada, K1A 0R6              Ottawa, Canada, K1A 0R6
+#  All rights reserved                  Tous droits réservés
+#
+#  NRC disclaims any warranties,        Le CNRC dénie toute garantie
+#  expressed, implied, or               énoncée, implicite ou légale,
+#  statutory, of any kind with          de quelque nature que ce
+#  respect to the software,             soit, concernant le logiciel,
+#  including without limitation         y compris sans restriction
+#  any warranty of merchantability      toute garantie de valeur
+#  or fitness for a particular          marchande ou de pertinence
+#  purpose. NRC shall not be            pour un usage particulier.
+#  liable in any event for any          Le CNRC ne pourra en aucun cas
+#  damages, whether direct or           être tenu responsable de tout
+#  indirect, special or general,        dommage, direct ou indirect,
+#  consequential or incidental,         particulier ou général,
+#  arising from the use of the          accessoire ou fortuit, résultant
+#  software.  Neither the name          de l'utilisation du logiciel. Ni
+#  of the National Research             le nom du Conseil National de
+#  Council of Canada nor the            Recherches du Canada ni les noms
+#  names of its contributors may        de ses  participants ne peuvent
+#  be used to endorse or promote        être utilisés pour approuver ou
+#  products derived from this           promouvoir les produits dérivés
+#  software without specific prior      de ce logiciel sans autorisation
+#  written permission.                  préalable et particulière
+#                                       par écrit.
+#
+#  This file is part of the             Ce fichier fait partie du projet
+#  OpenCADC project.                    OpenCADC.
+#
+#  OpenCADC is free software:           OpenCADC est un logiciel libre ;
+#  you can redistribute it and/or       vous pouvez le redistribuer ou le
+#  modify it under the terms of         modifier suivant les termes de
+#  the GNU Affero General Public        la “GNU Affero General Public
+#  License as published by the          License” telle que publiée
+#  Free Software Foundation,            par la Free Software Foundation
+#  either version 3 of the              : soit la version 3 de cette
+#  License, or (at your option)         licence, soit (à votre gré)
+#  any later version.                   toute version ultérieure.
+#
+#  OpenCADC is distributed in the       OpenCADC est distribué
+#  hope that it will be useful,         dans l’espoir qu’il vous
+#  but WITHOUT ANY WARRANTY;            sera utile, mais SANS AUCUNE
+#  without even the implied             GARANTIE : sans même la garantie
+#  warranty of MERCHANTABILITY          implicite de COMMERCIALISABILITÉ
+#  or FITNESS FOR A PARTICULAR          ni d’ADÉQUATION À UN OBJECTIF
+#  PURPOSE.  See the GNU Affero         PARTICULIER. Consultez la Licence
+#  General Public License for           Générale Publique GNU Affero
+#  more details.                        pour plus de détails.
+#
+#  You should have received             Vous devriez avoir reçu une
+#  a copy of the GNU Affero             copie de la Licence Générale
+#  General Public License along         Publique GNU Affero avec
+#  with OpenCADC.  If not, see          OpenCADC ; si ce n’est
+#  <http://www.gnu.org/licenses/>.      pas le cas, consultez :
+#                                       <http://www.gnu.org/licenses/>.
+#
+#  : 4 $
+#
+# ***********************************************************************
+#
+
+"""
+A transfer stage for the 'store' task type, so that file uploads to CADC storage run ahead of, and in the background
+of, the parsing and CAOM2 work for each file.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from os.path import dirname
+
+
+__all__ = ['AsyncTransferStage']
+
+
+class AsyncTransferStage:
+    """
+    Wrap the data client of a ClientCollection. The runner tells the stage about the files of the next 'lookahead'
+    entries it is going to store, and the stage uploads them in a background thread. When the store executor asks for
+    a put of one of those files, it waits for the upload that is already underway, and gets that upload's result or
+    exception, so success and failure are still reported for the right file. All other calls go to the wrapped client
+    unchanged.
+
+    The caom2pipe StorageClientWrapper.put changes the process working directory for the duration of the call, so the
+    puts run one at a time, in the same background thread, whether they were prefetched or not.
+
+    An upload that is prefetched uses the arguments of the most recent put, so it is the same call the store executor
+    makes. If the put for the file then has different arguments, the file is put again, with those arguments.
+
+    The background thread is started on the first put, so that a runner that forks worker processes starts one thread
+    per worker.
+    """
+
+    def __init__(self, client, lookahead):
+        self._client = client
+        self._lookahead = lookahead
+        # uri: (future, args, kwargs) for the uploads that have been prefetched, but not put
+        self._pending = {}
+        # the arguments of the most recent put, after working_directory and uri
+        self._put_args = ((), {})
+        self._lock = threading.Lock()
+        self._executor = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def lookahead(self):
+        return self._lookahead
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return len([ii for ii, _, _ in self._pending.values() if not ii.done()])
+
+    def prefetch(self, source_name, uri):
+        """
+        Start the upload of a file, if it's not already underway.
+
+        :param source_name: str fully-qualified name of the file on local disk
+        :param uri: str CADC storage destination
+        """
+        with self._lock:
+            if uri not in self._pending:
+                args, kwargs = self._put_args
+                self._pending[uri] = (self._submit(dirname(source_name), uri, args, kwargs), args, kwargs)
+
+    def put(self, working_directory, uri, *args, **kwargs):
+        with self._lock:
+            self._put_args = (args, kwargs)
+            pending = self._pending.pop(uri, None)
+            if pending is None:
+                future = self._submit(working_directory, uri, args, kwargs)
+        if pending is not None:
+            future, prefetch_args, prefetch_kwargs = pending
+            self._logger.debug(f'Wait for the transfer of {uri}.')
+            if (prefetch_args, prefetch_kwargs) != (args, kwargs):
+                self._logger.debug(f'Transfer {uri} again, with the arguments of the put.')
+                if not future.cancel():
+                    wait([future])
+                with self._lock:
+                    future = self._submit(working_directory, uri, args, kwargs)
+        return future.result()
+
+    def discard(self, uri):
+        """
+        Give up on a prefetched upload, because there will be no put for it - e.g. its entry was rejected, skipped, or
+        failed before it was stored. The upload is cancelled, if it has not started.
+
+        :param uri: str CADC storage destination
+        :return: True if the file was stored anyway, because its upload had already started
+        """
+        with self._lock:
+            pending = self._pending.pop(uri, None)
+        if pending is None or pending[0].cancel():
+            return False
+        try:
+            pending[0].result()
+            return True
+        except Exception as e:
+            self._logger.warning(f'Transfer of {uri} failed, and there is no put to report it against: {e}')
+            return False
+
+    def close(self):
+        """Cancel, or wait for, the prefetched uploads that were not put, and stop the background thread."""
+        with self._lock:
+            uris = list(self._pending.keys())
+        for uri in uris:
+            if self.discard(uri):
+                # the runner discards the uploads for each entry after it's processed, so this is unexpected
+                self._logger.warning(f'Stored {uri} with no entry to report it against.')
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _submit(self, working_directory, uri, args, kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transfer')
+        return self._executor.submit(self._put, working_directory, uri, args, kwargs)
+
+    def _put(self, working_directory, uri, args, kwargs):
+        self._logger.debug(f'Begin transfer of {uri}.')
+        result = self._client.put(working_directory, uri, *args, **kwargs)
+        self._logger.debug(f'End transfer of {uri}.')
+        return result